@@ -1,22 +1,155 @@
 # File: app/api.py
 # 为前端提供API接口
 import sys
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root))
 
-from backend.services import AuthService, BilibiliService, DownloadService, MusicService
-from backend.models.video import Video
-from core.config import DOWNLOAD_DIR
+from app.jobs import EventBus, JobManager, JobCancelled
+from core.bandwidth import BANDWIDTH, FOREGROUND, MIRROR, traffic_scope
+from core.config import BULK_WORKERS, LIBRARY_SIZE_BUDGET, MEDIA_SERVER_PORT, PLAY_TRACKING
+from core.cover_archive import ARCHIVE_PREFIX, COVER_ARCHIVE, is_archived
+from core.log import log_event
+from core.metrics import instrument_methods, REGISTRY
+from core.profiling import PROFILER
 import os
+import re
+import time
 
+@instrument_methods
 class Api:
-    def __init__(self):
-        self.auth_service = AuthService()
-        self.bilibili_service = BilibiliService(self.auth_service)
-        self.download_service = DownloadService(self.auth_service)
-        self.music_service = MusicService()
+    # 服务在第一次使用时才创建（见 __getattr__），导入和构造 Api 时不加载会话、音乐库和 requests 等依赖
+    _SERVICE_FACTORIES = {
+        'auth_service': '_create_auth_service',
+        'bilibili_service': '_create_bilibili_service',
+        'download_service': '_create_download_service',
+        'music_service': '_create_music_service',
+        'content_index': '_create_content_index',
+        'play_history': '_create_play_history',
+        'library_budget': '_create_library_budget',
+        'prefetcher': '_create_prefetcher',
+        'library_verifier': '_create_library_verifier',
+    }
+
+    def __init__(self, headless=False, max_workers=4, warm_up=True):
+        self._service_locks = {name: threading.Lock() for name in self._SERVICE_FACTORIES}
+        # 事件通道与任务管理器使用下划线命名，避免被 pywebview 暴露给前端
+        # 无界面模式（cli.py）下事件只交给监听器输出，不推送给窗口
+        self._events = EventBus(push_to_window=not headless)
+        self._jobs = JobManager(self._events, max_workers=max_workers)
+        self._login_watch_key = None
+        self._headless = headless
+        self._downloaded_bvids_cache = None
+        if warm_up:
+            # 窗口渲染期间在后台加载音乐库和会话，前端第一次调用时通常已经就绪
+            threading.Thread(target=self._warm_up, name='api-warm-up', daemon=True).start()
+
+    def __getattr__(self, name):
+        # 只有实例上还没有该属性时才会调用；pywebview 生成前端接口时会读取所有公开属性，
+        # 用 property 会让服务在那时就被创建，因此改用 __getattr__ 按需创建
+        factory = type(self)._SERVICE_FACTORIES.get(name)
+        if factory is None:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+        with self._service_locks[name]:
+            if name not in self.__dict__:
+                self.__dict__[name] = getattr(self, factory)()
+        return self.__dict__[name]
+
+    def _create_auth_service(self):
+        from backend.services import AuthService
+        auth_service = AuthService()
+        # 后台定期刷新 Cookie，长时间运行无需重新扫码
+        auth_service.start_auto_refresh()
+        return auth_service
+
+    def _create_bilibili_service(self):
+        from backend.services import BilibiliService
+        return BilibiliService(self.auth_service)
+
+    def _create_download_service(self):
+        from backend.services import DownloadService
+        return DownloadService(self.auth_service, content_index=self.content_index)
+
+    def _create_content_index(self):
+        from backend.services import ContentIndex
+        return ContentIndex()
+
+    def _create_play_history(self):
+        from backend.services import PlayHistory
+        return PlayHistory()
+
+    def _create_library_budget(self):
+        from backend.services import LibraryBudget
+        return LibraryBudget(self.music_service, self.play_history, LIBRARY_SIZE_BUDGET).start()
+
+    def _create_prefetcher(self):
+        from backend.services import Prefetcher
+        return Prefetcher(self.music_service, self.bilibili_service, self.download_service)
+
+    def _create_library_verifier(self):
+        from backend.services import LibraryVerifier
+        return LibraryVerifier(self.music_service, self.content_index)
+
+    def _create_music_service(self):
+        from backend.services import MusicService
+        music_service = MusicService()
+        # 音乐库变化时只推送版本号，前端再按需拉取增量
+        music_service.add_change_listener(
+            lambda version: self._events.emit(
+                'library_changed',
+                {'version': version, 'epoch': music_service.epoch},
+                coalesce_key='library_changed'
+            )
+        )
+        return music_service
+
+    def _warm_up(self):
+        start = time.perf_counter()
+        try:
+            self.music_service
+            self.auth_service
+            if LIBRARY_SIZE_BUDGET is not None:
+                self.library_budget
+        except Exception as e:
+            print(f"后台初始化服务失败: {e}")
+            return
+        log_event('startup', phase='services_ready', elapsed_ms=round((time.perf_counter() - start) * 1000, 3))
+        if not self._headless:
+            # 补全已有文件的内容哈希；只计算新增或变化的文件，无界面模式下按需调用 index_content
+            self._jobs.submit('index_content', self._index_content)
+
+    def _shutdown(self):
+        """程序退出前把延迟写盘的状态写入磁盘"""
+        if 'play_history' in self.__dict__:
+            self.play_history.flush()
+        if 'content_index' in self.__dict__:
+            self.content_index.save()
+
+    def attach_window(self, window):
+        """绑定 pywebview 窗口，用于推送事件"""
+        self._events.attach_window(window)
+
+    # 任务相关方法
+    def get_job(self, job_id):
+        """查询任务状态"""
+        job = self._jobs.get(job_id)
+        if not job:
+            return {'status': 'error', 'message': '任务不存在'}
+        return {'status': 'ok', 'job': job.to_dict()}
+
+    def cancel_job(self, job_id):
+        """取消任务"""
+        if self._jobs.cancel(job_id):
+            return {'status': 'ok', 'message': '任务已取消'}
+        return {'status': 'error', 'message': '任务不存在或已结束'}
+
+    def list_jobs(self, _=None):
+        """列出正在运行的任务"""
+        return [job.to_dict() for job in self._jobs.active_jobs()]
 
     def ensure_login(self, _=None):
         """检查并确保用户已登录"""
@@ -28,9 +161,9 @@ class Api:
         if not qrcode_data:
             return {'status': 'error', 'message': '获取登录二维码失败'}
 
-        # 启动一个线程来轮询登录状态
-        # 注意：在实际应用中，这里应该有更好的方式来处理异步和线程间通信
-        # 但对于pywebview的简单场景，我们可以直接返回二维码
+        # 在后台任务中轮询登录状态，状态变化通过 login_status 事件推送
+        self._login_watch_key = qrcode_data['qrcode_key']
+        self._jobs.submit('login_watch', self._watch_login, qrcode_data['qrcode_key'])
         return {
             'status': 'qrcode',
             'message': '请扫描二维码登录',
@@ -46,65 +179,731 @@ class Api:
         # 后端直接返回字典，前端直接透传
         return self.auth_service.poll_login_status(qrcode_key)
 
-    def get_favorites(self, force_refresh=False):
-        """获取收藏夹，带缓存和强制刷新"""
-        favorites = self.bilibili_service.get_favorites(force_refresh)
-        if favorites is not None:
-            return {'status': 'ok', 'favorites': favorites}
+    def _watch_login(self, job, qrcode_key, interval=2, timeout=180):
+        """后台轮询二维码状态，直到登录成功、二维码失效或超时"""
+        deadline = time.time() + timeout
+        last_status = None
+        while time.time() < deadline:
+            # 新的二维码生成后，旧的轮询任务自行退出
+            if job.cancelled or self._login_watch_key != qrcode_key:
+                raise JobCancelled()
+            result = self.auth_service.poll_login_status(qrcode_key)
+            if result['status'] != last_status:
+                last_status = result['status']
+                job.emit('login_status', result)
+            if result['status'] in ('ok', 'expired', 'error'):
+                return result
+            time.sleep(interval)
+        result = {'status': 'expired', 'message': '二维码已超时'}
+        job.emit('login_status', result)
+        return result
+
+    def get_favorite_folders(self, force_refresh=False):
+        """获取收藏夹列表（不含视频），带缓存和强制刷新；立即返回 job_id，结果通过 job_done 事件推送"""
+        return self._jobs.ticket('get_favorite_folders', self._get_favorite_folders, force_refresh)
+
+    def _get_favorite_folders(self, job, force_refresh=False):
+        job.progress(message='正在获取收藏夹')
+        folders = self.bilibili_service.get_favorite_folders(
+            force_refresh,
+            progress_callback=lambda done, total, title: job.progress(done, total, title or '正在获取收藏夹')
+        )
+        if folders is not None:
+            return {'status': 'ok', 'folders': folders}
         else:
             return {'status': 'error', 'message': '获取收藏夹失败'}
 
+    def get_favorite_videos(self, folder_id, cursor=0, limit=None):
+        """分页读取一个收藏夹的视频；返回本页视频、下一页的 cursor（没有更多时为 null）和总数"""
+        if self.bilibili_service.favorites.get_folder(folder_id) is None:
+            return {'status': 'error', 'message': '收藏夹不存在，请刷新收藏夹'}
+        page = self.bilibili_service.favorites.get_page(folder_id, cursor, limit)
+        return {'status': 'ok', **page}
+
+    def search_favorites(self, query=None):
+        """在本地保存的收藏夹中搜索和筛选
+
+        query 字段：keyword（标题关键字）、min_duration / max_duration（秒）、downloaded（true/false，
+        是否已在音乐库中）、folder_id、cursor、limit。
+        """
+        query = query or {}
+        # 前端传来的数字可能是字符串，这里统一转换，无效时返回错误而不是在搜索中抛出异常
+        durations = {}
+        for field in ('min_duration', 'max_duration'):
+            value = query.get(field)
+            if value is None or value == '':
+                durations[field] = None
+                continue
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                return {'status': 'error', 'message': f'时长筛选无效: {value}'}
+            if not 0 <= value < float('inf'):
+                return {'status': 'error', 'message': f'时长筛选必须为非负数: {value:g}'}
+            durations[field] = value
+        try:
+            cursor = int(query.get('cursor') or 0)
+            limit = int(query['limit']) if query.get('limit') else None
+        except (TypeError, ValueError):
+            return {'status': 'error', 'message': f"无效的分页参数: cursor={query.get('cursor')}, limit={query.get('limit')}"}
+        downloaded = query.get('downloaded')
+        result = self.bilibili_service.favorites.search(
+            keyword=query.get('keyword'),
+            min_duration=durations['min_duration'],
+            max_duration=durations['max_duration'],
+            downloaded=downloaded,
+            downloaded_bvids=self._downloaded_bvids() if downloaded is not None else None,
+            folder_id=query.get('folder_id'),
+            cursor=cursor,
+            limit=limit
+        )
+        return {'status': 'ok', **result}
+
+    def _downloaded_bvids(self):
+        """音乐库中已有的 BV 号集合，音乐库版本不变时复用"""
+        music_service = self.music_service
+        key = (music_service.epoch, music_service.version)
+        cached = self._downloaded_bvids_cache
+        if cached is None or cached[0] != key:
+            # 与 sync-favorites 的判断一致：音乐库中有记录即视为已下载（包括被磁盘预算移除的曲目）
+            bvids = {music.bv_id for music in list(music_service.music_library.values()) if music.bv_id}
+            cached = self._downloaded_bvids_cache = (key, bvids)
+        return cached[1]
+
     def load_video_info(self, url):
-        """加载视频信息"""
+        """加载视频信息；立即返回 job_id，结果通过 job_done 事件推送"""
         if not url:
             return {'status': 'error', 'message': 'URL不能为空'}
-        
+        return self._jobs.ticket('load_video_info', self._load_video_info, url)
+
+    def _load_video_info(self, job, url):
         video = self.bilibili_service.load_video_info(url)
         if video:
             return {'status': 'ok', 'video': video.to_dict()}
         else:
             return {'status': 'error', 'message': '获取视频信息失败'}
 
-    def download_audio(self, video_dict=None):
-        """根据视频信息字典下载音频"""
+    def resolve_videos(self, items=None):
+        """批量解析视频链接或 BV 号（列表，或以空白、逗号分隔的文本）；立即返回 job_id
+
+        每解析完一个视频推送一次 video_resolved 事件，全部完成后通过 job_done 返回汇总结果
+        """
+        if isinstance(items, str):
+            items = re.split(r'[\s,，]+', items)
+        items = [item for item in (items or []) if item and item.strip()]
+        if not items:
+            return {'status': 'error', 'message': '没有需要解析的视频'}
+        return self._jobs.ticket('resolve_videos', self._resolve_videos, items)
+
+    def _resolve_videos(self, job, items):
+        ids = [self.bilibili_service.normalize_video_id(item) for item in items]
+        total = len({video_id for video_id in ids if video_id}) + ids.count(None)
+        videos, failed = [], []
+        for result in self.bilibili_service.resolve_videos(items, cancel_check=lambda: job.cancelled):
+            job.check_cancelled()
+            (videos if result['status'] == 'ok' else failed).append(result)
+            job.emit('video_resolved', result)
+            job.progress(len(videos) + len(failed), total, result.get('id') or result['inputs'][0])
+        return {
+            'status': 'ok' if videos else 'error',
+            'message': f'解析成功 {len(videos)} 个，失败 {len(failed)} 个',
+            'videos': [result['video'] for result in videos],
+            'failed': [{'id': result['id'], 'inputs': result['inputs'], 'message': result['message']}
+                       for result in failed]
+        }
+
+    def download_audio(self, video_dict=None, parts=None, background=False):
+        """根据视频信息字典下载音频；立即返回 job_id，进度和结果通过事件推送
+
+        多P投稿默认下载全部分P，parts 可指定分P序号列表或 "1-3,5" 形式的范围；
+        background 为 True 时（批量下载、无人值守同步）计入后台流量，边下边播时让出带宽
+        """
+        from backend.models.video import parse_page_selection
+
         if not video_dict:
             return {'status': 'error', 'message': '无效的视频信息'}
-            
+        try:
+            parse_page_selection(parts)
+        except (TypeError, ValueError) as e:
+            return {'status': 'error', 'message': str(e) if isinstance(e, ValueError) else f'无效的分P选择: {parts}'}
+        return self._jobs.ticket('download_audio', self._download_audio, video_dict, parts, background)
+
+    def _download_audio(self, job, video_dict, parts=None, background=False):
+        with traffic_scope(MIRROR if background else FOREGROUND):
+            return self._download_video(job, video_dict, parts)
+
+    def _download_video(self, job, video_dict, parts=None):
+        from backend.models.video import Video, parse_page_selection
         video = Video.from_dict(video_dict)
-        music = self.download_service.download_audio(video)
+        job.progress(0, None, f'开始下载: {video.title}', bvid=video.bvid)
+        progress_callback = lambda done, total: job.progress(done, total, video.title, bvid=video.bvid)
+
+        if video.is_multi_part or parts:
+            if not video.pages:
+                # 收藏夹中的视频只有分P数量，需要先获取分P列表
+                video = self.bilibili_service.load_video_info(video.bvid)
+                if not video:
+                    return {'status': 'error', 'message': '获取分P列表失败'}
+            if video.is_multi_part:
+                return self._download_parts(job, video, parts, progress_callback)
+            ranges = parse_page_selection(parts)
+            if ranges is not None and not any(first <= 1 <= last for first, last in ranges):
+                return {'status': 'error', 'message': f'该视频只有 1 个分P，所选的分P不存在: {parts}'}
+
+        music = self.download_service.download_audio(
+            video,
+            progress_callback=progress_callback,
+            cancel_check=lambda: job.cancelled
+        )
+        self.content_index.save()
+        job.check_cancelled()
         if music:
+            self.music_service.upsert_music(music)
             return {'status': 'ok', 'message': f'音频已保存到 {music.file_path}', 'music': music.to_dict()}
         else:
             return {'status': 'error', 'message': '下载失败，请查看控制台日志'}
 
+    def _download_parts(self, job, video, parts, progress_callback):
+        """并行下载多P投稿的分P，每个分P作为同一专辑中的一首曲目入库"""
+        try:
+            results = self.download_service.download_parts(
+                video,
+                parts,
+                progress_callback=progress_callback,
+                cancel_check=lambda: job.cancelled
+            )
+        except ValueError as e:
+            return {'status': 'error', 'message': str(e)}
+        self.content_index.save()
+        job.check_cancelled()
+        if not results:
+            return {'status': 'error', 'message': f'没有选中任何分P: {parts}'}
+        tracks = [music for music in results if music]
+        for music in tracks:
+            self.music_service.upsert_music(music, save=False)
+        if tracks:
+            self.music_service.save_music_library()
+        if not tracks:
+            return {'status': 'error', 'message': '下载失败，请查看控制台日志'}
+        return {
+            'status': 'ok',
+            'message': f'{video.title}: 已下载 {len(tracks)}/{len(results)} 个分P',
+            'music': tracks[0].to_dict(),
+            'tracks': [music.to_dict() for music in tracks]
+        }
+
+    def index_content(self, _=None):
+        """计算音乐库中尚未建立索引的文件的内容哈希；立即返回 job_id"""
+        return self._jobs.ticket('index_content', self._index_content)
+
+    def _index_content(self, job):
+        tracks = [(music.file_path, music.cid) for music in list(self.music_service.music_library.values())]
+        stats = self.content_index.build(
+            tracks,
+            progress_callback=lambda done, total: job.progress(done, total, '正在计算文件哈希'),
+            cancel_check=lambda: job.cancelled
+        )
+        job.check_cancelled()
+        return {'status': 'ok', 'message': f"已索引 {stats['files']} 个文件，本次计算 {stats['hashed']} 个", **stats}
+
+    def get_duplicate_report(self, _=None):
+        """列出内容重复的音频及可释放的磁盘空间（会先补全索引）；立即返回 job_id"""
+        return self._jobs.ticket('duplicate_report', self._duplicate_report)
+
+    def _duplicate_report(self, job):
+        self._index_content(job)
+        report = self.content_index.duplicate_report()
+        report['status'] = 'ok'
+        report['message'] = f"重复文件 {report['duplicate_files']} 个，可释放 {report['reclaimable_readable']}"
+        return report
+
+    def migrate_to_tags(self, _=None):
+        """把已有曲目的 json 和封面文件转换为音频标签；立即返回 job_id，结果通过 job_done 事件推送"""
+        return self._jobs.ticket('migrate_to_tags', self._migrate_to_tags)
+
+    def _migrate_to_tags(self, job):
+        job.progress(message='正在把曲目信息写入音频标签')
+        result = self.music_service.migrate_to_tags(
+            content_index=self.content_index,
+            progress_callback=lambda done, total: job.progress(done, total, '正在把曲目信息写入音频标签'),
+            cancel_check=lambda: job.cancelled
+        )
+        if result is None:
+            return {'status': 'error', 'message': '需要安装 mutagen 才能写入音频标签'}
+        self.content_index.save()
+        return {
+            'status': 'ok' if not result['failed'] else 'error',
+            'message': f"已转换 {result['migrated']} 首，失败 {result['failed']} 首，"
+                       f"删除封面文件 {result['covers_removed']} 个",
+            **result
+        }
+
+    def migrate_layout(self, _=None):
+        """把位置不符合当前下载目录布局的曲目移到新位置（可中断，下次从未完成的部分继续）；立即返回 job_id"""
+        return self._jobs.ticket('migrate_layout', self._migrate_layout)
+
+    def _migrate_layout(self, job):
+        layout = self.music_service.layout
+        job.progress(message='正在整理下载目录')
+        # 正在播放的曲目本次不移动，留到下次迁移
+        play_history = self.play_history if PLAY_TRACKING else None
+        result = layout.migrate(
+            self.music_service,
+            content_index=self.content_index,
+            play_history=play_history,
+            skip={play_history.last_key} if play_history and play_history.last_key else None,
+            progress_callback=lambda done, total: job.progress(done, total, '正在整理下载目录'),
+            cancel_check=lambda: job.cancelled
+        )
+        if play_history is not None:
+            play_history.flush()
+        if result['moved'] and 'library_budget' in self.__dict__:
+            self.library_budget.resync()
+        job.check_cancelled()
+        return {
+            'status': 'ok' if not result['failed'] else 'error',
+            'message': f"已移动 {result['moved']} 首，失败 {result['failed']} 首，剩余 {result['remaining']} 首",
+            **result
+        }
+
+    def import_covers(self, _=None):
+        """把已有的 *_cover.* 封面文件导入封面归档，导入后删除封面文件；立即返回 job_id"""
+        return self._jobs.ticket('import_covers', self._import_covers)
+
+    def _import_covers(self, job):
+        job.progress(message='正在导入封面')
+        result = self.music_service.import_covers(
+            COVER_ARCHIVE,
+            save_info=self.download_service.save_music_info,
+            progress_callback=lambda done, total: job.progress(done, total, '正在导入封面'),
+            cancel_check=lambda: job.cancelled
+        )
+        job.check_cancelled()
+        return {
+            'status': 'ok' if not result['failed'] else 'error',
+            'message': f"已导入 {result['imported']} 首曲目的封面，失败 {result['failed']} 首，"
+                       f"删除封面文件 {result['covers_removed']} 个",
+            **result
+        }
+
+    def compact_cover_archive(self, _=None):
+        """整理封面归档：去掉已删除曲目的封面，回收空间；立即返回 job_id"""
+        return self._jobs.ticket('compact_cover_archive', self._compact_cover_archive)
+
+    def _compact_cover_archive(self, job):
+        from backend.services.content_index import format_size
+
+        job.progress(message='正在整理封面归档')
+        # 先记下归档大小，整理期间新下载的封面不会因为尚未记入音乐库而被丢弃
+        keep_from = COVER_ARCHIVE.status()['size']
+        self.music_service.scan_download_folder()
+        result = COVER_ARCHIVE.compact(self.music_service.archived_covers(), keep_from=keep_from)
+        return {
+            'status': 'ok',
+            'message': f"保留 {result['kept']} 张封面，移除 {result['removed']} 张，"
+                       f"释放 {format_size(result['reclaimed_bytes'])}",
+            **result
+        }
+
+    def get_cover_archive_status(self, _=None):
+        """查询封面归档中的封面数、pack 文件大小和可回收的空间"""
+        return {'status': 'ok', **COVER_ARCHIVE.status()}
+
+    def record_playback(self, file_path):
+        """前端开始播放曲目时调用，记录播放时间和次数（后台延迟写盘，立即返回）"""
+        if not PLAY_TRACKING:
+            return {'status': 'ok', 'message': '未开启播放记录'}
+        if not self.music_service.get_music_by_path(file_path):
+            return {'status': 'error', 'message': '音乐不在库中'}
+        entry = self.play_history.record(file_path)
+        self.library_budget.touch(str(file_path))
+        return {'status': 'ok', **entry}
+
+    def set_play_queue(self, file_paths=None):
+        """前端告知接下来要播放的曲目（按顺序，最多 PREFETCH_QUEUE_LENGTH 首），后台预取，立即返回"""
+        try:
+            queued = self.prefetcher.set_queue(file_paths)
+        except TypeError as e:
+            return {'status': 'error', 'message': str(e)}
+        return {'status': 'ok', 'queued': queued}
+
+    def get_stream_url(self, file_path):
+        """未下载或已被移除的曲目：解析播放地址后返回媒体服务器的边下边播地址，失败时返回 None
+
+        已在播放队列中预取过的曲目直接返回，开头部分从内存播放。
+        """
+        music = self.music_service.get_music_by_path(file_path)
+        if not music or not self.prefetcher.resolve_stream(music):
+            return None
+        return f"http://localhost:{MEDIA_SERVER_PORT}/stream/{self.music_service.layout.relative_url(music.file_path)}"
+
+    def get_media_cache_status(self, _=None):
+        """查询媒体服务器内存缓存的条目数、占用和预解析的播放地址数"""
+        from core.media_cache import MEDIA_CACHE
+        return {'status': 'ok', 'queue': self.prefetcher.queue() if 'prefetcher' in self.__dict__ else [],
+                **MEDIA_CACHE.status()}
+
+    def get_bandwidth_status(self, _=None):
+        """查询带宽上限（含时段规则）、各类流量的权重、正在传输的类别和当前分配的速率"""
+        BANDWIDTH.publish()
+        return {'status': 'ok', **BANDWIDTH.status()}
+
+    def set_bandwidth_limit(self, kb_per_second=None):
+        """设置下载总速率上限（KB/s），传 None 或 0 取消限制；时段规则命中时以规则为准"""
+        limit = None
+        if kb_per_second is not None and kb_per_second != '':
+            try:
+                kb_per_second = float(kb_per_second)
+            except (TypeError, ValueError):
+                return {'status': 'error', 'message': f'速率上限无效: {kb_per_second}'}
+            if not 0 <= kb_per_second < float('inf'):
+                return {'status': 'error', 'message': f'速率上限不能为负数: {kb_per_second:g}'}
+            limit = int(kb_per_second * 1024)
+        BANDWIDTH.set_limit(limit)
+        return {'status': 'ok', **BANDWIDTH.status()}
+
+    def get_library_budget(self, _=None):
+        """查询磁盘预算、当前占用和已移除的曲目数"""
+        return {'status': 'ok', **self.library_budget.status()}
+
+    def set_library_budget(self, megabytes=None):
+        """设置音乐库的磁盘预算（MB，须大于 0），传 None 取消限制；超出部分在后台按最近播放时间移除"""
+        budget = None
+        if megabytes is not None and megabytes != '':
+            try:
+                megabytes = float(megabytes)
+            except (TypeError, ValueError):
+                return {'status': 'error', 'message': f'磁盘预算无效: {megabytes}'}
+            if not 0 < megabytes < float('inf'):
+                return {'status': 'error', 'message': f'磁盘预算必须大于 0 MB（取消限制请传空值）: {megabytes:g}'}
+            budget = int(megabytes * 1024 * 1024)
+        self.library_budget.set_budget(budget)
+        return {'status': 'ok', **self.library_budget.status()}
+
+    def restore_music(self, file_path):
+        """重新下载因磁盘预算被移除的曲目，保持原来的文件名；立即返回 job_id"""
+        music = self.music_service.get_music_by_path(file_path)
+        if not music:
+            return {'status': 'error', 'message': '音乐不在库中'}
+        if not music.evicted and music.file_path.exists():
+            return {'status': 'ok', 'message': '音频文件已存在', 'music': self._music_to_client(music)}
+        return self._jobs.ticket('restore_music', self._restore_music, music)
+
+    def _restore_music(self, job, music):
+        restored, message = self._download_track(
+            music,
+            progress_callback=lambda done, total: job.progress(done, total, music.title, bvid=music.bv_id),
+            cancel_check=lambda: job.cancelled
+        )
+        self.content_index.save()
+        job.check_cancelled()
+        if not restored:
+            return {'status': 'error', 'message': message}
+        return {'status': 'ok', 'message': f'已重新下载 {music.title}', 'music': self._music_to_client(restored)}
+
+    def _download_track(self, music, progress_callback=None, cancel_check=None, reuse_existing=True):
+        """按曲目记录重新下载音频到原来的位置，保持原来的下载时间；返回 (新的 Music 或 None, 说明)"""
+        if not music.bv_id:
+            return None, f'缺少视频信息，无法重新下载: {music.title}'
+        video = self.bilibili_service.load_video_info(music.bv_id)
+        if not video:
+            return None, f'获取视频信息失败: {music.bv_id}'
+        if music.page:
+            page = next((page for page in video.pages if page['page'] == music.page), None)
+            if page is None:
+                return None, f'分P已不存在: {music.title}'
+            video = video.part_video(page)
+        restored = self.download_service.download_audio(
+            video,
+            filename=music.file_path.name,
+            output_dir=music.file_path.parent,
+            progress_callback=progress_callback,
+            cancel_check=cancel_check,
+            reuse_existing=reuse_existing
+        )
+        if not restored:
+            return None, f'重新下载失败: {music.title}'
+        # 保持原来的下载时间，曲目在列表中的位置不变
+        restored.download_time = music.download_time
+        self.download_service.save_music_info(restored)
+        self.music_service.upsert_music(restored)
+        return restored, f'已重新下载 {music.title}'
+
+    # 批量操作：名称 -> (处理方法, 说明)
+    BULK_OPERATIONS = {
+        'delete': ('_bulk_delete', '删除'),
+        'retag': ('_bulk_retag', '修改曲目信息'),
+        'move': ('_bulk_move', '移动'),
+        'redownload': ('_bulk_redownload', '重新下载'),
+    }
+
+    def bulk_music(self, operation, file_paths=None, options=None):
+        """对多首曲目执行同一操作，音乐库只写盘一次；立即返回 job_id，结果中逐首给出成功与否
+
+        - delete：删除音频、json 和封面
+        - retag：修改标题或专辑，options 为 {'title': ..., 'album': ...}（只修改给出的字段）
+        - move：移动到 options['folder'] 目录（相对路径视为下载目录下的子目录）
+        - redownload：重新下载到原来的位置
+        """
+        if operation not in self.BULK_OPERATIONS:
+            return {'status': 'error', 'message': f'未知的批量操作: {operation}'}
+        file_paths = list(dict.fromkeys(str(path) for path in file_paths or []))
+        if not file_paths:
+            return {'status': 'error', 'message': '没有选中任何曲目'}
+        options = options or {}
+        if operation == 'retag' and not any(options.get(field) for field in ('title', 'album')):
+            return {'status': 'error', 'message': '请给出要修改的标题或专辑'}
+        if operation == 'move' and not options.get('folder'):
+            return {'status': 'error', 'message': '请给出目标目录'}
+        return self._jobs.ticket('bulk_' + operation, self._bulk_music, operation, file_paths, options)
+
+    def _bulk_music(self, job, operation, file_paths, options):
+        method, label = self.BULK_OPERATIONS[operation]
+        start = time.perf_counter()
+        progress_callback = lambda done, total: job.progress(done, total, f'正在{label}')
+        job.progress(0, len(file_paths), f'正在{label}')
+        with self.music_service.transaction():
+            results = getattr(self, method)(file_paths, options, progress_callback, lambda: job.cancelled)
+        if operation in ('move', 'redownload'):
+            self.content_index.save()
+        succeeded = sum(1 for result in results if result['status'] == 'ok')
+        log_event('bulk_music', operation=operation, tracks=len(file_paths), succeeded=succeeded,
+                  duration_ms=round((time.perf_counter() - start) * 1000, 3))
+        return {
+            'status': 'ok' if succeeded == len(results) else 'error',
+            'message': f'{label}: 成功 {succeeded} 首，失败 {len(results) - succeeded} 首',
+            'succeeded': succeeded,
+            'failed': len(results) - succeeded,
+            'results': results
+        }
+
+    def _bulk_items(self, file_paths, handle, progress_callback, cancel_check, thread_name):
+        """并行处理多首曲目，handle(key, music) 返回单首的结果；返回与 file_paths 顺序一致的结果列表"""
+        def run(key):
+            music = self.music_service.get_music_by_path(key)
+            if music is None:
+                return {'file_path': key, 'status': 'error', 'message': '音乐不在库中'}
+            if cancel_check():
+                return {'file_path': key, 'status': 'error', 'message': '已取消'}
+            try:
+                return handle(key, music)
+            except Exception as e:
+                return {'file_path': key, 'status': 'error', 'message': str(e)}
+
+        results = []
+        workers = min(len(file_paths), BULK_WORKERS)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=thread_name) as executor:
+            for index, result in enumerate(executor.map(run, file_paths), 1):
+                results.append(result)
+                progress_callback(index, len(file_paths))
+        return results
+
+    def _bulk_delete(self, file_paths, options, progress_callback, cancel_check):
+        results = self.music_service.delete_music_files(file_paths, progress_callback=progress_callback)
+        if 'play_history' in self.__dict__:
+            for result in results:
+                if result['status'] == 'ok':
+                    self.play_history.forget(result['file_path'])
+        return results
+
+    def _bulk_retag(self, file_paths, options, progress_callback, cancel_check):
+        from backend.models.music import Music
+
+        fields = {field: options[field] for field in ('title', 'album') if options.get(field)}
+
+        def retag(key, music):
+            updated = Music.from_dict(dict(music.to_dict(), **fields))
+            if not music.evicted:
+                # 写入 json 或音频标签（tags 方式下同时更新内容哈希）
+                self.download_service.save_music_info(updated)
+            self.music_service.upsert_music(updated, save=False)
+            return {'file_path': key, 'status': 'ok', 'message': f'{updated.title} 已更新'}
+
+        return self._bulk_items(file_paths, retag, progress_callback, cancel_check, 'bulk-retag')
+
+    def _bulk_move(self, file_paths, options, progress_callback, cancel_check):
+        layout = self.music_service.layout
+        folder = Path(options['folder'])
+        if not folder.is_absolute():
+            folder = layout.root / folder
+        folder.mkdir(parents=True, exist_ok=True)
+        selected = set(file_paths)
+        # 多P投稿的共用封面还有未移动的分P在用时，复制一份到新位置
+        shared_covers = Counter(music.cover_path for key, music in list(self.music_service.music_library.items())
+                                if music.cover_path and key not in selected)
+        play_history = self.play_history if 'play_history' in self.__dict__ else None
+        lock = threading.Lock()
+
+        def move(key, music):
+            target = folder / music.file_path.name
+            if target == music.file_path:
+                return {'file_path': key, 'status': 'ok', 'message': '已在目标目录中', 'new_file_path': key}
+            # 同一批中的分P共用封面，移动封面时互斥
+            with lock:
+                moved = layout.move_track(music, target, keep_cover=bool(shared_covers[music.cover_path]))
+            if moved is None:
+                return {'file_path': key, 'status': 'error', 'message': f'移动失败（文件缺失或目标已存在）: {music.title}'}
+            self.music_service.move_music(key, moved, save=False)
+            self.content_index.move(key, moved.file_path)
+            if play_history is not None:
+                play_history.rename(key, moved.file_path)
+            return {'file_path': key, 'status': 'ok', 'message': f'{music.title} 已移动', 'new_file_path': str(target)}
+
+        results = self._bulk_items(file_paths, move, progress_callback, cancel_check, 'bulk-move')
+        if 'library_budget' in self.__dict__ and any(result['status'] == 'ok' for result in results):
+            self.library_budget.resync()
+        return results
+
+    def _bulk_redownload(self, file_paths, options, progress_callback, cancel_check):
+        def redownload(key, music):
+            with traffic_scope(MIRROR):
+                restored, message = self._download_track(music, cancel_check=cancel_check, reuse_existing=False)
+            if not restored:
+                return {'file_path': key, 'status': 'error', 'message': message}
+            return {'file_path': key, 'status': 'ok', 'message': message}
+
+        return self._bulk_items(file_paths, redownload, progress_callback, cancel_check, 'bulk-download')
+
+    def verify_library(self, repair=True, full=False, clean=False):
+        """校验音乐库文件是否完整，立即返回 job_id
+
+        repair 为 True 时，音频缺失、被截断或损坏的曲目在发现时立即放入重新下载队列，封面缺失的重新下载封面；
+        full 为 True 时忽略校验缓存并对每个文件计算完整哈希；clean 为 True 时删除孤立的 json 和临时文件，
+        并移除音频已缺失且无法重新下载的记录。
+        """
+        return self._jobs.ticket('verify_library', self._verify_library, repair, full, clean)
+
+    def _verify_library(self, job, repair, full, clean):
+        self.music_service.scan_download_folder()
+        repair_jobs = []
+
+        def on_broken(music, problem):
+            if not repair:
+                return
+            # 无界面模式在校验结束后才逐个等待修复任务，结果保留到被取走；界面通过 job_done 事件得到结果
+            job_id = self._jobs.submit('repair_track', self._repair_track, problem['file_path'], problem['repair'],
+                                       retain=self._headless)
+            problem['job_id'] = job_id
+            repair_jobs.append(job_id)
+
+        report = self.library_verifier.verify(
+            full=full,
+            on_broken=on_broken,
+            progress_callback=lambda done, total: job.progress(done, total, '正在校验音乐库'),
+            cancel_check=lambda: job.cancelled
+        )
+        job.check_cancelled()
+        cleaned = self.library_verifier.clean(report) if clean else None
+        problems = len(report['problems'])
+        message = f"检查 {report['checked']} 首（{report['cached']} 首未变化），发现 {problems} 个问题"
+        if report['orphans']:
+            message += f"，孤立文件 {len(report['orphans'])} 个"
+        if repair_jobs:
+            message += f"，已加入修复队列 {len(repair_jobs)} 首"
+        return {'status': 'ok', 'message': message, **report, 'repair_jobs': repair_jobs, 'cleaned': cleaned}
+
+    def _repair_track(self, job, file_path, repair):
+        """修复校验发现的问题：重新下载音频（按镜像类别限速）或只重新下载封面"""
+        music = self.music_service.get_music_by_path(file_path)
+        if music is None:
+            return {'status': 'error', 'message': '音乐不在库中'}
+        if repair == 'cover':
+            cover = self.download_service.fetch_cover(music.pic)
+            if cover is None:
+                return {'status': 'error', 'message': f'重新下载封面失败: {music.title}'}
+            if is_archived(music.cover_path):
+                from backend.models.music import Music
+                # 新建记录而不是修改库中的对象，upsert_music 才能比较出变化、保存音乐库并通知客户端
+                repaired = Music.from_dict(dict(music.to_dict(),
+                                                cover_path=COVER_ARCHIVE.put(cover[0], ext=cover[1])))
+                self.download_service.save_music_info(repaired)
+                self.music_service.upsert_music(repaired)
+            else:
+                with open(music.cover_path, 'wb') as f:
+                    f.write(cover[0])
+            return {'status': 'ok', 'message': f'已重新下载封面 {music.title}'}
+        with traffic_scope(MIRROR):
+            restored, message = self._download_track(
+                music,
+                progress_callback=lambda done, total: job.progress(done, total, music.title, bvid=music.bv_id),
+                cancel_check=lambda: job.cancelled,
+                reuse_existing=False
+            )
+        self.content_index.save()
+        job.check_cancelled()
+        return {'status': 'ok' if restored else 'error', 'message': message}
+
+    def export_library(self, target, layout='mirror', playlists=False, delete=True, link=True):
+        """把音乐库增量导出到外部目录（手机、NAS 等），立即返回 job_id
+
+        layout 为 mirror（保持下载目录结构）或 album（专辑/曲目）；playlists 为 True 时为每个收藏夹写 M3U 播放列表；
+        delete 为 True 时删除上次导出而音乐库中已没有的文件；link 为 True 时同一文件系统上使用 reflink 或硬链接。
+        """
+        from backend.services.library_export import EXPORT_LAYOUTS
+
+        if not target:
+            return {'status': 'error', 'message': '请给出导出目录'}
+        if layout not in EXPORT_LAYOUTS:
+            return {'status': 'error', 'message': f'未知的导出布局: {layout}'}
+        return self._jobs.ticket('export_library', self._export_library, str(target), layout, playlists, delete, link)
+
+    def _export_library(self, job, target, layout, playlists, delete, link):
+        from backend.services import LibraryExporter
+
+        self.music_service.scan_download_folder()
+        favorites = self.bilibili_service.favorites if playlists else None
+        exporter = LibraryExporter(self.music_service, self.content_index, favorites)
+        result = exporter.export(
+            target, layout, playlists, delete, link,
+            progress_callback=lambda done, total: job.progress(done, total, '正在导出'),
+            cancel_check=lambda: job.cancelled
+        )
+        job.check_cancelled()
+        transferred = result['copied'] + result['reflinked'] + result['hardlinked']
+        message = (f"已导出到 {target}：新增或更新 {transferred} 个文件，改名 {result['moved']} 个，"
+                   f"未变化 {result['unchanged']} 个，删除 {result['deleted']} 个")
+        if result['failed']:
+            message += f"，失败 {result['failed']} 个"
+        return {'status': 'ok' if not result['failed'] else 'error', 'message': message, **result}
+
     def get_music_library(self, _=None):
         """获取音乐库中的所有音乐信息"""
         music_list = self.music_service.get_all_music()
-        
-        # 为每个音乐对象添加 cover_url
-        for music in music_list:
+        return [self._music_to_client(music) for music in music_list]
+
+    def get_music_library_changes(self, since_version=None, epoch=None):
+        """获取客户端已知版本之后的音乐库变更，版本过旧时返回完整快照"""
+        result = self.music_service.get_changes_since(since_version, epoch)
+        if result['full']:
+            result['music'] = [self._music_to_client(music) for music in result['music']]
+        else:
+            result['changes'] = [
+                {**change, 'music': self._music_to_client(change['music']) if change['music'] else None}
+                for change in result['changes']
+            ]
+        return result
+
+    def _music_to_client(self, music):
+        """为音乐对象添加 cover_url 并转换为前端使用的字典"""
+        if music.cover_embedded and not music.cover_path:
+            # 封面在音频标签中，由媒体服务器从音频文件中读取
+            relative_url = self.music_service.layout.relative_url(music.file_path)
+            music.cover_url = f"http://localhost:{MEDIA_SERVER_PORT}/cover/{relative_url}"
+        else:
             music.cover_url = self.get_media_url(music.cover_path)
-            
-        return [music.to_dict_with_cover_url() for music in music_list]
+        return music.to_dict_with_cover_url()
 
     def get_media_url(self, file_path):
         """将本地媒体文件路径转换为可访问的Flask URL"""
         if not file_path:
             return None
-        
-        from pathlib import Path
-        file_path = Path(file_path)
-        # 只获取文件名，因为服务器知道根目录
-        file_name = file_path.name
-        
-        # 返回指向 Flask 路由的 URL
-        return f"http://localhost:8765/media/{file_name}"
+        # 封面归档中的封面按内容哈希从 /covers/ 读取
+        if is_archived(file_path):
+            return f"http://localhost:{MEDIA_SERVER_PORT}/covers/{str(file_path)[len(ARCHIVE_PREFIX):]}"
+
+        # 相对于下载目录的路径（分片布局下含子目录），服务器按同一布局解析
+        return f"http://localhost:{MEDIA_SERVER_PORT}/media/{self.music_service.layout.relative_url(file_path)}"
 
-    def refresh_music_library(self, _=None):
-        """刷新音乐库"""
-        self.music_service.scan_download_folder()
-        return self.get_music_library()
-    
     def download_audio_wrap(self, bv_id):
         video = self.bilibili_service.load_video_info(bv_id)
         if not video:
@@ -126,22 +925,47 @@ class Api:
     
     def delete_music(self, file_path):
         """删除音乐文件"""
-        return self.music_service.delete_music_file(file_path)
+        result = self.music_service.delete_music_file(file_path)
+        if result['status'] == 'ok' and 'play_history' in self.__dict__:
+            self.play_history.forget(file_path)
+        return result
     
+    def get_metrics(self, _=None):
+        """获取所有指标的当前值（Prometheus 格式见媒体服务器的 /metrics）"""
+        return REGISTRY.snapshot()
+
+    def start_profile(self, duration=30, mode='all'):
+        """开始性能采集：mode 为 all（栈采样 + cProfile）、sample 或 cprofile，结果写入 data/profiles"""
+        return PROFILER.start(duration, mode)
+
+    def stop_profile(self, _=None):
+        """提前结束性能采集并写出结果"""
+        return PROFILER.stop()
+
+    def get_profile_status(self, _=None):
+        """查询性能采集状态及最近一次结果文件"""
+        return PROFILER.status()
+
+    def get_transport_stats(self, _=None):
+        """获取各主机的请求耗时（DNS/连接/TLS/首字节/传输）和连接复用统计"""
+        return self.auth_service.transport.stats.snapshot()
+
     def get_music_statistics(self):
         """获取音乐库统计信息"""
         return self.music_service.get_statistics()
     
-    def refresh_music_library(self):
-        """刷新音乐库（扫描新文件）"""
+    def refresh_music_library(self, _=None):
+        """刷新音乐库（扫描新文件）；立即返回 job_id，扫描结果通过 job_done 事件推送"""
+        return self._jobs.ticket('refresh_music_library', self._refresh_music_library)
+
+    def _refresh_music_library(self, job):
         new_files = self.music_service.scan_download_folder()
-        return len(new_files)  # 返回新发现的文件数量
+        return {'status': 'ok', 'count': len(new_files)}  # 返回新发现的文件数量
     
     def get_audio_file_url(self, file_path):
         """获取音频文件的可访问URL"""
         import os
         import urllib.parse
-        from core.config import DOWNLOAD_DIR
         
         # 检查文件是否存在
         if not os.path.exists(file_path):
@@ -149,15 +973,12 @@ class Api:
             
         try:
             # 获取相对于下载目录的路径
-            download_dir = Path(DOWNLOAD_DIR)
+            layout = self.music_service.layout
             file_path_obj = Path(file_path)
             
             # 如果文件在下载目录中，使用本地服务器
-            if download_dir in file_path_obj.parents or download_dir == file_path_obj.parent:
-                relative_path = file_path_obj.name
-                # 使用本地HTTP服务器的URL
-                encoded_path = urllib.parse.quote(relative_path)
-                return f"http://localhost:8765/media/{encoded_path}"
+            if layout.root in file_path_obj.parents:
+                return f"http://localhost:{MEDIA_SERVER_PORT}/media/{layout.relative_url(file_path_obj)}"
             else:
                 # 如果文件不在下载目录中，尝试file协议
                 abs_path = os.path.abspath(file_path)
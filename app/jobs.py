@@ -0,0 +1,283 @@
+# File: app/jobs.py
+# 后台任务与事件推送：耗时操作在后台线程池中执行，进度和结果通过 evaluate_js 推送给前端
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from core.config import LONG_JOB_WORKERS
+from core.log import correlation_scope, log_event
+from core.metrics import JOBS, JOB_DURATION, JOB_QUEUE_DEPTH
+from core.profiling import PROFILER
+
+
+class EventBus:
+    """后端事件通道
+
+    事件先进入队列，由推送线程按帧（约 16ms）合并后一次性通过
+    window.evaluate_js 交给前端；带 coalesce_key 的事件在同一帧内只保留最新一条。
+    """
+
+    FRAME_INTERVAL = 1 / 60
+
+    def __init__(self, push_to_window=True):
+        # 无界面模式下没有窗口，事件只交给监听器，不再排队等待推送
+        self.push_to_window = push_to_window
+        self._window = None
+        self._lock = threading.Lock()
+        self._pending = []
+        self._coalesce_index = {}
+        self._listeners = []
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def attach_window(self, window):
+        """绑定 pywebview 窗口，之后开始向前端推送事件"""
+        self._window = window
+        self._ensure_thread()
+        self._wakeup.set()
+
+    def subscribe(self, callback):
+        """注册事件监听器（无界面模式下用于输出进度），callback(event)"""
+        self._listeners.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def emit(self, event_type, data=None, coalesce_key=None):
+        """发布事件；coalesce_key 相同的事件在同一帧内合并为最后一条"""
+        event = {'type': event_type, 'data': data, 'ts': time.time()}
+
+        for listener in list(self._listeners):
+            try:
+                listener(event)
+            except Exception as e:
+                print(f"事件监听器执行失败: {e}")
+
+        if not self.push_to_window:
+            return
+
+        with self._lock:
+            if coalesce_key is not None and coalesce_key in self._coalesce_index:
+                self._pending[self._coalesce_index[coalesce_key]] = event
+            else:
+                if coalesce_key is not None:
+                    self._coalesce_index[coalesce_key] = len(self._pending)
+                self._pending.append(event)
+
+        if self._window is not None:
+            self._ensure_thread()
+            self._wakeup.set()
+
+    def flush(self):
+        """立即把当前积压的事件批量推送给前端"""
+        with self._lock:
+            if not self._pending or self._window is None:
+                return
+            events = self._pending
+            self._pending = []
+            self._coalesce_index = {}
+
+        payload = json.dumps(events, ensure_ascii=False, default=str)
+        try:
+            self._window.evaluate_js(f"window.__bilibiliEvents && window.__bilibiliEvents({payload})")
+        except Exception as e:
+            print(f"推送事件到前端失败: {e}")
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='event-bus', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            # 等待一帧，让同一帧内产生的事件合并成一批
+            time.sleep(self.FRAME_INTERVAL)
+            self.flush()
+
+
+class JobCancelled(Exception):
+    """任务被取消"""
+
+
+class Job:
+    """单个后台任务，任务函数通过它汇报进度和检查取消状态"""
+
+    def __init__(self, job_id, kind, bus):
+        self.id = job_id
+        self.kind = kind
+        self.status = 'pending'
+        self.result = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        # 结束后保留结果，直到被 wait 取走（不参与已完成任务的清理）
+        self.retained = False
+        self._bus = bus
+        self._cancel_event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def check_cancelled(self):
+        """在任务的循环中调用，已取消时抛出 JobCancelled"""
+        if self.cancelled:
+            raise JobCancelled()
+
+    def progress(self, current=None, total=None, message=None, **extra):
+        """汇报进度，同一任务的进度事件每帧只推送最新一条"""
+        data = {'job_id': self.id, 'kind': self.kind, 'current': current, 'total': total, 'message': message}
+        data.update(extra)
+        self._bus.emit('job_progress', data, coalesce_key=f'progress:{self.id}')
+
+    def emit(self, event_type, data=None, coalesce_key=None):
+        """以本任务的名义发布自定义事件"""
+        payload = {'job_id': self.id, 'kind': self.kind}
+        if data:
+            payload.update(data)
+        self._bus.emit(event_type, payload, coalesce_key=coalesce_key)
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'result': self.result,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at
+        }
+
+
+# 轮询类任务：大部分时间在等待，单独一个线程运行，不会被其他任务挡住
+POLLING_JOB_KINDS = frozenset({'login_watch'})
+# 耗时较长的任务：在单独的线程池中运行，普通任务（下载、加载视频信息等）不必排在它们后面
+LONG_JOB_KINDS = frozenset({
+    'index_content', 'migrate_to_tags', 'migrate_layout', 'import_covers', 'compact_cover_archive',
+    'verify_library', 'export_library',
+})
+
+
+class JobManager:
+    """在线程池中运行任务，完成后推送 job_done 事件
+
+    普通任务共用 max_workers 个线程；耗时较长的任务（LONG_JOB_KINDS）和轮询任务（POLLING_JOB_KINDS）
+    各有自己的线程池，一次长时间的导出或迁移不会让登录轮询和下载一直排队。
+    """
+
+    def __init__(self, bus, max_workers=4, keep_finished=200, long_workers=LONG_JOB_WORKERS):
+        self.bus = bus
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self.long_executor = ThreadPoolExecutor(max_workers=long_workers, thread_name_prefix='job-long')
+        self.polling_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='job-poll')
+        self.keep_finished = keep_finished
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind, func, *args, retain=False, **kwargs):
+        """提交任务，立即返回 job_id；func 的第一个参数为 Job 对象
+
+        retain 为 True 时任务结束后一直保留结果，直到被 wait 取走；用于提交后要过一段时间才逐个等待的任务，
+        否则期间提交的其他任务可能已把它从已完成的任务中清理掉。
+        """
+        job = Job(uuid.uuid4().hex[:12], kind, self.bus)
+        job.retained = retain
+        with self._lock:
+            self._jobs[job.id] = job
+            self._trim()
+        JOB_QUEUE_DEPTH.inc(state='pending')
+        # 在提交方的关联ID下记录 job_id，把前端调用和后台任务串起来
+        log_event('job_submit', kind=kind, job_id=job.id)
+        self._executor_for(kind).submit(self._run, job, func, args, kwargs)
+        return job.id
+
+    def _executor_for(self, kind):
+        if kind in POLLING_JOB_KINDS:
+            return self.polling_executor
+        if kind in LONG_JOB_KINDS:
+            return self.long_executor
+        return self.executor
+
+    def ticket(self, kind, func, *args, **kwargs):
+        """提交任务并返回给前端的占位结果"""
+        job_id = self.submit(kind, func, *args, **kwargs)
+        return {'status': 'pending', 'job_id': job_id}
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if not job or job.status in ('done', 'failed', 'cancelled'):
+            return False
+        job.cancel()
+        return True
+
+    def active_jobs(self):
+        with self._lock:
+            return [job for job in self._jobs.values() if job.status in ('pending', 'running')]
+
+    def wait(self, job_id, timeout=None):
+        """阻塞等待任务完成（无界面模式使用），返回任务结果"""
+        deadline = None if timeout is None else time.time() + timeout
+        job = self.get(job_id)
+        while job and job.status in ('pending', 'running'):
+            if deadline is not None and time.time() > deadline:
+                break
+            time.sleep(0.05)
+        if job is None:
+            return None
+        if job.finished_at is not None:
+            # 结果已取走，之后按普通任务清理
+            with self._lock:
+                job.retained = False
+        return job.result
+
+    def _run(self, job, func, args, kwargs):
+        JOB_QUEUE_DEPTH.dec(state='pending')
+        # 任务内的日志都带上 job_id 作为关联ID
+        with correlation_scope(job.id):
+            if job.cancelled:
+                self._finish(job, 'cancelled', {'status': 'cancelled', 'message': '任务已取消'})
+                return
+            job.status = 'running'
+            job.started_at = time.time()
+            JOB_QUEUE_DEPTH.inc(state='running')
+            log_event('job_start', kind=job.kind, job_id=job.id)
+            try:
+                result = PROFILER.call(func, job, *args, **kwargs)
+                self._finish(job, 'done', result)
+            except JobCancelled:
+                self._finish(job, 'cancelled', {'status': 'cancelled', 'message': '任务已取消'})
+            except Exception as e:
+                print(f"任务 {job.kind}({job.id}) 执行失败: {e}")
+                self._finish(job, 'failed', {'status': 'error', 'message': str(e)})
+            finally:
+                JOB_QUEUE_DEPTH.dec(state='running')
+
+    def _finish(self, job, status, result):
+        job.status = status
+        job.result = result
+        job.finished_at = time.time()
+        duration = job.finished_at - (job.started_at or job.created_at)
+        JOBS.inc(kind=job.kind, status=status)
+        JOB_DURATION.observe(duration, kind=job.kind)
+        log_event('job_done', kind=job.kind, job_id=job.id, status=status, duration_ms=round(duration * 1000, 3))
+        self.bus.emit('job_done', {'job_id': job.id, 'kind': job.kind, 'status': status, 'result': result})
+
+    def _trim(self):
+        finished = [j for j in self._jobs.values() if j.finished_at is not None and not j.retained]
+        if len(finished) <= self.keep_finished:
+            return
+        finished.sort(key=lambda j: j.finished_at)
+        for job in finished[:len(finished) - self.keep_finished]:
+            del self._jobs[job.id]
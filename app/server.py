@@ -1,11 +1,62 @@
 # File: app/media_server.py
-from flask import Flask, send_from_directory
+from flask import Flask, Response, abort, jsonify, request, send_file
+import mimetypes
 import os
+from core.bandwidth import BANDWIDTH, PLAYBACK
+from core.cover_archive import COVER_ARCHIVE, archive_key
+from core.media_cache import MEDIA_CACHE, READ_CHUNK_SIZE
+from core.metrics import REGISTRY
+from core.profiling import MAX_PROFILE_SECONDS, PROFILER
 
 app = Flask(__name__)
 
-@app.route('/media/<path:filename>')
-def serve_media(filename):
+@app.route('/metrics')
+def metrics():
+    """Prometheus 文本格式的指标"""
+    # 带宽分配随时段规则变化，输出前刷新一次
+    BANDWIDTH.publish()
+    return Response(REGISTRY.render_prometheus(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+def _check_debug_request(changes_state=False):
+    """调试接口只允许本机访问；会改变状态的接口还要拒绝来自其他网页的请求（CSRF）
+
+    浏览器中的网页向本机端口发起的跨站请求也来自 127.0.0.1，只能靠 Origin / Sec-Fetch-Site 区分：
+    带有 Origin 时必须与本服务器同源，Sec-Fetch-Site 只接受 same-origin 和 none（地址栏、curl 等不带这两个头）。
+    """
+    # 服务器监听所有地址，调试接口只允许本机访问
+    if request.remote_addr not in ('127.0.0.1', '::1'):
+        abort(403)
+    if not changes_state:
+        return
+    origin = request.headers.get('Origin')
+    if origin is not None and origin.rstrip('/') != request.host_url.rstrip('/'):
+        abort(403)
+    if request.headers.get('Sec-Fetch-Site', 'none') not in ('same-origin', 'none'):
+        abort(403)
+
+@app.route('/debug/profile', methods=['POST'])
+def debug_profile():
+    """开始性能采集，参数 seconds（默认 30，最长 MAX_PROFILE_SECONDS）和 mode（all/sample/cprofile）"""
+    _check_debug_request(changes_state=True)
+    try:
+        seconds = float(request.values.get('seconds', 30))
+    except ValueError:
+        seconds = None
+    if seconds is None or not 1 <= seconds <= MAX_PROFILE_SECONDS:
+        return jsonify({'status': 'error', 'message': f'seconds 参数应在 1 到 {MAX_PROFILE_SECONDS} 之间'}), 400
+    return jsonify(PROFILER.start(seconds, request.values.get('mode', 'all')))
+
+@app.route('/debug/profile/status')
+def debug_profile_status():
+    _check_debug_request()
+    return jsonify(PROFILER.status())
+
+@app.route('/debug/profile/stop', methods=['POST'])
+def debug_profile_stop():
+    _check_debug_request(changes_state=True)
+    return jsonify(PROFILER.stop())
+
+def _download_dir():
     # 从环境变量或配置中获取下载目录
     download_dir = os.environ.get('DOWNLOAD_DIR')
     if not download_dir:
@@ -13,8 +64,135 @@ def serve_media(filename):
         # 注意：这需要与主应用中的路径保持一致
         current_dir = os.path.dirname(os.path.abspath(__file__))
         download_dir = os.path.join(current_dir, '..', 'data', 'downloads')
-        
-    return send_from_directory(download_dir, filename)
+    return download_dir
+
+def _resolve(filename):
+    """按下载目录布局把 URL 中的相对路径（可含分片子目录）转换为文件，越界或不存在时返回 404"""
+    from backend.services.library_layout import LibraryLayout
+
+    path = LibraryLayout(_download_dir()).resolve(filename)
+    if path is None:
+        abort(404)
+    return path
+
+def _range_response(head, size, mimetype, read_rest):
+    """先从内存中的开头部分返回，其余部分由 read_rest(offset, length) 返回的迭代器逐块产出；支持单个 Range 请求
+
+    read_rest 在发送状态行之前调用，返回 None 时（如远程地址已失效）返回 502，而不是发出被截断的响应。
+    """
+    byte_range = None
+    if request.range is not None:
+        byte_range = request.range.range_for_length(size)
+        if byte_range is None:
+            abort(416)
+    start, stop = byte_range or (0, size)
+    rest_offset = max(start, len(head))
+    rest = None
+    if rest_offset < stop:
+        rest = read_rest(rest_offset, stop - rest_offset)
+        if rest is None:
+            abort(502)
+
+    def generate():
+        if start < len(head):
+            yield head[start:min(stop, len(head))]
+        if rest is not None:
+            yield from rest
+
+    response = Response(generate(), status=206 if byte_range else 200, mimetype=mimetype, direct_passthrough=True)
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['Content-Length'] = str(stop - start)
+    if byte_range:
+        response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+    return response
+
+def _read_file(path):
+    def read(offset, length):
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            while length > 0:
+                chunk = f.read(min(length, READ_CHUNK_SIZE))
+                if not chunk:
+                    break
+                length -= len(chunk)
+                yield chunk
+    return read
+
+@app.route('/media/<path:filename>')
+def serve_media(filename):
+    """播放队列中的曲目和封面已预取到内存时先从内存返回，其余部分从（已预读的）文件读取"""
+    path = str(_resolve(filename))
+    cached = MEDIA_CACHE.get(path, path, kind='media')
+    if cached is None:
+        return send_file(path)
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    return _range_response(cached['data'], cached['size'], mimetype, _read_file(path))
+
+@app.route('/stream/<path:filename>')
+def serve_stream(filename):
+    """未下载的曲目：转发预解析的播放地址，开头部分已在内存中，之后按 Range 向 CDN 续取"""
+    stream = MEDIA_CACHE.get_stream(filename)
+    if stream is None:
+        abort(404)
+
+    def read_remote(offset, length):
+        # 先向 CDN 发出请求、确认返回了所需的部分，再发送响应头
+        headers = {'Range': f'bytes={offset}-{offset + length - 1}'}
+        try:
+            res = stream['session'].get(stream['url'], headers=headers, stream=True, timeout=30)
+        except Exception as e:
+            print(f"从 CDN 读取音频失败: {e}")
+            return None
+        if res.status_code != 206:
+            # 地址失效或不支持 Range：返回 502，前端重新获取播放地址时会重新解析
+            print(f"CDN 返回状态码 {res.status_code}，播放地址可能已失效: {filename}")
+            res.close()
+            MEDIA_CACHE.drop_stream(filename)
+            return None
+
+        def generate():
+            # 从 CDN 读取期间后台下载让出带宽
+            with res, BANDWIDTH.transfer(PLAYBACK):
+                for chunk in res.iter_content(READ_CHUNK_SIZE):
+                    BANDWIDTH.consume(len(chunk), PLAYBACK)
+                    yield chunk
+        return generate()
+
+    return _range_response(stream['head'], stream['size'], stream['mimetype'], read_remote)
+
+@app.route('/cover/<path:filename>')
+def serve_embedded_cover(filename):
+    """返回音频标签中内嵌的封面（tags 保存方式下没有单独的封面文件）"""
+    from backend.services.audio_tags import read_cover
+
+    path = str(_resolve(filename))
+    cached = MEDIA_CACHE.get(('cover', path), path, kind='cover')
+    if cached is not None:
+        cover = cached['data'], cached['mimetype']
+    else:
+        cover = read_cover(path)
+        if cover is None:
+            abort(404)
+        MEDIA_CACHE.put(('cover', path), cover[0], path, cover[1])
+    data, mimetype = cover
+    response = Response(data, mimetype=mimetype)
+    response.headers['Cache-Control'] = 'max-age=86400'
+    return response
+
+@app.route('/covers/<key>')
+def serve_archived_cover(key):
+    """返回封面归档中的封面：从映射的 pack 文件按切片读取，不打开单独的文件；内容按哈希寻址，可永久缓存"""
+    cover = COVER_ARCHIVE.get(key)
+    if cover is None:
+        abort(404)
+    data, mimetype = cover
+    etag = archive_key(key)
+    if request.if_none_match.contains(etag):
+        return Response(status=304)
+    response = Response(data, mimetype=mimetype)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    response.set_etag(etag)
+    return response
 
 def start_media_server(directory, port):
     """启动 Flask 媒体服务器"""
@@ -1,22 +1,21 @@
 # File: backend/models/music.py
 import os
 import json
+import importlib.util
 from pathlib import Path
 from datetime import datetime
 
-try:
-    import mutagen
-    from mutagen.id3 import ID3, TIT2, TPE1, TALB, TDRC
-    HAS_MUTAGEN = True
-except ImportError:
-    HAS_MUTAGEN = False
+# mutagen 只在读取音频元数据时才导入
+HAS_MUTAGEN = importlib.util.find_spec('mutagen') is not None
+if not HAS_MUTAGEN:
     print("Warning: mutagen not installed. Audio metadata reading will be disabled.")
 
 class Music:
     """本地音乐文件类"""
     
     def __init__(self, file_path, title=None, album=None, duration=None, 
-                 bv_id=None, download_time=None, pic=None, cover_path=None):
+                 bv_id=None, download_time=None, pic=None, cover_path=None, cid=None, page=None,
+                 content_hash=None, evicted=False, cover_embedded=False):
         self.file_path = Path(file_path)
         self.title = title or self.file_path.stem
         self.album = album or "Unknown Album"
@@ -25,9 +24,21 @@ class Music:
         self.download_time = download_time or datetime.now().isoformat()
         self.pic = pic
         self.cover_path = cover_path
-        self.file_size = self.get_file_size()
+        self.cid = cid
+        self.page = page # 多P投稿中的分P序号，即专辑内的曲目序号
+        self.content_hash = content_hash # 音频内容哈希，用于识别重复内容
+        self.evicted = evicted # 超出磁盘预算被移除了本地文件，只保留元数据，播放时重新下载
+        self.cover_embedded = cover_embedded # 封面保存在音频文件的标签中，没有单独的封面文件
+        self._file_size = None
         self.cover_url = None # 新增字段
         
+    @property
+    def file_size(self):
+        """文件大小（字节），第一次访问时才读取，加载大音乐库时不必逐个 stat"""
+        if self._file_size is None:
+            self._file_size = self.get_file_size()
+        return self._file_size
+
     def get_file_size(self):
         """获取文件大小（字节）"""
         try:
@@ -48,7 +59,8 @@ class Music:
         """从文件中读取元数据"""
         if not HAS_MUTAGEN:
             return
-            
+
+        import mutagen
         try:
             if self.file_path.exists() and self.file_path.suffix.lower() == '.mp3':
                 audio_file = mutagen.File(self.file_path)
@@ -81,7 +93,12 @@ class Music:
             'bv_id': self.bv_id,
             'download_time': self.download_time,
             'pic': self.pic,
-            'cover_path': self.cover_path
+            'cover_path': self.cover_path,
+            'cid': self.cid,
+            'page': self.page,
+            'content_hash': self.content_hash,
+            'evicted': self.evicted,
+            'cover_embedded': self.cover_embedded
         }
     
     def to_dict_with_cover_url(self):
@@ -101,7 +118,12 @@ class Music:
             bv_id=data.get('bv_id'),
             download_time=data.get('download_time'),
             pic=data.get('pic'),
-            cover_path=data.get('cover_path')
+            cover_path=data.get('cover_path'),
+            cid=data.get('cid'),
+            page=data.get('page'),
+            content_hash=data.get('content_hash'),
+            evicted=data.get('evicted', False),
+            cover_embedded=data.get('cover_embedded', False)
         )
     
     @classmethod
@@ -110,13 +132,14 @@ class Music:
         return cls(
             file_path=file_path,
             title=video.title,
-            artist="Bilibili",
-            album="Bilibili",
+            album=video.album or video.title,
             duration=video.duration,
             bv_id=video.bvid,
             download_time=datetime.now().isoformat(),
             pic=video.pic,
-            cover_path=cover_path
+            cover_path=cover_path,
+            cid=video.cid,
+            page=video.page
         )
     
     def __str__(self):
@@ -1,18 +1,94 @@
 # File: video.py
 from core import wbi
 
+def parse_page_selection(selection):
+    """把分P选择解析为 [(起始序号, 结束序号), ...]；None、'all' 或空字符串表示全部，返回 None
+
+    可以是序号列表，也可以是 "1-3,5" 形式的字符串；格式无效（如 "a-3"、"1-"、"3-1"、"0"）时抛出 ValueError，
+    信息中带有出错的部分。
+    """
+    if selection is None or (isinstance(selection, str) and selection.strip().lower() in ('', 'all')):
+        return None
+    if isinstance(selection, str):
+        items = selection.replace('，', ',').split(',')
+    elif isinstance(selection, int):
+        items = [selection]
+    else:
+        items = list(selection)
+    ranges = []
+    for item in items:
+        text = str(item).strip()
+        if not text:
+            continue
+        start, dash, end = text.partition('-')
+        start, end = start.strip(), end.strip()
+        if not start.isdigit() or (dash and not end.isdigit()):
+            raise ValueError(f'无效的分P范围 "{text}"')
+        first = int(start)
+        last = int(end) if dash else first
+        if first < 1 or last < first:
+            raise ValueError(f'无效的分P范围 "{text}"')
+        ranges.append((first, last))
+    if not ranges:
+        raise ValueError(f'没有选择任何分P: {selection}')
+    return ranges
+
+
+def format_page_range(first, last):
+    return str(first) if first == last else f"{first}-{last}"
+
+
 class Video:
     """视频类，包含视频的基本信息和下载功能"""
-    def __init__(self, avid=None, bvid=None, cid=None, title=None, pic=None, duration=None):
+    def __init__(self, avid=None, bvid=None, cid=None, title=None, pic=None, duration=None,
+                 pages=None, page_count=None, page=None, album=None):
         self.avid = avid
         self.bvid = bvid
         self.cid = cid
         self.title = title
         self.pic = pic           # 封面 url
         self.duration = duration # 视频时长，单位为秒
+        self.pages = pages or [] # 分P列表，每项包含 cid、page、part、duration
+        self.page_count = page_count or len(self.pages) or 1
+        self.page = page         # 单个分P的序号，表示整个投稿时为 None
+        self.album = album       # 分P所属投稿的标题
 
     def __str__(self):
         return f"Video(AV号: {self.avid}, BV号: {self.bvid}, CID: {self.cid}, 标题: {self.title})"
+
+    @property
+    def is_multi_part(self):
+        return self.page_count > 1
+
+    def select_pages(self, selection=None):
+        """按选择返回分P列表：None 或 'all' 为全部，也可以是序号列表或 "1-3,5" 形式的字符串
+
+        选择无效，或其中某一段不包含任何已有的分P时抛出 ValueError（见 parse_page_selection）。
+        """
+        ranges = parse_page_selection(selection)
+        if ranges is None:
+            return list(self.pages)
+        numbers = [page['page'] for page in self.pages]
+        missing = [format_page_range(first, last) for first, last in ranges
+                   if not any(first <= number <= last for number in numbers)]
+        if missing:
+            raise ValueError(f"分P {', '.join(missing)} 不存在（共 {len(numbers)} 个分P）")
+        return [page for page in self.pages if any(first <= page['page'] <= last for first, last in ranges)]
+
+    def part_video(self, page):
+        """为单个分P创建 Video，标题带上分P名称，album 为投稿标题"""
+        part = page.get('part') or ''
+        title = self.title if not part or part == self.title else f"{self.title} - {part}"
+        return Video(
+            avid=self.avid,
+            bvid=self.bvid,
+            cid=page['cid'],
+            title=title,
+            pic=self.pic,
+            duration=page.get('duration'),
+            page=page['page'],
+            album=self.title
+        )
     
     def to_dict(self):
         """转换为字典格式"""
@@ -22,7 +98,11 @@ class Video:
             'cid': self.cid,
             'title': self.title,
             'pic': self.pic,
-            'duration': self.duration
+            'duration': self.duration,
+            'pages': self.pages,
+            'page_count': self.page_count,
+            'page': self.page,
+            'album': self.album
         }
     
     @classmethod
@@ -34,16 +114,25 @@ class Video:
             cid=data.get('cid'),
             title=data.get('title'),
             pic=data.get('pic'),
-            duration=data.get('duration')
+            duration=data.get('duration'),
+            pages=data.get('pages'),
+            page_count=data.get('page_count'),
+            page=data.get('page'),
+            album=data.get('album')
         )
 
     def download_audio(self, session, filename):
-        """下载视频音频，目前仅用 dash 视频格式"""
+        """下载视频音频，目前仅用 dash 视频格式；session 为 None 时使用共享传输层"""
         if not self.cid or (not self.avid and not self.bvid):
             print("视频信息不完整，无法下载音频")
             return False
         
-        download_url = "https://api.bilibili.com/x/player/wbi/playurl"
+        if session is None:
+            from core.http import get_transport
+            session = get_transport().session
+
+        from core.config import API_BASE_URL
+        download_url = f"{API_BASE_URL}/x/player/wbi/playurl"
         img_key, sub_key = wbi.getWbiKeys()
         params = wbi.encWbi(
             params={
@@ -56,13 +145,8 @@ class Video:
             sub_key=sub_key
         )
         
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3",
-            "Referer": "https://www.bilibili.com/"
-        }
-        
         try:
-            res = session.get(download_url, params=params, headers=headers)
+            res = session.get(download_url, params=params, timeout=30)
             if res.status_code == 200:
                 data = res.json()
                 if data.get('code') == 0:
@@ -70,7 +154,7 @@ class Video:
                     audio_url = video_data['dash']['audio'][0]['baseUrl']
                     
                     # 下载音频文件
-                    audio_res = session.get(audio_url, headers=headers)
+                    audio_res = session.get(audio_url, timeout=60)
                     if audio_res.status_code == 200:
                         with open(filename, 'wb') as f:
                             f.write(audio_res.content)
@@ -1,11 +1,27 @@
 from .auth import AuthService
+from .content_index import ContentIndex
 from .bilibili_service import BilibiliService
 from .download import DownloadService
+from .favorites_store import FavoritesStore
+from .library_budget import LibraryBudget
+from .library_export import LibraryExporter
+from .library_layout import LibraryLayout
+from .library_verifier import LibraryVerifier
 from .music import MusicService
+from .play_history import PlayHistory
+from .prefetch import Prefetcher
 
 __all__ = [
     'AuthService',
     'BilibiliService', 
+    'ContentIndex',
     'DownloadService',
-    'MusicService'
+    'FavoritesStore',
+    'LibraryBudget',
+    'LibraryExporter',
+    'LibraryLayout',
+    'LibraryVerifier',
+    'MusicService',
+    'PlayHistory',
+    'Prefetcher'
 ]
\ No newline at end of file
@@ -0,0 +1,161 @@
+# File: backend/services/audio_tags.py
+# 曲目信息保存在音频文件自身的标签中（B站音频流为 MP4 容器，写入 MP4 atoms），不再需要 json 和封面文件
+# 需要 mutagen；未安装时退回到旁车文件（sidecar）方式
+import importlib.util
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from core.config import METADATA_STORAGE, TAG_READ_WORKERS
+from core.log import log_event
+
+HAS_MUTAGEN = importlib.util.find_spec('mutagen') is not None
+
+STORAGE_SIDECAR = 'sidecar'
+STORAGE_TAGS = 'tags'
+
+# 下载的音频文件后缀，扫描下载目录时只读取这些文件的标签
+AUDIO_SUFFIXES = ('.mp3', '.m4a')
+
+# 标题、专辑、分P序号（曲目号）和封面使用标准 atom，其余字段保存为本项目命名空间下的自定义 atom
+TAG_NAMESPACE = 'com.bilibili-music'
+FREEFORM_FIELDS = ('bv_id', 'cid', 'download_time', 'pic', 'duration')
+
+
+_warned = False
+
+
+def storage_mode(storage=None):
+    """实际使用的保存方式：要求 tags 但未安装 mutagen 时退回 sidecar"""
+    global _warned
+    storage = storage or METADATA_STORAGE
+    if storage == STORAGE_TAGS and not HAS_MUTAGEN:
+        if not _warned:
+            _warned = True
+            print("Warning: mutagen not installed. 曲目信息改为保存在 json 文件中。")
+        return STORAGE_SIDECAR
+    return storage
+
+
+def _freeform_key(field):
+    return f'----:{TAG_NAMESPACE}:{field}'
+
+
+def _image_mimetype(data):
+    if data.startswith(b'\x89PNG'):
+        return 'image/png'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'image/jpeg'
+
+
+def _break_hardlink(path):
+    """文件有多个硬链接时先复制出独立的一份，写标签不影响其他曲目"""
+    if os.stat(path).st_nlink <= 1:
+        return
+    tmp_path = path.with_name(path.name + '.unlink')
+    shutil.copy2(path, tmp_path)
+    tmp_path.replace(path)
+
+
+def write_tags(music, cover=None):
+    """把曲目信息写入音频文件的标签，cover 为封面图片数据（None 时保留已有封面）；返回是否成功"""
+    from mutagen.mp4 import MP4, MP4Cover, MP4FreeForm
+
+    path = Path(music.file_path)
+    try:
+        _break_hardlink(path)
+        audio = MP4(path)
+        if audio.tags is None:
+            audio.add_tags()
+        tags = audio.tags
+        tags['\xa9nam'] = [music.title]
+        tags['\xa9alb'] = [music.album]
+        if music.page:
+            tags['trkn'] = [(music.page, 0)]
+        for field in FREEFORM_FIELDS:
+            value = getattr(music, field)
+            if value is None:
+                tags.pop(_freeform_key(field), None)
+            else:
+                tags[_freeform_key(field)] = [MP4FreeForm(str(value).encode('utf-8'))]
+        if cover:
+            image_format = MP4Cover.FORMAT_PNG if _image_mimetype(cover) == 'image/png' else MP4Cover.FORMAT_JPEG
+            tags['covr'] = [MP4Cover(cover, image_format)]
+        audio.save()
+        return True
+    except Exception as e:
+        print(f"写入音频标签失败 {path}: {e}")
+        return False
+
+
+def _load_tags(path):
+    """只解析 atom 结构和 ilst 标签，不读取音频流信息"""
+    from mutagen.mp4 import Atoms, MP4Tags
+
+    with open(path, 'rb') as f:
+        atoms = Atoms(f)
+        return MP4Tags(atoms, f)
+
+
+def read_tags(path):
+    """读取本项目写入的标签，返回可用于 Music.from_dict 的字典；文件没有这些标签时返回 None"""
+    try:
+        tags = _load_tags(path)
+    except Exception:
+        return None
+    if _freeform_key('download_time') not in tags:
+        return None
+
+    def text(key):
+        values = tags.get(key)
+        return str(values[0]) if values else None
+
+    def freeform(field):
+        values = tags.get(_freeform_key(field))
+        return bytes(values[0]).decode('utf-8') if values else None
+
+    cid = freeform('cid')
+    duration = freeform('duration')
+    track = tags.get('trkn')
+    return {
+        'file_path': str(path),
+        'title': text('\xa9nam'),
+        'album': text('\xa9alb'),
+        'duration': float(duration) if duration else None,
+        'bv_id': freeform('bv_id'),
+        'download_time': freeform('download_time'),
+        'pic': freeform('pic'),
+        'cover_path': None,
+        'cover_embedded': 'covr' in tags,
+        'cid': int(cid) if cid else None,
+        'page': track[0][0] if track else None,
+    }
+
+
+def read_cover(path):
+    """读取内嵌的封面，返回 (图片数据, MIME 类型)，没有封面时返回 None"""
+    try:
+        covers = _load_tags(path).get('covr')
+    except Exception:
+        return None
+    if not covers:
+        return None
+    data = bytes(covers[0])
+    return data, _image_mimetype(data)
+
+
+def read_tags_parallel(paths, max_workers=None):
+    """并行读取多个音频文件的标签，返回 {路径: 字典}；没有本项目标签的文件不在结果中"""
+    paths = list(paths)
+    if not paths:
+        return {}
+    start = time.perf_counter()
+    workers = min(len(paths), max_workers or TAG_READ_WORKERS)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tag-reader') as executor:
+        results = {str(path): info for path, info in zip(paths, executor.map(read_tags, paths)) if info}
+    log_event('read_tags', files=len(paths), tagged=len(results), workers=workers,
+              duration_ms=round((time.perf_counter() - start) * 1000, 3))
+    return results
@@ -1,32 +1,140 @@
 # File: backend/services/auth.py
-import requests
+import threading
 import time
-import json
 import os
-import qrcode
+import re
 import base64
+import importlib.util
 from io import BytesIO
-from pathlib import Path
 from core.config import DEFAULT_SESSION_FILE, DEFAULT_QRCODE_FILE, BILIBILI_API
+from core import wbi
+from core.http import get_transport
+from core.serialization import read_json, write_json
+
+# cryptography 和 qrcode 导入较慢，只在刷新 Cookie、生成二维码时才导入
+HAS_CRYPTOGRAPHY = importlib.util.find_spec('cryptography') is not None
+if not HAS_CRYPTOGRAPHY:
+    print("Warning: cryptography not installed. Automatic cookie refresh will be disabled.")
+
+# 表示登录状态失效的接口错误码：账号未登录 / csrf 校验失败
+AUTH_ERROR_CODES = (-101, -111)
+
+# 生成 CorrespondPath 用的公钥，见 bilibili-API-collect 的 Cookie 刷新文档
+COOKIE_REFRESH_PUBLIC_KEY = b'''-----BEGIN PUBLIC KEY-----
+MIGfMA0GCSqGSIb3DQEBAQUAA4GNADCBiQKBgQDLgd2OAkcGVtoE3ThUREbio0Eg
+Uc/prcajMKXvkCKFCWhJYJcLkcM2DKKcSeFpD/j6Boy538YXnR6VhcuUJOhH2x71
+nzPjfdTcqMz7djHum0qSZA0AyCBDABUqCrfNgCiJ00Ra7GmRj+YCK1NJEuewlb40
+JNrRuoEUXpabUzGB8QIDAQAB
+-----END PUBLIC KEY-----'''
 
 class AuthService:
-    def __init__(self, session_file=None):
-        self.session = requests.Session()
+    # nav 接口响应的缓存时间（秒），登录状态变化时会主动失效
+    NAV_CACHE_TTL = 60
+    # WBI 密钥每天更新一次，缓存时间可以比登录状态长
+    WBI_KEYS_TTL = 3600
+    # 后台检查 Cookie 是否需要刷新的间隔（秒）
+    COOKIE_REFRESH_INTERVAL = 6 * 3600
+    # 接口报登录失效时，两次主动刷新之间的最短间隔（秒）
+    COOKIE_REFRESH_COOLDOWN = 300
+
+    def __init__(self, session_file=None, transport=None):
+        # 所有服务共享同一个传输层（连接池、默认请求头、请求统计）
+        self.transport = transport or get_transport()
+        self.session = self.transport.session
         self.session_file = session_file or DEFAULT_SESSION_FILE
         self.qrcode_file = DEFAULT_QRCODE_FILE
+        # 同一时间只发出一个 nav 请求，并发调用方共享结果
+        self._nav_lock = threading.Lock()
+        self._nav_cache = None   # (获取时间, nav 响应)
+        self._wbi_keys = None    # (获取时间, (img_key, sub_key))
+        # 密钥缺失时并发的签名请求只触发一次 nav 请求
+        self._wbi_lock = threading.Lock()
+        # 扫码登录时返回的 refresh_token，用于刷新 Cookie
+        self.refresh_token = None
+        self._refresh_lock = threading.Lock()
+        self._last_refresh_attempt = 0
+        self._last_refresh_success = 0
+        self._refresh_thread = None
+        self._refresh_stop = threading.Event()
         self.load_session()
 
+    def get_nav(self, force_refresh=False):
+        """获取 nav 接口的完整响应，带短时缓存"""
+        with self._nav_lock:
+            if not force_refresh and self._nav_cache:
+                fetched_at, nav_data = self._nav_cache
+                if time.time() - fetched_at < self.NAV_CACHE_TTL:
+                    return nav_data
+
+            check_url = f"{BILIBILI_API['base_url']}/x/web-interface/nav"
+            res = self.session.get(check_url, timeout=10)
+            res.raise_for_status()
+            nav_data = res.json()
+            now = time.time()
+            self._nav_cache = (now, nav_data)
+            try:
+                self._wbi_keys = (now, wbi.extractWbiKeys(nav_data))
+            except (KeyError, TypeError, IndexError):
+                pass
+            return nav_data
+
+    def invalidate_nav_cache(self):
+        """登录状态可能变化时调用，下次检查会重新请求 nav 接口"""
+        with self._nav_lock:
+            self._nav_cache = None
+
+    def invalidate_wbi_keys(self):
+        """WBI 签名校验失败时调用，下次签名会重新获取密钥"""
+        with self._nav_lock:
+            self._wbi_keys = None
+
+    def handle_api_error(self, code):
+        """接口返回登录相关错误时使登录状态缓存失效
+
+        如果因此成功刷新了 Cookie，返回 True，调用方可以重试一次请求
+        """
+        if code in AUTH_ERROR_CODES:
+            self.invalidate_nav_cache()
+            return self.try_refresh_after_auth_error()
+        elif code == -352:
+            # 风控校验失败，多半是 WBI 密钥过期
+            self.invalidate_wbi_keys()
+        return False
+
+    def cached_wbi_keys(self):
+        """未过期的 WBI 密钥，没有时返回 None（不访问网络，可在事件循环中调用）"""
+        keys = self._wbi_keys
+        if keys and time.time() - keys[0] < self.WBI_KEYS_TTL:
+            return keys[1]
+        return None
+
+    def get_wbi_keys(self):
+        """获取 WBI 签名用的 img_key 和 sub_key，与登录检查共用 nav 响应"""
+        keys = self.cached_wbi_keys()
+        if keys:
+            return keys
+        with self._wbi_lock:
+            # 等锁期间其他线程可能已经取到了新密钥
+            keys = self._wbi_keys
+            if keys and time.time() - keys[0] < self.WBI_KEYS_TTL:
+                return keys[1]
+            nav_data = self.get_nav(force_refresh=True)
+            return wbi.extractWbiKeys(nav_data)
+
     def load_session(self):
         """从文件加载session信息"""
         if os.path.exists(self.session_file):
             try:
-                with open(self.session_file, 'r', encoding='utf-8') as f:
-                    session_data = json.load(f)
+                session_data = read_json(self.session_file)
                 
-                # sessions 过七天需要重新登录
+                self.refresh_token = session_data.get('refresh_token')
+
+                # sessions 过七天需要重新登录；保存了 refresh_token 的会话交给后台刷新
                 if time.time() - session_data.get('timestamp', 0) > 7 * 24 * 3600:
-                    print("Session已过期，需要重新登录")
-                    return False
+                    if not self.refresh_token:
+                        print("Session已过期，需要重新登录")
+                        return False
+                    print("Session已超过7天，将尝试自动刷新Cookie")
                 
                 # 恢复cookies
                 for cookie in session_data.get('cookies', []):
@@ -53,11 +161,12 @@ class AuthService:
             
             session_data = {
                 'cookies': cookies_data,
+                'refresh_token': self.refresh_token,
                 'timestamp': time.time()
             }
             
-            with open(self.session_file, 'w', encoding='utf-8') as f:
-                json.dump(session_data, f, ensure_ascii=False, indent=2)
+            # 先写临时文件再替换，避免刷新过程中崩溃留下损坏的会话文件
+            write_json(self.session_file, session_data)
             
             print("Session saved to file")
             return True
@@ -65,22 +174,16 @@ class AuthService:
             print(f"Failed to save session: {e}")
             return False
     
-    def check_login_status(self):
-        """通过nav接口检查登录状态，成功则返回用户信息，否则返回None"""
+    def check_login_status(self, force_refresh=False):
+        """通过nav接口检查登录状态，成功则返回用户信息，否则返回None
+
+        nav 响应会缓存 NAV_CACHE_TTL 秒，force_refresh=True 时跳过缓存
+        """
         try:
-            check_url = f"{BILIBILI_API['base_url']}/x/web-interface/nav"
-            headers = {
-                "User-Agent": BILIBILI_API['user_agent'],
-                "Referer": "https://www.bilibili.com/"
-            }
-            
-            res = self.session.get(check_url, headers=headers, timeout=10)
-            if res.status_code == 200:
-                data = res.json()
-                if data.get('code') == 0 and data.get('data', {}).get('isLogin'):
-                    user_info = data['data']
-                    print(f"已登录用户: {user_info.get('uname', 'Unknown')}")
-                    return user_info
+            data = self.get_nav(force_refresh)
+            if data.get('code') == 0 and data.get('data', {}).get('isLogin'):
+                user_info = data['data']
+                return user_info
             
             print("Session已失效，需要重新登录")
             return None
@@ -93,8 +196,7 @@ class AuthService:
         try:
             # 1. 申请二维码
             apply_url = f"{BILIBILI_API['login_base']}/x/passport-login/web/qrcode/generate"
-            headers = {"User-Agent": BILIBILI_API['user_agent']}
-            res = self.session.get(apply_url, headers=headers, timeout=10)
+            res = self.session.get(apply_url, timeout=10)
             res.raise_for_status()
             data = res.json()
             if data['code'] != 0:
@@ -104,6 +206,7 @@ class AuthService:
             url = data["data"]["url"]
 
             # 2. 生成二维码图片 (Base64)
+            import qrcode
             qr_img = qrcode.make(url)
             buffered = BytesIO()
             qr_img.save(buffered, format="PNG")
@@ -111,7 +214,8 @@ class AuthService:
 
             return {
                 "qrcode_key": qrcode_key,
-                "qrcode_base64": img_str
+                "qrcode_base64": img_str,
+                "url": url
             }
         except Exception as e:
             print(f"获取登录二维码时发生错误: {e}")
@@ -121,10 +225,9 @@ class AuthService:
         """轮询二维码登录状态"""
         try:
             poll_url = f"{BILIBILI_API['login_base']}/x/passport-login/web/qrcode/poll"
-            headers = {"User-Agent": BILIBILI_API['user_agent']}
             params = {"qrcode_key": qrcode_key}
             
-            res = self.session.get(poll_url, params=params, headers=headers, timeout=10)
+            res = self.session.get(poll_url, params=params, timeout=10)
             res.raise_for_status()
             data = res.json()['data']
 
@@ -133,7 +236,9 @@ class AuthService:
             
             # 登录成功, 保存cookies
             if code == 0:
+                self.refresh_token = data.get('refresh_token')
                 self.save_session()
+                self.invalidate_nav_cache()
                 return {"status": "ok", "message": "登录成功"}
             # 二维码失效
             elif code == 86038:
@@ -148,6 +253,159 @@ class AuthService:
             print(f"轮询登录状态失败: {e}")
             return {"status": "error", "message": "轮询异常"}
 
+    def _get_cookie(self, name):
+        """读取指定名称的 cookie，存在多个同名 cookie 时取最后一个"""
+        value = None
+        for cookie in self.session.cookies:
+            if cookie.name == name:
+                value = cookie.value
+        return value
+
+    def check_cookie_refresh(self):
+        """检查 Cookie 是否需要刷新，返回 (是否需要刷新, 服务器时间戳)，失败返回 None"""
+        csrf = self._get_cookie('bili_jct')
+        if not csrf:
+            return None
+        try:
+            info_url = f"{BILIBILI_API['login_base']}/x/passport-login/web/cookie/info"
+            res = self.session.get(info_url, params={'csrf': csrf}, timeout=10)
+            res.raise_for_status()
+            data = res.json()
+            if data.get('code') != 0:
+                print(f"检查Cookie状态失败: {data.get('message')}")
+                return None
+            return bool(data['data'].get('refresh')), data['data'].get('timestamp')
+        except Exception as e:
+            print(f"检查Cookie状态失败: {e}")
+            return None
+
+    def _get_correspond_path(self, timestamp):
+        """用公钥加密 refresh_{timestamp}，得到 CorrespondPath"""
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.hazmat.primitives.asymmetric import padding
+
+        public_key = serialization.load_pem_public_key(COOKIE_REFRESH_PUBLIC_KEY)
+        encrypted = public_key.encrypt(
+            f"refresh_{timestamp}".encode(),
+            padding.OAEP(
+                mgf=padding.MGF1(algorithm=hashes.SHA256()),
+                algorithm=hashes.SHA256(),
+                label=None
+            )
+        )
+        return encrypted.hex()
+
+    def _get_refresh_csrf(self, timestamp):
+        """访问 correspond 页面获取 refresh_csrf"""
+        correspond_url = f"https://www.bilibili.com/correspond/1/{self._get_correspond_path(timestamp)}"
+        res = self.session.get(correspond_url, timeout=10)
+        res.raise_for_status()
+        match = re.search(r'<div id="1-name">(.+?)</div>', res.text)
+        return match.group(1) if match else None
+
+    def refresh_cookies(self):
+        """执行 Cookie 刷新流程：获取 refresh_csrf -> 刷新 Cookie -> 确认更新"""
+        if not HAS_CRYPTOGRAPHY:
+            print("未安装 cryptography，无法自动刷新Cookie")
+            return False
+        if not self.refresh_token:
+            print("没有 refresh_token，无法自动刷新Cookie，需要重新扫码登录")
+            return False
+
+        with self._refresh_lock:
+            # 等锁期间其他线程已经刷新成功，直接复用结果
+            if time.time() - self._last_refresh_success < self.COOKIE_REFRESH_COOLDOWN:
+                return True
+            self._last_refresh_attempt = time.time()
+            try:
+                status = self.check_cookie_refresh()
+                timestamp = status[1] if status else int(time.time() * 1000)
+
+                refresh_csrf = self._get_refresh_csrf(timestamp)
+                if not refresh_csrf:
+                    print("获取 refresh_csrf 失败")
+                    return False
+
+                old_refresh_token = self.refresh_token
+                refresh_url = f"{BILIBILI_API['login_base']}/x/passport-login/web/cookie/refresh"
+                res = self.session.post(refresh_url, data={
+                    'csrf': self._get_cookie('bili_jct'),
+                    'refresh_csrf': refresh_csrf,
+                    'source': 'main_web',
+                    'refresh_token': old_refresh_token
+                }, timeout=10)
+                res.raise_for_status()
+                data = res.json()
+                if data.get('code') != 0:
+                    print(f"刷新Cookie失败: {data.get('message')}")
+                    return False
+
+                # 新 Cookie 已经写入 session，保存新的 refresh_token
+                self.refresh_token = data['data']['refresh_token']
+                self.save_session()
+                self.invalidate_nav_cache()
+
+                # 使用新的 csrf 和旧的 refresh_token 确认更新，旧的 refresh_token 随之失效
+                confirm_url = f"{BILIBILI_API['login_base']}/x/passport-login/web/confirm/refresh"
+                res = self.session.post(confirm_url, data={
+                    'csrf': self._get_cookie('bili_jct'),
+                    'refresh_token': old_refresh_token
+                }, timeout=10)
+                res.raise_for_status()
+                confirm_data = res.json()
+                if confirm_data.get('code') != 0:
+                    print(f"确认Cookie刷新失败: {confirm_data.get('message')}")
+
+                self._last_refresh_success = time.time()
+                print("Cookie 已自动刷新")
+                return True
+            except Exception as e:
+                print(f"刷新Cookie时发生错误: {e}")
+                return False
+
+    def ensure_fresh_session(self):
+        """需要时刷新 Cookie，批量任务开始前调用，返回会话是否可用"""
+        if not self._get_cookie('SESSDATA'):
+            return False
+        status = self.check_cookie_refresh()
+        if status is None:
+            # 检查接口本身失败时不阻塞任务，交给后续请求的错误处理
+            return True
+        needs_refresh, _ = status
+        if needs_refresh:
+            return self.refresh_cookies()
+        return True
+
+    def try_refresh_after_auth_error(self):
+        """接口报登录失效时尝试刷新一次 Cookie，带冷却时间防止反复刷新"""
+        if not self.refresh_token or not HAS_CRYPTOGRAPHY:
+            return False
+        if time.time() - self._last_refresh_attempt < self.COOKIE_REFRESH_COOLDOWN:
+            return False
+        return self.refresh_cookies()
+
+    def start_auto_refresh(self, interval=None, initial_delay=5):
+        """启动后台线程，定期检查并刷新 Cookie"""
+        if self._refresh_thread and self._refresh_thread.is_alive():
+            return
+        interval = interval or self.COOKIE_REFRESH_INTERVAL
+        self._refresh_stop.clear()
+
+        def run():
+            delay = initial_delay
+            while not self._refresh_stop.wait(delay):
+                delay = interval
+                try:
+                    self.ensure_fresh_session()
+                except Exception as e:
+                    print(f"后台刷新Cookie失败: {e}")
+
+        self._refresh_thread = threading.Thread(target=run, name='cookie-refresh', daemon=True)
+        self._refresh_thread.start()
+
+    def stop_auto_refresh(self):
+        self._refresh_stop.set()
+
     def login_with_qrcode(self, max_attempts=3):
         """使用二维码登录"""
         attempts = 0
@@ -211,6 +469,8 @@ class AuthService:
         try:
             # 清除cookies
             self.session.cookies.clear()
+            self.refresh_token = None
+            self.invalidate_nav_cache()
             
             # 删除session文件
             if os.path.exists(self.session_file):
@@ -1,38 +1,60 @@
 # File: backend/services/bilibili_service.py
+import asyncio
 import requests
 import re
 from urllib.parse import urlparse, parse_qs
-from core.config import BILIBILI_API, FAVORITES_CACHE_FILE
+from core.config import BILIBILI_API
 from core import wbi
 from backend.models.video import Video
+from backend.services.favorites_store import FavoritesStore
 import json
+import threading
 import time
 import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# 文本中的 BV 号、av 号
+BVID_PATTERN = re.compile(r'(BV[0-9A-Za-z]{10})')
+AVID_PATTERN = re.compile(r'(?:^|/|\b)av(\d+)', re.IGNORECASE)
 
 class BilibiliService:
+    # view 接口响应的缓存时间（秒），会话内重复解析同一视频不再请求
+    VIEW_CACHE_TTL = 600
+    # 批量解析时的并发数，实际请求速率受传输层的 API 限速约束
+    RESOLVE_WORKERS = 8
+
     def __init__(self, auth_service):
         self.auth_service = auth_service
         self.session = auth_service.session
+        self.rate_limiter = auth_service.transport.api_limiter
+        # 异步引擎：接口请求在一个事件循环中多路复用少量连接；未安装 httpx 时为 None，退回 requests 和线程池
+        self.engine = auth_service.transport.async_engine()
+        self._view_cache = {}    # 视频标识 -> (获取时间, view 响应)
+        self._view_cache_lock = threading.Lock()
+        # 收藏夹按收藏夹分别保存，浏览时分页读取
+        self.favorites = FavoritesStore()
+        self._favorites_lock = threading.Lock()
+
+    def _send_request(self, url, params=None, needs_wbi=False, retry_on_auth_error=True):
+        """统一发送请求，自动处理WBI签名；登录失效时尝试刷新Cookie并重试一次"""
+        if self.engine is not None:
+            return self.engine.run(self._send_request_async(url, params, needs_wbi, retry_on_auth_error))
 
-    def _send_request(self, url, params=None, needs_wbi=False):
-        """统一发送请求，自动处理WBI签名"""
-        headers = {
-            "User-Agent": BILIBILI_API['user_agent'],
-            "Referer": "https://www.bilibili.com/"
-        }
-        
         final_params = params.copy() if params else {}
         
         if needs_wbi:
-            img_key, sub_key = wbi.getWbiKeys()
+            img_key, sub_key = self.auth_service.get_wbi_keys()
             final_params = wbi.encWbi(params=final_params, img_key=img_key, sub_key=sub_key)
 
         try:
-            res = self.session.get(url, params=final_params, headers=headers, timeout=10)
+            self.rate_limiter.acquire()
+            res = self.session.get(url, params=final_params, timeout=10)
             res.raise_for_status()
             data = res.json()
             if data.get('code', 0) != 0:
                 print(f"API Error: {data.get('message', 'Unknown error')}, URL: {url}")
+                if self.auth_service.handle_api_error(data.get('code')) and retry_on_auth_error:
+                    return self._send_request(url, params, needs_wbi, retry_on_auth_error=False)
                 return None
             return data.get('data')
         except requests.exceptions.RequestException as e:
@@ -42,6 +64,32 @@ class BilibiliService:
             print(f"JSON解码失败, URL: {url}")
             return None
 
+    async def _send_request_async(self, url, params=None, needs_wbi=False, retry_on_auth_error=True):
+        """_send_request 的异步版本，在引擎的事件循环中运行；可能访问网络的登录相关操作放到线程中执行"""
+        final_params = params.copy() if params else {}
+
+        if needs_wbi:
+            keys = self.auth_service.cached_wbi_keys() or await asyncio.to_thread(self.auth_service.get_wbi_keys)
+            final_params = wbi.encWbi(params=final_params, img_key=keys[0], sub_key=keys[1])
+
+        try:
+            res = await self.engine.request('GET', url, params=final_params, timeout=10, rate_limited=True)
+            res.raise_for_status()
+            data = res.json()
+            if data.get('code', 0) != 0:
+                print(f"API Error: {data.get('message', 'Unknown error')}, URL: {url}")
+                refreshed = await asyncio.to_thread(self.auth_service.handle_api_error, data.get('code'))
+                if refreshed and retry_on_auth_error:
+                    return await self._send_request_async(url, params, needs_wbi, retry_on_auth_error=False)
+                return None
+            return data.get('data')
+        except self.engine.errors as e:
+            print(f"请求失败: {e!r}, URL: {url}")
+            return None
+        except json.JSONDecodeError:
+            print(f"JSON解码失败, URL: {url}")
+            return None
+
     def extract_bvid_from_url(self, url):
         """从Bilibili视频URL中提取BV号"""
         match = re.search(r'/(BV[a-zA-Z0-9]+)', url)
@@ -49,39 +97,190 @@ class BilibiliService:
             return match.group(1)
         return None
 
+    def normalize_video_id(self, text):
+        """把 URL、BV 号或 av 号统一为 'BV...' 或 'av123' 形式，无法识别时返回 None"""
+        text = (text or '').strip()
+        if not text:
+            return None
+        match = BVID_PATTERN.search(text)
+        if match:
+            return match.group(1)
+        match = AVID_PATTERN.search(text)
+        if match:
+            return f"av{match.group(1)}"
+        return None
+
+    def _cached_view(self, video_id):
+        now = time.time()
+        with self._view_cache_lock:
+            cached = self._view_cache.get(video_id)
+            if cached and now - cached[0] < self.VIEW_CACHE_TTL:
+                return cached[1]
+        return None
+
+    def _cache_view(self, video_id, video_data):
+        if not video_data:
+            return
+        with self._view_cache_lock:
+            self._view_cache[video_id] = (time.time(), video_data)
+            # 同一视频用 av 号和 BV 号都能命中缓存
+            if video_data.get('bvid'):
+                self._view_cache[video_data['bvid']] = (time.time(), video_data)
+
+    @staticmethod
+    def _view_params(video_id):
+        if video_id.startswith('av'):
+            return {'aid': video_id[2:]}
+        return {'bvid': video_id}
+
+    def _fetch_view(self, video_id):
+        """获取 view 接口数据，带 TTL 缓存"""
+        video_data = self._cached_view(video_id)
+        if video_data:
+            return video_data
+        api_url = f"{BILIBILI_API['base_url']}/x/web-interface/view"
+        video_data = self._send_request(api_url, self._view_params(video_id), needs_wbi=True)
+        self._cache_view(video_id, video_data)
+        return video_data
+
+    async def _fetch_view_async(self, video_id):
+        video_data = self._cached_view(video_id)
+        if video_data:
+            return video_data
+        api_url = f"{BILIBILI_API['base_url']}/x/web-interface/view"
+        video_data = await self._send_request_async(api_url, self._view_params(video_id), needs_wbi=True)
+        self._cache_view(video_id, video_data)
+        return video_data
+
+    def _video_from_view(self, video_data):
+        # 保留完整的分P列表，多P投稿可以按分P下载
+        pages = [
+            {
+                'cid': page.get('cid'),
+                'page': page.get('page'),
+                'part': page.get('part'),
+                'duration': page.get('duration')
+            }
+            for page in video_data.get('pages') or []
+        ]
+        return Video(
+            avid=video_data.get('aid'),
+            bvid=video_data.get('bvid'),
+            cid=video_data.get('cid'),
+            title=video_data.get('title'),
+            pic=video_data.get('pic'),
+            duration=video_data.get('duration'),
+            pages=pages,
+            page_count=video_data.get('videos')
+        )
+
     def load_video_info(self, video_url):
         """加载视频信息"""
-        bvid = self.extract_bvid_from_url(video_url) or video_url
-        api_url = f"{BILIBILI_API['base_url']}/x/web-interface/view"
-        params = {'bvid': bvid}
-        
-        video_data = self._send_request(api_url, params, needs_wbi=True)
+        video_id = self.normalize_video_id(video_url) or self.extract_bvid_from_url(video_url) or video_url
+        video_data = self._fetch_view(video_id)
         
         if video_data:
-            video = Video(
-                avid=video_data.get('aid'),
-                bvid=video_data.get('bvid'),
-                cid=video_data.get('cid'),
-                title=video_data.get('title'),
-                pic=video_data.get('pic'),
-                duration=video_data.get('duration')
-            )
+            video = self._video_from_view(video_data)
             print(f"视频信息加载成功: {video.title}")
             return video
         return None
 
-    def get_favorites(self, force_refresh=False):
-        """获取收藏夹信息，优先从缓存读取"""
-        if not force_refresh and FAVORITES_CACHE_FILE.exists():
+    def resolve_videos(self, items, max_workers=None, cancel_check=None):
+        """批量解析视频：规范化并去重后并发请求，按完成顺序逐个产出结果
+
+        每个结果为 {'id', 'inputs', 'status', 'video' | 'message'}；无法识别的输入也会作为失败项产出。
+        """
+        unique = {}
+        for item in items:
+            video_id = self.normalize_video_id(item)
+            if video_id is None:
+                yield {'id': None, 'inputs': [item], 'status': 'error', 'message': '无法识别的视频链接或编号'}
+                continue
+            unique.setdefault(video_id, []).append(item)
+        if not unique:
+            return
+
+        if self.engine is not None:
+            # 所有请求同时交给异步引擎，在途请求数由引擎限制，不占用额外线程
+            fetched = self.engine.map(self._fetch_view_async, unique, cancel_check)
+        else:
+            fetched = self._fetch_views_threaded(unique, max_workers, cancel_check)
+        for video_id, video_data in fetched:
+            result = {'id': video_id, 'inputs': unique[video_id]}
+            if isinstance(video_data, Exception):
+                result['message'] = str(video_data)
+                video_data = None
+            if video_data:
+                result.update(status='ok', video=self._video_from_view(video_data).to_dict())
+            else:
+                result.setdefault('message', '获取视频信息失败')
+                result['status'] = 'error'
+            yield result
+
+    def _fetch_views_threaded(self, video_ids, max_workers=None, cancel_check=None):
+        """用线程池并发获取 view 数据，按完成顺序产出 (video_id, 数据或异常)"""
+        def resolve(video_id):
+            if cancel_check and cancel_check():
+                return None
+            return self._fetch_view(video_id)
+
+        workers = min(len(video_ids), max_workers or self.RESOLVE_WORKERS)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='resolve') as executor:
+            futures = {executor.submit(resolve, video_id): video_id for video_id in video_ids}
             try:
-                with open(FAVORITES_CACHE_FILE, 'r', encoding='utf-8') as f:
-                    print("从缓存加载收藏夹...")
-                    return json.load(f)
-            except Exception as e:
-                print(f"从缓存加载收藏夹失败: {e}")
-        
+                for future in as_completed(futures):
+                    try:
+                        yield futures[future], future.result()
+                    except Exception as e:
+                        yield futures[future], e
+            finally:
+                # 调用方提前停止迭代时不再发出剩余的请求
+                for future in futures:
+                    future.cancel()
+
+    def get_favorite_folders(self, force_refresh=False, progress_callback=None):
+        """获取收藏夹列表（不含视频），优先读取本地存储；获取失败时返回 None"""
+        if not force_refresh:
+            if self.favorites.is_empty():
+                self.favorites.migrate_legacy()
+            if not self.favorites.is_empty():
+                print("从缓存加载收藏夹...")
+                return self.favorites.list_folders()
+
         print("从API获取收藏夹...")
-        return self._fetch_and_cache_favorites()
+        if not self.refresh_favorites(progress_callback):
+            return None
+        return self.favorites.list_folders()
+
+    # 收藏夹接口每页的视频数
+    FAVORITES_PAGE_SIZE = 20
+
+    def _favorite_page_params(self, media_id, page_num):
+        return {'media_id': media_id, 'pn': page_num, 'ps': self.FAVORITES_PAGE_SIZE, 'platform': 'web'}
+
+    def _videos_from_medias(self, videos_info):
+        videos = []
+        for video_info in videos_info:
+            # Skip invalid/deleted videos which may lack essential data
+            if video_info.get('is_invalid') or not video_info.get('bvid'):
+                print(f"Skipping invalid or incomplete video entry: {video_info.get('title')}")
+                continue
+            
+            ugc_info = video_info.get('ugc')
+            cid = ugc_info.get('first_cid') if ugc_info else None
+
+            video = Video(
+                avid=video_info.get('id'),
+                bvid=video_info.get('bvid'),
+                cid=cid,
+                title=video_info.get('title'),
+                pic=video_info.get('cover'),
+                duration=video_info.get('duration'),
+                # 收藏夹接口只给出分P数量，分P列表在下载时再通过 view 接口获取
+                page_count=video_info.get('page')
+            )
+            videos.append(video.to_dict())
+        return videos
 
     def _fetch_favorite_videos_paginated(self, media_id, folder_title):
         """分页获取单个收藏夹的所有视频"""
@@ -89,7 +288,7 @@ class BilibiliService:
         page_num = 1
         while True:
             fav_videos_url = BILIBILI_API['get_fav_videos_detail']
-            params = {'media_id': media_id, 'pn': page_num, 'ps': 20, 'platform': 'web'}
+            params = self._favorite_page_params(media_id, page_num)
             
             data = self._send_request(fav_videos_url, params, needs_wbi=True)
             
@@ -101,24 +300,7 @@ class BilibiliService:
             if not videos_info:
                 break  # No more videos
 
-            for video_info in videos_info:
-                # Skip invalid/deleted videos which may lack essential data
-                if video_info.get('is_invalid') or not video_info.get('bvid'):
-                    print(f"Skipping invalid or incomplete video entry: {video_info.get('title')}")
-                    continue
-                
-                ugc_info = video_info.get('ugc')
-                cid = ugc_info.get('first_cid') if ugc_info else None
-
-                video = Video(
-                    avid=video_info.get('id'),
-                    bvid=video_info.get('bvid'),
-                    cid=cid,
-                    title=video_info.get('title'),
-                    pic=video_info.get('cover'),
-                    duration=video_info.get('duration')
-                )
-                videos.append(video.to_dict())
+            videos.extend(self._videos_from_medias(videos_info))
             
             if not data.get('has_more'):
                 break  # Last page
@@ -127,52 +309,97 @@ class BilibiliService:
             time.sleep(random.uniform(0.1, 0.2))  # Be nice to Bilibili API
         return videos
 
-    def _fetch_and_cache_favorites(self):
-        """从Bilibili API获取所有收藏夹内容并缓存"""
-        user_info = self.auth_service.check_login_status()
-        if not user_info or 'mid' not in user_info:
-            print("用户未登录或无法获取用户信息")
-            return []
+    async def _fetch_favorite_videos_async(self, media_id, folder_title, media_count):
+        """异步获取单个收藏夹的所有视频：按收藏数算出页数后同时请求各页，按页序合并
 
-        up_mid = user_info['mid']
-        fav_list_url = BILIBILI_API['get_fav']
-        
-        data = self._send_request(fav_list_url, params={'up_mid': up_mid})
-        if not data:
-            return []
-
-        favorites_data = []
-        fav_folders = data.get('list', [])
-        if not fav_folders:
-            print("没有找到任何收藏夹")
-            return []
-
-        for folder in fav_folders:
-            media_id = folder.get('id')
-            folder_title = folder.get('title')
+        请求速率仍受传输层的 API 限速约束；某一页失败时只保留它之前的页，与逐页获取时一致。
+        """
+        fav_videos_url = BILIBILI_API['get_fav_videos_detail']
+        page_count = max(1, -(-media_count // self.FAVORITES_PAGE_SIZE))
+        pages = await asyncio.gather(*(
+            self._send_request_async(fav_videos_url, self._favorite_page_params(media_id, page_num), needs_wbi=True)
+            for page_num in range(1, page_count + 1)
+        ))
+        videos = []
+        page_num = page_count
+        for data in pages:
+            if not data:
+                print(f"获取收藏夹 {folder_title} 内容失败。")
+                return videos
+            videos.extend(self._videos_from_medias(data.get('medias') or []))
+        # 收藏数在列表返回之后增加时，其余的页逐页获取
+        while pages[-1].get('has_more') and pages[-1].get('medias'):
+            page_num += 1
+            data = await self._send_request_async(
+                fav_videos_url, self._favorite_page_params(media_id, page_num), needs_wbi=True)
+            if not data:
+                print(f"获取收藏夹 {folder_title} 内容失败。")
+                break
+            videos.extend(self._videos_from_medias(data.get('medias') or []))
+            pages = [data]
+        return videos
+
+    def _fetch_favorite_folders(self, fav_folders):
+        """获取各收藏夹的视频，按完成顺序产出 (收藏夹, 视频列表)
+
+        有异步引擎时所有收藏夹的所有页同时请求，否则逐个收藏夹、逐页获取。
+        """
+        if self.engine is None:
+            for folder in fav_folders:
+                media_count = folder.get('media_count', 0)
+                videos = self._fetch_favorite_videos_paginated(folder['id'], folder.get('title')) if media_count > 0 else []
+                yield folder, videos
+            return
+
+        async def fetch(folder):
             media_count = folder.get('media_count', 0)
+            if media_count <= 0:
+                return []
+            return await self._fetch_favorite_videos_async(folder['id'], folder.get('title'), media_count)
 
-            if not media_id:
-                continue
+        yield from self.engine.map(fetch, fav_folders)
 
-            folder_data = {
-                "id": media_id,
-                "title": folder_title,
-                "media_count": media_count,
-                "videos": []
-            }
+    def refresh_favorites(self, progress_callback=None):
+        """从Bilibili API获取所有收藏夹内容，每抓完一个收藏夹就写入本地存储；返回是否成功"""
+        with self._favorites_lock:
+            # 批量抓取前先确保 Cookie 有效，避免中途因登录过期而失败
+            self.auth_service.ensure_fresh_session()
+            user_info = self.auth_service.check_login_status()
+            if not user_info or 'mid' not in user_info:
+                print("用户未登录或无法获取用户信息")
+                return False
 
-            if media_count > 0:
-                folder_data["videos"] = self._fetch_favorite_videos_paginated(media_id, folder_title)
-            
-            favorites_data.append(folder_data)
-        
-        try:
-            FAVORITES_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
-            with open(FAVORITES_CACHE_FILE, 'w', encoding='utf-8') as f:
-                json.dump(favorites_data, f, ensure_ascii=False, indent=4)
-            print("收藏夹数据已成功缓存。")
-        except Exception as e:
-            print(f"缓存收藏夹失败: {e}")
+            up_mid = user_info['mid']
+            fav_list_url = BILIBILI_API['get_fav']
 
-        return favorites_data
\ No newline at end of file
+            data = self._send_request(fav_list_url, params={'up_mid': up_mid})
+            if not data:
+                return False
+
+            fav_folders = [folder for folder in data.get('list') or [] if folder.get('id')]
+            if not fav_folders:
+                print("没有找到任何收藏夹")
+
+            if progress_callback:
+                progress_callback(0, len(fav_folders), None)
+            for position, (folder, videos) in enumerate(self._fetch_favorite_folders(fav_folders), 1):
+                folder_title = folder.get('title')
+                if isinstance(videos, Exception):
+                    print(f"获取收藏夹 {folder_title} 失败: {videos}")
+                    return False
+                try:
+                    self.favorites.write_folder(
+                        {"id": folder['id'], "title": folder_title, "media_count": folder.get('media_count', 0)},
+                        videos
+                    )
+                except Exception as e:
+                    print(f"保存收藏夹 {folder_title} 失败: {e}")
+                    return False
+                if progress_callback:
+                    progress_callback(position, len(fav_folders), folder_title)
+
+            self.favorites.retain_folders([folder['id'] for folder in fav_folders])
+            if progress_callback:
+                progress_callback(len(fav_folders), len(fav_folders), None)
+            print("收藏夹数据已成功缓存。")
+            return True
@@ -0,0 +1,310 @@
+# File: backend/services/content_index.py
+# 音频内容索引：记录每个文件的内容哈希和对应的 cid，用于识别重复下载和重复内容
+import hashlib
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from core.config import CONTENT_HASH_WORKERS, CONTENT_INDEX_FILE
+from core.log import log_event
+from core.serialization import read_json, write_json
+
+# 内容哈希算法，下载时边写边算，已有文件按块读取计算
+CONTENT_HASH_ALGORITHM = 'sha256'
+HASH_CHUNK_SIZE = 1024 * 1024
+# 抽样哈希读取的块大小和块数：开头、结尾和均匀分布在中间的若干块
+SAMPLE_BLOCK_SIZE = 64 * 1024
+SAMPLE_BLOCKS = 4
+
+
+def content_hasher():
+    return hashlib.new(CONTENT_HASH_ALGORITHM)
+
+
+def hash_file(path):
+    """分块读取文件计算内容哈希"""
+    hasher = content_hasher()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def sample_hash(path, size=None):
+    """只读取文件开头、结尾和中间几块计算的抽样哈希（含文件大小），用于快速判断内容是否变化"""
+    size = os.path.getsize(path) if size is None else size
+    hasher = content_hasher()
+    hasher.update(str(size).encode('ascii'))
+    with open(path, 'rb') as f:
+        if size <= SAMPLE_BLOCK_SIZE * (SAMPLE_BLOCKS + 2):
+            hasher.update(f.read())
+            return hasher.hexdigest()
+        step = (size - SAMPLE_BLOCK_SIZE) // (SAMPLE_BLOCKS + 1)
+        for index in range(SAMPLE_BLOCKS + 2):
+            f.seek(min(index * step, size - SAMPLE_BLOCK_SIZE))
+            hasher.update(f.read(SAMPLE_BLOCK_SIZE))
+    return hasher.hexdigest()
+
+
+def link_or_copy(source, target, copy=True):
+    """让 target 成为 source 的硬链接，替换 target 原有内容；返回是否为硬链接
+
+    不支持硬链接（如跨分区）时，copy 为 True 则改为复制，否则保持 target 不变。
+    """
+    target = Path(target)
+    tmp_path = target.with_name(target.name + '.link')
+    tmp_path.unlink(missing_ok=True)
+    try:
+        os.link(source, tmp_path)
+        linked = True
+    except OSError:
+        if not copy:
+            return False
+        shutil.copy2(source, tmp_path)
+        linked = False
+    tmp_path.replace(target)
+    return linked
+
+
+def format_size(size):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024.0:
+            return f"{size:.1f} {unit}"
+        size /= 1024.0
+    return f"{size:.1f} TB"
+
+
+class ContentIndex:
+    """文件路径到内容哈希、抽样哈希、大小、修改时间和 cid 的索引
+
+    按哈希和 cid 反查文件；文件的大小或修改时间变化后视为需要重新计算哈希。
+    大小和抽样哈希是下载完成时记下的“应有内容”，校验音乐库时据此发现被截断或损坏的文件。
+    """
+
+    def __init__(self, index_file=None):
+        self.index_file = Path(index_file or CONTENT_INDEX_FILE)
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._by_hash = {}
+        self._by_cid = {}
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        if not self.index_file.exists():
+            return
+        try:
+            data = read_json(self.index_file)
+        except Exception as e:
+            print(f"加载内容索引失败: {e}")
+            return
+        if data.get('algorithm') != CONTENT_HASH_ALGORITHM:
+            return
+        for path, entry in data.get('entries', {}).items():
+            self._add(path, entry)
+
+    def save(self):
+        """有变化时写回索引文件，先写临时文件再替换"""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {'algorithm': CONTENT_HASH_ALGORITHM, 'entries': dict(self._entries)}
+            self._dirty = False
+        try:
+            write_json(self.index_file, data)
+        except Exception as e:
+            print(f"保存内容索引失败: {e}")
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _add(self, path, entry):
+        self._entries[path] = entry
+        self._by_hash.setdefault(entry['hash'], set()).add(path)
+        if entry.get('cid'):
+            self._by_cid.setdefault(entry['cid'], set()).add(path)
+
+    def _remove(self, path):
+        entry = self._entries.pop(path, None)
+        if entry is None:
+            return
+        self._by_hash.get(entry['hash'], set()).discard(path)
+        if entry.get('cid'):
+            self._by_cid.get(entry['cid'], set()).discard(path)
+
+    def record(self, path, content_hash, cid=None):
+        """记录文件的内容哈希（下载完成时调用）"""
+        path = str(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        try:
+            sample = sample_hash(path, stat.st_size)
+        except OSError:
+            sample = None
+        entry = {'hash': content_hash, 'size': stat.st_size, 'mtime': stat.st_mtime, 'cid': cid, 'sample': sample}
+        with self._lock:
+            if cid is None and path in self._entries:
+                entry['cid'] = self._entries[path].get('cid')
+            self._remove(path)
+            self._add(path, entry)
+            self._dirty = True
+
+    def move(self, old_path, new_path):
+        """文件移动后更新索引中的路径（内容不变，不重新计算哈希）"""
+        old_path, new_path = str(old_path), str(new_path)
+        with self._lock:
+            entry = self._entries.get(old_path)
+            if entry is None:
+                return
+            self._remove(old_path)
+            self._add(new_path, entry)
+            self._dirty = True
+
+    def get(self, path):
+        with self._lock:
+            entry = self._entries.get(str(path))
+            return dict(entry) if entry else None
+
+    def _valid_paths(self, paths, exclude=None):
+        """只返回仍然存在且大小未变的文件，已变化的条目从索引中移除"""
+        valid = []
+        for path in sorted(paths):
+            if exclude is not None and path == str(exclude):
+                continue
+            entry = self._entries[path]
+            try:
+                if os.stat(path).st_size == entry['size']:
+                    valid.append(path)
+                    continue
+            except OSError:
+                pass
+            self._remove(path)
+            self._dirty = True
+        return valid
+
+    def find_hash(self, content_hash, exclude=None):
+        """按内容哈希查找已有文件，返回路径或 None"""
+        with self._lock:
+            paths = self._valid_paths(self._by_hash.get(content_hash, ()), exclude)
+        return paths[0] if paths else None
+
+    def find_cid(self, cid, exclude=None):
+        """按 cid 查找已下载的音频，返回路径或 None"""
+        if not cid:
+            return None
+        with self._lock:
+            paths = self._valid_paths(self._by_cid.get(cid, ()), exclude)
+        return paths[0] if paths else None
+
+    def build(self, tracks, max_workers=None, progress_callback=None, cancel_check=None):
+        """为已有文件补全索引：tracks 为 (路径, cid) 列表，只对新文件和已变化的文件计算哈希
+
+        多个文件并行读取计算；已不存在的文件从索引中移除。返回统计信息。
+        """
+        start = time.perf_counter()
+        stale = []
+        with self._lock:
+            for path in list(self._entries):
+                if not os.path.exists(path):
+                    self._remove(path)
+                    self._dirty = True
+            for path, cid in tracks:
+                path = str(path)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entry = self._entries.get(path)
+                if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+                    if cid and entry.get('cid') != cid:
+                        self._remove(path)
+                        self._add(path, dict(entry, cid=cid))
+                        self._dirty = True
+                    continue
+                stale.append((path, cid, stat.st_size))
+
+        def hash_one(item):
+            path, cid, size = item
+            if cancel_check and cancel_check():
+                return None
+            try:
+                return path, cid, hash_file(path)
+            except OSError as e:
+                print(f"计算文件哈希失败 {path}: {e}")
+                return None
+
+        hashed = 0
+        hashed_bytes = 0
+        if stale:
+            workers = min(len(stale), max_workers or CONTENT_HASH_WORKERS)
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='content-hash') as executor:
+                for index, result in enumerate(executor.map(hash_one, stale), 1):
+                    if result is not None:
+                        path, cid, content_hash = result
+                        self.record(path, content_hash, cid)
+                        hashed += 1
+                        hashed_bytes += stale[index - 1][2]
+                    if progress_callback:
+                        progress_callback(index, len(stale))
+        self.save()
+
+        duration = time.perf_counter() - start
+        log_event('content_index_build', files=len(self), hashed=hashed, bytes=hashed_bytes,
+                  duration_ms=round(duration * 1000, 3))
+        return {'files': len(self), 'hashed': hashed, 'hashed_bytes': hashed_bytes, 'seconds': round(duration, 3)}
+
+    def duplicate_report(self):
+        """列出内容相同的文件组，以及把它们合并为硬链接后可以释放的空间"""
+        with self._lock:
+            groups = []
+            for content_hash, paths in list(self._by_hash.items()):
+                if len(paths) > 1:
+                    paths = self._valid_paths(paths)
+                    if len(paths) > 1:
+                        groups.append((content_hash, paths, self._entries[paths[0]]['size']))
+
+        report = []
+        reclaimable = 0
+        vanished = []
+        for content_hash, paths, size in groups:
+            # 已经互为硬链接的文件不额外占用空间；检查之后才被删除或移动的文件跳过，并从索引中移除
+            inodes = set()
+            present = []
+            for path in paths:
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    vanished.append(path)
+                    continue
+                inodes.add((stat.st_dev, stat.st_ino))
+                present.append(path)
+            if len(present) < 2:
+                continue
+            group_reclaimable = size * (len(inodes) - 1)
+            reclaimable += group_reclaimable
+            report.append({
+                'hash': content_hash,
+                'size': size,
+                'paths': present,
+                'copies': len(inodes),
+                'reclaimable': group_reclaimable
+            })
+        if vanished:
+            with self._lock:
+                for path in vanished:
+                    # 期间在原路径重新下载的文件保留
+                    if not os.path.exists(path):
+                        self._remove(path)
+                        self._dirty = True
+        report.sort(key=lambda group: group['reclaimable'], reverse=True)
+        return {
+            'groups': report,
+            'duplicate_files': sum(len(group['paths']) - 1 for group in report),
+            'reclaimable_bytes': reclaimable,
+            'reclaimable_readable': format_size(reclaimable)
+        }
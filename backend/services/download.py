@@ -1,28 +1,47 @@
 # File: backend/services/download.py
-import json
-import requests
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from core.config import DOWNLOAD_DIR, BILIBILI_API
+from core.bandwidth import BANDWIDTH, COVER, current_class, traffic_scope
+from core.config import BILIBILI_API, COVER_ARCHIVE_ENABLED, PART_DOWNLOAD_WORKERS, DEDUP_HARDLINK
+from core.cover_archive import COVER_ARCHIVE
 from core import wbi
+from core.log import log_event
+from core.metrics import DOWNLOAD_BYTES, DOWNLOAD_SPEED
+from core.serialization import read_json, write_json
 from backend.models.music import Music
+from backend.services.audio_tags import STORAGE_TAGS, read_tags, storage_mode, write_tags
+from backend.services.content_index import content_hasher, hash_file, link_or_copy
+from backend.services.library_layout import LibraryLayout, part_filename, safe_filename
 
 class DownloadService:
-    def __init__(self, auth_service):
+    def __init__(self, auth_service, content_index=None, metadata_storage=None, layout=None, bandwidth=None,
+                 cover_archive=None):
         self.auth_service = auth_service
         self.session = auth_service.session
-    
-    def download_cover_image(self, pic_url, output_dir, filename_base):
-        """下载封面图片"""
+        # 异步引擎：播放地址等接口请求多路复用少量连接；音频流仍由 requests 流式写入文件
+        self.engine = auth_service.transport.async_engine()
+        # 内容索引：按 cid 跳过已下载的音频，按内容哈希识别重复文件
+        self.content_index = content_index
+        # 曲目信息保存在旁车文件（sidecar）还是音频标签（tags）中
+        self.metadata_storage = storage_mode(metadata_storage)
+        # 下载目录布局：未指定输出目录时按布局决定音频和封面的位置
+        self.layout = layout or LibraryLayout()
+        # 带宽调度：音频和封面下载按流量类别（见 core/bandwidth.py）分配总速率
+        self.bandwidth = bandwidth or BANDWIDTH
+        # 封面归档：启用时 sidecar 方式的封面写入归档，曲目记录中的 cover_path 为 pack:哈希.扩展名
+        self.cover_archive = cover_archive or (COVER_ARCHIVE if COVER_ARCHIVE_ENABLED else None)
+
+    def fetch_cover(self, pic_url):
+        """下载封面图片到内存，返回 (图片数据, 扩展名)，失败时返回 None"""
         if not pic_url:
             return None
-            
+
         try:
-            headers = {
-                "User-Agent": BILIBILI_API['user_agent'],
-                "Referer": "https://www.bilibili.com/"
-            }
-            
-            response = self.session.get(pic_url, headers=headers, timeout=30)
+            with self.bandwidth.transfer(COVER):
+                response = self.session.get(pic_url, timeout=30)
+                self.bandwidth.consume(len(response.content), COVER)
             if response.status_code == 200:
                 # 获取图片扩展名
                 content_type = response.headers.get('content-type', '')
@@ -34,21 +53,34 @@ class DownloadService:
                     ext = '.webp'
                 else:
                     ext = '.jpg'  # 默认
-                
-                cover_filename = f"{filename_base}_cover{ext}"
-                cover_path = Path(output_dir) / cover_filename
-                
-                with open(cover_path, 'wb') as f:
-                    f.write(response.content)
-                
-                print(f"封面已下载到 {cover_path}")
-                return str(cover_path)
+                return response.content, ext
             else:
                 print(f"封面下载失败，状态码: {response.status_code}")
                 return None
         except Exception as e:
             print(f"下载封面时发生错误: {e}")
             return None
+
+    def _write_cover(self, cover, output_dir, filename_base):
+        data, ext = cover
+        if self.cover_archive is not None:
+            return self.cover_archive.put(data, ext=ext)
+        cover_path = Path(output_dir) / f"{filename_base}_cover{ext}"
+        with open(cover_path, 'wb') as f:
+            f.write(data)
+        print(f"封面已下载到 {cover_path}")
+        return str(cover_path)
+
+    def download_cover_image(self, pic_url, output_dir, filename_base):
+        """下载封面图片"""
+        cover = self.fetch_cover(pic_url)
+        if cover is None:
+            return None
+        try:
+            return self._write_cover(cover, output_dir, filename_base)
+        except OSError as e:
+            print(f"保存封面时发生错误: {e}")
+            return None
     
     def create_music_info_file(self, music, output_dir):
         """创建音乐信息JSON文件"""
@@ -56,52 +88,207 @@ class DownloadService:
             info_filename = f"{music.file_path.stem}_info.json"
             info_path = Path(output_dir) / info_filename
             
-            with open(info_path, 'w', encoding='utf-8') as f:
-                json.dump(music.to_dict(), f, ensure_ascii=False, indent=2)
+            write_json(info_path, music.to_dict())
             
             print(f"音乐信息已保存到 {info_path}")
             return str(info_path)
         except Exception as e:
             print(f"保存音乐信息失败: {e}")
             return None
-    def download_audio(self, video, filename=None, output_dir=None):
-        """下载视频音频，并生成json和本地封面"""
+
+    def _stream_to_file(self, url, output_path, progress_callback=None, cancel_check=None):
+        """流式下载到临时文件，完成后再改名，避免留下不完整的文件
+
+        写入的同时计算内容哈希，成功时返回哈希值，失败时返回 None；
+        收到的字节数与 Content-Length 不符（连接中途断开）时视为失败
+        """
+        tmp_path = output_path.with_name(output_path.name + '.part')
+        hasher = content_hasher()
+        with self.session.get(url, timeout=60, stream=True) as res, self.bandwidth.transfer() as traffic_class:
+            if res.status_code != 200:
+                print(f"音频下载失败，状态码: {res.status_code}")
+                return None
+            total = int(res.headers.get('content-length') or 0) or None
+            downloaded = 0
+            start = time.perf_counter()
+            try:
+                with open(tmp_path, 'wb') as f:
+                    for chunk in res.iter_content(chunk_size=64 * 1024):
+                        if cancel_check and cancel_check():
+                            raise InterruptedError("下载已取消")
+                        if not chunk:
+                            continue
+                        f.write(chunk)
+                        hasher.update(chunk)
+                        downloaded += len(chunk)
+                        self.bandwidth.consume(len(chunk), traffic_class)
+                        if progress_callback:
+                            progress_callback(downloaded, total)
+                if total is not None and downloaded != total:
+                    tmp_path.unlink(missing_ok=True)
+                    print(f"音频下载不完整: 收到 {downloaded} 字节，应为 {total} 字节")
+                    log_event('download_truncated', path=str(output_path), bytes=downloaded, expected=total)
+                    return None
+                tmp_path.replace(output_path)
+            except BaseException:
+                tmp_path.unlink(missing_ok=True)
+                raise
+            finally:
+                DOWNLOAD_BYTES.inc(downloaded)
+        elapsed = time.perf_counter() - start
+        if elapsed > 0:
+            DOWNLOAD_SPEED.observe(downloaded / elapsed)
+        log_event('download_audio', path=str(output_path), bytes=downloaded,
+                  duration_ms=round(elapsed * 1000, 3))
+        return hasher.hexdigest()
+
+    def _api_get(self, url, params=None, timeout=30):
+        """请求 API 接口，返回带 status_code 和 json() 的响应；有异步引擎时交给引擎，否则使用 requests"""
+        if self.engine is not None:
+            return self.engine.get(url, params=params, timeout=timeout)
+        return self.session.get(url, params=params, timeout=timeout)
+
+    def _output_path(self, video, output_dir, filename):
+        """确定音频的保存路径；未指定输出目录和文件名时按下载目录布局决定
+
+        自动命名时若同名文件属于另一个视频（flat 布局或指定了输出目录），改用带 BV 号的文件名，不覆盖
+        """
+        if output_dir is None and filename is None:
+            output_path = self.layout.audio_path(video)
+            if self.layout.unique_names:
+                return output_path
+        else:
+            output_path = Path(output_dir or self.layout.root) / (filename or safe_filename(video.title))
+        if filename is not None or self.content_index is None:
+            return output_path
+        entry = self.content_index.get(output_path)
+        if output_path.exists() and entry and entry.get('cid') and entry['cid'] != video.cid:
+            output_path = output_path.with_name(
+                safe_filename(f"{output_path.stem} ({video.bvid or video.avid})", output_path.suffix))
+        return output_path
+
+    def _read_saved_music(self, output_path):
+        """读取已保存的曲目信息：优先读音频旁的 json，其次读音频标签"""
+        info_path = output_path.with_name(f"{output_path.stem}.json")
+        if info_path.exists():
+            try:
+                return Music.from_dict(read_json(info_path))
+            except Exception as e:
+                print(f"读取音乐信息失败: {e}")
+        if self.metadata_storage == STORAGE_TAGS:
+            info = read_tags(output_path)
+            if info:
+                return Music.from_dict(info)
+        return None
+
+    def _reuse_existing(self, video, output_path, cover_path, cover=None):
+        """同一 cid 的音频已经下载过时不再请求：就在目标位置则直接返回，否则硬链接（或复制）过去"""
+        existing = self.content_index.find_cid(video.cid)
+        if existing is None:
+            return None
+        entry = self.content_index.get(existing)
+        if Path(existing) == output_path:
+            music = self._read_saved_music(output_path)
+            if music:
+                log_event('download_skipped', path=str(output_path), cid=video.cid)
+                return music
+        else:
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            linked = link_or_copy(existing, output_path)
+            self.content_index.record(output_path, entry['hash'], video.cid)
+            log_event('download_reused', source=existing, path=str(output_path), cid=video.cid, linked=linked)
+            print(f"音频已存在，{'硬链接' if linked else '复制'}到 {output_path}")
+            if self.metadata_storage == STORAGE_TAGS:
+                # 链接过来的文件已带有同一 cid 的标签，不再改写，保持硬链接
+                info = read_tags(output_path)
+                if info and info['cid'] == video.cid:
+                    return Music.from_dict(dict(info, content_hash=entry['hash']))
+        return self._save_music(video, output_path, cover_path, entry['hash'], cover)
+
+    def _deduplicate(self, video, output_path, content_hash):
+        """新下载的内容与已有文件相同时，换成已有文件的硬链接以节省磁盘空间，并记入索引"""
+        if self.content_index is None:
+            return
+        duplicate = self.content_index.find_hash(content_hash, exclude=output_path)
+        if duplicate is not None and DEDUP_HARDLINK and link_or_copy(duplicate, output_path, copy=False):
+            log_event('download_deduplicated', source=duplicate, path=str(output_path), cid=video.cid)
+            print(f"音频内容与 {duplicate} 相同，已改为硬链接")
+        self.content_index.record(output_path, content_hash, video.cid)
+
+    def _save_music(self, video, output_path, cover_path, content_hash, cover=None):
+        """下载封面（未提供时），创建音乐对象并保存曲目信息
+
+        sidecar 方式在音频旁生成 json 和封面文件；tags 方式把信息和封面（cover 为已下载的封面）写入音频标签，
+        写入失败时退回 sidecar 方式。
+        """
+        if self.metadata_storage == STORAGE_TAGS:
+            if cover is None and video.pic:
+                cover = self.fetch_cover(video.pic)
+            cover_path = None
+        elif cover_path is None and video.pic:
+            cover_path = self.download_cover_image(video.pic, output_path.parent, output_path.stem)
+
+        music = Music(
+            file_path=str(output_path),
+            title=video.title,
+            album=video.album or video.title, # 分P归入投稿标题对应的专辑
+            duration=video.duration,
+            bv_id=video.bvid,
+            pic=video.pic,
+            cover_path=cover_path,
+            cid=video.cid,
+            page=video.page,
+            content_hash=content_hash,
+            cover_embedded=bool(cover) and self.metadata_storage == STORAGE_TAGS
+        )
+
+        saved = self.save_music_info(music, cover[0] if cover else None)
+        if music.cover_embedded and saved.suffix == '.json':
+            # 标签写入失败，封面也改为单独保存
+            music.cover_embedded = False
+            music.cover_path = self._write_cover(cover, output_path.parent, output_path.stem)
+            self.save_music_info(music)
+        return music
+
+    def save_music_info(self, music, cover=None):
+        """保存曲目信息，扫描下载目录时据此重建音乐库；返回保存的位置
+
+        tags 方式写入音频标签（cover 为要嵌入的封面数据，None 时保留已有封面），写入会改变文件内容，
+        之后重新计算内容哈希；sidecar 方式或写入标签失败时在音频旁写入与音频同名的 json。
+        """
+        if self.metadata_storage == STORAGE_TAGS and not music.cover_path and write_tags(music, cover):
+            music.content_hash = hash_file(music.file_path)
+            if self.content_index is not None:
+                self.content_index.record(music.file_path, music.content_hash, music.cid)
+            return music.file_path
+
+        info_path = music.file_path.with_name(f"{music.file_path.stem}.json")
+        write_json(info_path, music.to_dict())
+
+        print(f"音乐信息已保存到 {info_path}")
+        return info_path
+
+    def download_audio(self, video, filename=None, output_dir=None, progress_callback=None, cancel_check=None,
+                       retry_on_auth_error=True, cover_path=None, reuse_existing=True, cover=None):
+        """下载视频音频，并保存曲目信息和封面（json 和本地封面，或音频标签）
+
+        progress_callback(downloaded, total) 用于汇报下载进度，cancel_check() 返回 True 时中止下载；
+        传入 cover_path（sidecar 方式）或 cover（tags 方式，封面数据和扩展名）时直接使用已下载的封面。
+        reuse_existing 为 True 时，内容索引中已有同一 cid 的音频则不再下载；重新下载损坏的文件时应传 False
+        """
         if not video.cid or (not video.avid and not video.bvid):
             print("视频信息不完整，无法下载音频")
             return None
-        
-        if output_dir is None:
-            output_dir = DOWNLOAD_DIR
-        
-        if filename is None:
-            # 清理文件名中的非法字符
-            safe_title = video.title.replace('/', '_').replace('\\', '_').replace(':', '_').replace('*', '_').replace('?', '_').replace('"', '_').replace('<', '_').replace('>', '_').replace('|', '_')
-            filename = f"{safe_title}.mp3"
-        
-        output_path = Path(output_dir) / filename
-        filename_base = output_path.stem  # 用于生成封面和信息文件名
-        
-        download_url = f"{BILIBILI_API['base_url']}/x/player/wbi/playurl"
-        
+
+        output_path = self._output_path(video, output_dir, filename)
+
+        if reuse_existing and self.content_index is not None:
+            music = self._reuse_existing(video, output_path, cover_path, cover)
+            if music:
+                return music
+
         try:
-            img_key, sub_key = wbi.getWbiKeys()
-            params = wbi.encWbi(
-                params={
-                    'aid': video.avid,
-                    'bvid': video.bvid,
-                    'cid': video.cid,
-                    'fnval': 16,  # 请求 dash 视频流
-                },
-                img_key=img_key,
-                sub_key=sub_key
-            )
-            
-            headers = {
-                "User-Agent": BILIBILI_API['user_agent'],
-                "Referer": "https://www.bilibili.com/"
-            }
-            
-            res = self.session.get(download_url, params=params, headers=headers, timeout=30)
+            res = self._request_playurl(video)
             if res.status_code == 200:
                 data = res.json()
                 if data.get('code') == 0:
@@ -109,48 +296,133 @@ class DownloadService:
                     audio_url = video_data['dash']['audio'][0]['baseUrl']
                     
                     # 下载音频文件
-                    audio_res = self.session.get(audio_url, headers=headers, timeout=60)
-                    if audio_res.status_code == 200:
-                        # 确保输出目录存在
-                        output_path.parent.mkdir(parents=True, exist_ok=True)
-                        
-                        with open(output_path, 'wb') as f:
-                            f.write(audio_res.content)
+                    # 确保输出目录存在
+                    output_path.parent.mkdir(parents=True, exist_ok=True)
+                    content_hash = self._stream_to_file(audio_url, output_path, progress_callback, cancel_check)
+                    if content_hash:
                         print(f"音频已下载到 {output_path}")
-                        
-                        # 下载封面图片
-                        cover_path = None
-                        if video.pic:
-                            cover_path = self.download_cover_image(video.pic, output_dir, filename_base)
-                        
-                        # 创建音乐对象
-                        music = Music(
-                            file_path=str(output_path),
-                            title=video.title,
-                            album=video.title, # Use title as a fallback for album
-                            bv_id=video.bvid,
-                            pic=video.pic,
-                            cover_path=cover_path
-                        )
-                        
-                        # 生成json
-                        info_filename = f"{output_path.stem}.json"
-                        info_path = Path(output_dir) / info_filename
-                        with open(info_path, 'w', encoding='utf-8') as f:
-                            json.dump(music.to_dict(), f, ensure_ascii=False, indent=2)
-                        
-                        print(f"音乐信息已保存到 {info_path}")
-                        return music
+                        if self.metadata_storage == STORAGE_TAGS:
+                            # 写入标签会改变文件内容，按写入后的内容去重
+                            music = self._save_music(video, output_path, cover_path, content_hash, cover)
+                            self._deduplicate(video, output_path, music.content_hash)
+                            return music
+                        self._deduplicate(video, output_path, content_hash)
+                        return self._save_music(video, output_path, cover_path, content_hash)
                     else:
-                        print(f"音频下载失败，状态码: {audio_res.status_code}")
                         return None
                 else:
                     error_msg = data.get('message', '未知错误')
                     print(f"获取下载链接失败: {error_msg}")
+                    # 登录失效时刷新 Cookie 后重试一次
+                    if self.auth_service.handle_api_error(data.get('code')) and retry_on_auth_error:
+                        return self.download_audio(video, filename, output_dir, progress_callback,
+                                                   cancel_check, retry_on_auth_error=False, cover_path=cover_path,
+                                                   reuse_existing=False, cover=cover)
                     return None
             else:
                 print(f"请求失败，状态码: {res.status_code}")
                 return None
         except Exception as e:
             print(f"下载音频时发生错误: {e}")
-            return None
\ No newline at end of file
+            return None
+
+    def _request_playurl(self, video):
+        """请求视频（分P）的播放地址接口（dash 格式），返回响应"""
+        img_key, sub_key = self.auth_service.get_wbi_keys()
+        params = wbi.encWbi(
+            params={
+                'aid': video.avid,
+                'bvid': video.bvid,
+                'cid': video.cid,
+                'fnval': 16,  # 请求 dash 视频流
+            },
+            img_key=img_key,
+            sub_key=sub_key
+        )
+        return self._api_get(f"{BILIBILI_API['base_url']}/x/player/wbi/playurl", params=params, timeout=30)
+
+    def resolve_audio_url(self, video, retry_on_auth_error=True):
+        """只解析音频流地址而不下载（用于边下边播），失败时返回 None"""
+        if not video.cid or (not video.avid and not video.bvid):
+            return None
+        try:
+            res = self._request_playurl(video)
+            if res.status_code != 200:
+                print(f"请求失败，状态码: {res.status_code}")
+                return None
+            data = res.json()
+            if data.get('code') == 0:
+                return data['data']['dash']['audio'][0]['baseUrl']
+            print(f"获取播放地址失败: {data.get('message', '未知错误')}")
+            if self.auth_service.handle_api_error(data.get('code')) and retry_on_auth_error:
+                return self.resolve_audio_url(video, retry_on_auth_error=False)
+        except Exception as e:
+            print(f"解析播放地址时发生错误: {e}")
+        return None
+
+    def download_parts(self, video, selection=None, output_dir=None, progress_callback=None, cancel_check=None,
+                       max_workers=None):
+        """并行下载多P投稿的各个分P，每个分P单独解析播放地址并保存为一首曲目
+
+        selection 同 Video.select_pages；返回与所选分P顺序一致的列表，下载失败的位置为 None。
+        progress_callback(downloaded, total) 汇报所有分P合计的进度，总大小在全部分P开始下载后才确定。
+        """
+        pages = video.select_pages(selection)
+        if not pages:
+            print(f"没有选中任何分P: {video.title}")
+            return []
+
+        # 未指定输出目录时各分P的位置由下载目录布局决定
+        if output_dir is None:
+            paths = {page['page']: self.layout.audio_path(video.part_video(page)) for page in pages}
+            cover_dir, cover_base = self.layout.shared_cover_base(video)
+        else:
+            output_dir = Path(output_dir)
+            paths = {page['page']: output_dir / part_filename(video.title, page['page']) for page in pages}
+            cover_dir, cover_base = output_dir, safe_filename(video.title, suffix='')
+
+        # 同一投稿的封面只下载一次，各分P共用
+        cover_dir.mkdir(parents=True, exist_ok=True)
+        if self.metadata_storage == STORAGE_TAGS:
+            cover_path = None
+            cover = self.fetch_cover(video.pic)
+        else:
+            cover_path = self.download_cover_image(video.pic, cover_dir, cover_base)
+            cover = None
+        progress = {}
+        lock = threading.Lock()
+
+        def report(page_number, downloaded, total):
+            if not progress_callback:
+                return
+            with lock:
+                progress[page_number] = (downloaded, total)
+                done = sum(item[0] for item in progress.values())
+                totals = [item[1] for item in progress.values()]
+                known = len(progress) == len(pages) and all(totals)
+                progress_callback(done, sum(totals) if known else None)
+
+        # 工作线程中沿用调用方的流量类别
+        traffic_class = current_class()
+
+        def download(page):
+            part = video.part_video(page)
+            with traffic_scope(traffic_class):
+                return self.download_audio(
+                    part,
+                    filename=paths[page['page']].name,
+                    output_dir=paths[page['page']].parent,
+                    progress_callback=lambda done, total: report(page['page'], done, total),
+                    cancel_check=cancel_check,
+                    cover_path=cover_path,
+                    cover=cover
+                )
+
+        workers = min(len(pages), max_workers or PART_DOWNLOAD_WORKERS)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='part') as executor:
+            results = list(executor.map(download, pages))
+        log_event('download_parts', bvid=video.bvid, parts=len(pages), workers=workers,
+                  succeeded=sum(1 for music in results if music),
+                  duration_ms=round((time.perf_counter() - start) * 1000, 3))
+        return results
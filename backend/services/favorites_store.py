@@ -0,0 +1,284 @@
+# File: backend/services/favorites_store.py
+# 收藏夹的本地存储：每个收藏夹的视频单独保存，按需读取和分页，不再一次加载全部收藏
+# 另有一份只含 BV 号、标题和时长的列式索引，用于跨收藏夹的搜索和筛选
+import bisect
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from core.config import FAVORITES_CACHE_FILE, FAVORITES_CACHED_FOLDERS, FAVORITES_DIR
+from core.log import log_event
+from core.serialization import load_document, save_document, snapshot_path
+
+FAVORITES_PAGE_SIZE = 50
+FAVORITES_MAX_PAGE_SIZE = 500
+
+
+def _index_title(title):
+    # 索引中的标题统一小写，换行替换为空格，保证拼接后每个标题占一行
+    return (title or '').casefold().replace('\n', ' ')
+
+
+class _FolderIndex:
+    """单个收藏夹的列式索引：bvids、titles、durations 三列按收藏顺序排列"""
+
+    def __init__(self, bvids, titles, durations):
+        self.bvids = bvids
+        self.titles = titles
+        self.durations = durations
+        self._blob = None
+        self._starts = None
+
+    @classmethod
+    def from_videos(cls, videos):
+        return cls(
+            [video.get('bvid') for video in videos],
+            [_index_title(video.get('title')) for video in videos],
+            [video.get('duration') or 0 for video in videos]
+        )
+
+    def to_dict(self):
+        return {'bvids': self.bvids, 'titles': self.titles, 'durations': self.durations}
+
+    def __len__(self):
+        return len(self.bvids)
+
+    def match_keyword(self, keyword, start=0):
+        """按顺序返回标题包含 keyword 的行号；在拼接后的标题文本上查找，不逐行比较"""
+        if self._blob is None:
+            self._blob = '\n'.join(self.titles)
+            self._starts = []
+            offset = 0
+            for title in self.titles:
+                self._starts.append(offset)
+                offset += len(title) + 1
+        if start >= len(self.titles):
+            return
+        # keyword 经过 _index_title 处理，不含换行，命中位置一定落在某个标题内
+        position = self._starts[start]
+        while True:
+            position = self._blob.find(keyword, position)
+            if position < 0:
+                return
+            row = bisect.bisect_right(self._starts, position) - 1
+            yield row
+            if row + 1 >= len(self._starts):
+                return
+            position = self._starts[row + 1]
+
+
+class FavoritesStore:
+    """收藏夹存储
+
+    - folders 文档：收藏夹列表（ID、名称、数量、更新时间）和所有收藏夹的列式索引
+    - folder_<ID> 文档：单个收藏夹的完整视频列表，分页读取时才加载，最近用过的几个保留在内存中
+
+    刷新时每抓完一个收藏夹就写入它的文档，不需要在内存中保留全部收藏。
+    """
+
+    def __init__(self, directory=None, cached_folders=FAVORITES_CACHED_FOLDERS):
+        self.directory = Path(directory or FAVORITES_DIR)
+        self.cached_folders = cached_folders
+        self._lock = threading.Lock()
+        self._folders = []
+        self._index = {}
+        self._cache = OrderedDict()
+        self._load()
+
+    def _folders_file(self):
+        return self.directory / 'folders.json'
+
+    def _folder_file(self, folder_id):
+        return self.directory / f'folder_{folder_id}.json'
+
+    def _load(self):
+        try:
+            data = load_document(self._folders_file())
+        except Exception as e:
+            print(f"加载收藏夹索引失败: {e}")
+            data = None
+        if data is None:
+            return
+        self._folders = data.get('folders', [])
+        self._index = {
+            key: _FolderIndex(cols['bvids'], cols['titles'], cols['durations'])
+            for key, cols in data.get('index', {}).items()
+        }
+
+    def _save_folders(self):
+        # 调用方持有 self._lock
+        data = {
+            'folders': self._folders,
+            'index': {key: index.to_dict() for key, index in self._index.items()}
+        }
+        save_document(self._folders_file(), data)
+
+    def is_empty(self):
+        return not self._folders
+
+    def list_folders(self):
+        """收藏夹列表，不含视频；count 为本地保存的有效视频数"""
+        with self._lock:
+            return [dict(folder) for folder in self._folders]
+
+    def get_folder(self, folder_id):
+        with self._lock:
+            return next((dict(folder) for folder in self._folders if str(folder['id']) == str(folder_id)), None)
+
+    def write_folder(self, folder, videos):
+        """保存一个收藏夹的视频（刷新时每抓完一个调用一次），并更新收藏夹列表和索引"""
+        key = str(folder['id'])
+        meta = {
+            'id': folder['id'],
+            'title': folder.get('title'),
+            'media_count': folder.get('media_count', len(videos)),
+            'count': len(videos),
+            'updated_at': time.time()
+        }
+        # 先写收藏夹文档再写索引，中途退出时索引最多落后于文档，读取时会校验
+        save_document(self._folder_file(key), videos)
+        with self._lock:
+            self._cache.pop(key, None)
+            self._index[key] = _FolderIndex.from_videos(videos)
+            position = next((i for i, item in enumerate(self._folders) if str(item['id']) == key), None)
+            if position is None:
+                self._folders.append(meta)
+            else:
+                self._folders[position] = meta
+            self._save_folders()
+        return meta
+
+    def retain_folders(self, folder_ids):
+        """刷新结束后按服务端的顺序排列收藏夹，删除已不存在的收藏夹"""
+        order = {str(folder_id): position for position, folder_id in enumerate(folder_ids)}
+        with self._lock:
+            removed = [folder for folder in self._folders if str(folder['id']) not in order]
+            self._folders = sorted(
+                (folder for folder in self._folders if str(folder['id']) in order),
+                key=lambda folder: order[str(folder['id'])]
+            )
+            for folder in removed:
+                key = str(folder['id'])
+                self._index.pop(key, None)
+                self._cache.pop(key, None)
+            self._save_folders()
+        for folder in removed:
+            path = self._folder_file(folder['id'])
+            path.unlink(missing_ok=True)
+            snapshot_path(path).unlink(missing_ok=True)
+
+    def _folder_videos(self, key):
+        with self._lock:
+            videos = self._cache.get(key)
+            if videos is not None:
+                self._cache.move_to_end(key)
+                return videos
+        try:
+            videos = load_document(self._folder_file(key), default=[])
+        except Exception as e:
+            print(f"加载收藏夹 {key} 失败: {e}")
+            videos = []
+        with self._lock:
+            self._cache[key] = videos
+            while len(self._cache) > self.cached_folders:
+                self._cache.popitem(last=False)
+        return videos
+
+    def folder_videos(self, folder_id):
+        """单个收藏夹的全部视频（用于同步和镜像，一次只加载一个收藏夹）"""
+        return list(self._folder_videos(str(folder_id)))
+
+    def get_page(self, folder_id, cursor=0, limit=FAVORITES_PAGE_SIZE):
+        """分页读取收藏夹的视频：cursor 为起始位置，返回本页视频和下一页的 cursor（没有更多时为 None）"""
+        cursor = max(int(cursor or 0), 0)
+        limit = min(max(int(limit or FAVORITES_PAGE_SIZE), 1), FAVORITES_MAX_PAGE_SIZE)
+        videos = self._folder_videos(str(folder_id))
+        page = videos[cursor:cursor + limit]
+        next_cursor = cursor + len(page)
+        return {
+            'videos': [dict(video) for video in page],
+            'next_cursor': next_cursor if next_cursor < len(videos) else None,
+            'total': len(videos)
+        }
+
+    def search(self, keyword=None, min_duration=None, max_duration=None, downloaded=None,
+               downloaded_bvids=None, folder_id=None, cursor=0, limit=FAVORITES_PAGE_SIZE):
+        """在所有收藏夹（或 folder_id 指定的收藏夹）中搜索
+
+        keyword 匹配标题子串（不区分大小写），时长单位为秒；downloaded 为 True/False 时按 BV 号是否在
+        downloaded_bvids 中筛选。只扫描索引，命中的视频才从收藏夹文档读取。cursor 为索引中的行号，
+        total 为全部命中数，同一 BV 号在多个收藏夹中出现时各算一次。
+        """
+        start = time.perf_counter()
+        cursor = max(int(cursor or 0), 0)
+        limit = min(max(int(limit or FAVORITES_PAGE_SIZE), 1), FAVORITES_MAX_PAGE_SIZE)
+        keyword = _index_title(keyword).strip()
+        if downloaded is not None and downloaded_bvids is None:
+            downloaded_bvids = set()
+
+        with self._lock:
+            folders = [
+                (folder, self._index.get(str(folder['id'])))
+                for folder in self._folders
+                if folder_id is None or str(folder['id']) == str(folder_id)
+            ]
+
+        hits = []
+        total = 0
+        next_cursor = None
+        row_base = 0
+        for folder, index in folders:
+            if index is None:
+                continue
+            rows = index.match_keyword(keyword) if keyword else range(len(index))
+            for row in rows:
+                duration = index.durations[row]
+                if min_duration is not None and duration < min_duration:
+                    continue
+                if max_duration is not None and duration > max_duration:
+                    continue
+                if downloaded is not None and (index.bvids[row] in downloaded_bvids) != bool(downloaded):
+                    continue
+                total += 1
+                position = row_base + row
+                if position < cursor:
+                    continue
+                if len(hits) < limit:
+                    hits.append((folder, row, index.bvids[row]))
+                elif next_cursor is None:
+                    next_cursor = position
+            row_base += len(index)
+
+        results = []
+        for folder, row, bvid in hits:
+            videos = self._folder_videos(str(folder['id']))
+            video = videos[row] if row < len(videos) else None
+            if video is None or video.get('bvid') != bvid:
+                # 索引与收藏夹文档不一致（刷新中途退出），按 BV 号重新查找
+                video = next((item for item in videos if item.get('bvid') == bvid), None)
+                if video is None:
+                    continue
+            results.append(dict(video, folder_id=folder['id'], folder_title=folder.get('title')))
+
+        log_event('favorites_search', keyword=keyword, hits=total, returned=len(results),
+                  duration_ms=round((time.perf_counter() - start) * 1000, 3))
+        return {'videos': results, 'next_cursor': next_cursor, 'total': total}
+
+    def migrate_legacy(self, legacy_file=None):
+        """把旧版整体缓存的收藏夹（favorites_cache）转换为按收藏夹保存，成功后删除旧文件"""
+        legacy_file = Path(legacy_file or FAVORITES_CACHE_FILE)
+        try:
+            favorites = load_document(legacy_file)
+        except Exception as e:
+            print(f"读取旧版收藏夹缓存失败: {e}")
+            return False
+        if not favorites:
+            return False
+        for folder in favorites:
+            self.write_folder(folder, folder.get('videos', []))
+        self.retain_folders([folder['id'] for folder in favorites])
+        legacy_file.unlink(missing_ok=True)
+        snapshot_path(legacy_file).unlink(missing_ok=True)
+        print(f"已转换旧版收藏夹缓存：{len(favorites)} 个收藏夹")
+        return True
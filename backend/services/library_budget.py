@@ -0,0 +1,191 @@
+# File: backend/services/library_budget.py
+# 音乐库磁盘预算：按最近播放时间维护 LRU 顺序，超出预算时在后台逐个移除最久未播放曲目的本地文件
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime
+
+from core.log import log_event
+from core.metrics import LIBRARY_BYTES, LIBRARY_EVICTIONS
+
+
+class LibraryBudget:
+    """跟踪音乐库本地文件的总大小，超出 budget（字节）时淘汰最久未播放的曲目
+
+    启动时按播放记录（没有播放过的按下载时间）排一次序，之后只通过音乐库的变更日志和播放事件
+    增量维护顺序和总大小，不重新扫描音乐库。被淘汰的曲目保留元数据，可以按需重新下载。
+    """
+
+    def __init__(self, music_service, play_history=None, budget=None):
+        self.music_service = music_service
+        self.play_history = play_history
+        self.budget = self._checked(budget)
+        self._lock = threading.Lock()
+        # 路径 -> 文件大小，最久未播放的在前
+        self._order = OrderedDict()
+        # 去重时同一内容的曲目硬链接到同一个文件：按 (st_dev, st_ino) 记录每个 inode 被几个曲目使用，
+        # 只有第一个计入总大小，最后一个移除时才真正释放空间
+        self._inodes = {}
+        self._links = Counter()
+        self._total = 0
+        self._version = None
+        self._epoch = None
+        self.evicted_count = 0
+        self.evicted_bytes = 0
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """开始在后台跟踪音乐库变化"""
+        self.music_service.add_change_listener(lambda version: self._wakeup.set())
+        self._thread = threading.Thread(target=self._run, name='library-budget', daemon=True)
+        self._thread.start()
+        self._wakeup.set()
+        return self
+
+    @staticmethod
+    def _checked(budget):
+        # 预算不大于 0 时淘汰永远无法结束，会移除所有曲目的本地文件；取消限制应传 None
+        if budget is not None and budget <= 0:
+            raise ValueError(f'磁盘预算必须大于 0: {budget}')
+        return budget
+
+    def set_budget(self, budget):
+        """设置预算（字节），None 表示不限制；不大于 0 时抛出 ValueError"""
+        self.budget = self._checked(budget)
+        self._wakeup.set()
+
+    def resync(self):
+        """曲目批量移动路径后（变更日志中为先删除再添加），按播放记录重新排一次 LRU 顺序"""
+        with self._lock:
+            self._version = None
+        self._wakeup.set()
+
+    def touch(self, key):
+        """曲目被播放，移到 LRU 顺序的末尾"""
+        with self._lock:
+            if key in self._order:
+                self._order.move_to_end(key)
+
+    def status(self):
+        with self._lock:
+            return {
+                'budget': self.budget,
+                'used': self._total,
+                'tracks': len(self._order),
+                'evicted': self.evicted_count,
+                'evicted_bytes': self.evicted_bytes
+            }
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            try:
+                self._apply_changes()
+                self._evict()
+            except Exception as e:
+                print(f"磁盘预算处理失败: {e}")
+
+    def _recency(self, music):
+        played = self.play_history.last_played(music.file_path) if self.play_history else None
+        if played:
+            return played
+        try:
+            return datetime.fromisoformat(music.download_time).timestamp()
+        except (TypeError, ValueError):
+            return 0
+
+    @staticmethod
+    def _file_id(music):
+        """文件大小和 inode；文件无法读取时 inode 为 None"""
+        try:
+            stat = os.stat(music.file_path)
+        except OSError:
+            return music.file_size, None
+        return stat.st_size, (stat.st_dev, stat.st_ino)
+
+    def _charge(self, key, music):
+        """记入曲目的大小（已在 _order 中时保持 LRU 位置）；同一 inode 只计一次"""
+        size, inode = self._file_id(music)
+        self._order[key] = size
+        if inode is not None:
+            self._inodes[key] = inode
+            self._links[inode] += 1
+            if self._links[inode] > 1:
+                return
+        self._total += size
+
+    def _release(self, key):
+        """不再计入曲目的大小（不从 _order 中移除），返回释放的字节数；inode 仍被其他曲目使用时为 0"""
+        size = self._order.get(key, 0)
+        inode = self._inodes.pop(key, None)
+        if inode is not None:
+            self._links[inode] -= 1
+            if self._links[inode]:
+                return 0
+            del self._links[inode]
+        self._total -= size
+        return size
+
+    def _apply_changes(self):
+        """读取上次处理之后的音乐库变更，更新 LRU 顺序和总大小"""
+        result = self.music_service.get_changes_since(self._version, self._epoch)
+        with self._lock:
+            if result['full']:
+                tracks = sorted((music for music in result['music'] if not music.evicted), key=self._recency)
+                self._order = OrderedDict()
+                self._inodes = {}
+                self._links = Counter()
+                self._total = 0
+                for music in tracks:
+                    self._charge(str(music.file_path), music)
+            else:
+                for change in result['changes']:
+                    key = change['key']
+                    music = change['music']
+                    present = change['op'] != 'remove' and music is not None and not music.evicted
+                    if not present:
+                        if key in self._order:
+                            self._release(key)
+                            del self._order[key]
+                    elif key in self._order:
+                        # 元数据更新不改变曲目在 LRU 中的位置；文件可能已被替换，重新记入大小和 inode
+                        self._release(key)
+                        self._charge(key, music)
+                    else:
+                        # 新下载或重新下载的曲目视为最近使用
+                        self._charge(key, music)
+            self._version = result['version']
+            self._epoch = result['epoch']
+            LIBRARY_BYTES.set(self._total)
+
+    def _evict(self):
+        """逐个移除最久未播放的曲目，直到总大小不超过预算；正在播放的曲目不会被移除"""
+        start = time.perf_counter()
+        count = 0
+        freed = 0
+        while True:
+            with self._lock:
+                if self.budget is None or self._total <= self.budget:
+                    break
+                protected = self.play_history.last_key if self.play_history else None
+                key = next((key for key in self._order if key != protected), None)
+                if key is None:
+                    break
+                # 与其他曲目硬链接的文件，移除它不会减少总大小，继续移除下一首
+                self._release(key)
+                del self._order[key]
+            freed += self.music_service.evict_music(key, save=False)
+            count += 1
+            LIBRARY_EVICTIONS.inc()
+        if not count:
+            return
+        self.music_service.save_music_library()
+        with self._lock:
+            self.evicted_count += count
+            self.evicted_bytes += freed
+            LIBRARY_BYTES.set(self._total)
+        log_event('library_budget_evict', tracks=count, freed=freed, used=self._total, budget=self.budget,
+                  duration_ms=round((time.perf_counter() - start) * 1000, 3))
@@ -0,0 +1,409 @@
+# File: backend/services/library_export.py
+# 把音乐库增量导出到外部目录（手机挂载点、NAS 共享、另一台机器的同步目录）：
+# 目标目录中的清单记录每个导出文件的来源、大小、修改时间和内容哈希，再次导出时只复制变化的部分，
+# 删除音乐库中已不存在的曲目；同一文件系统上优先使用 reflink 或硬链接
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from core.config import EXPORT_WORKERS
+from core.log import log_event
+from core.serialization import read_json, write_json
+from backend.services.library_layout import TITLE_MAX_LENGTH, safe_filename
+
+# 目标目录中的导出清单
+MANIFEST_NAME = '.bilibili_music_export.json'
+MANIFEST_VERSION = 1
+# 每完成多少个文件保存一次清单，中断后重新导出时最多重复复制这么多个文件
+MANIFEST_SAVE_INTERVAL = 500
+
+# mirror：保持下载目录中的相对路径（含 json 和封面），album：按“专辑/曲目”重新命名，只含音频和专辑封面
+EXPORT_MIRROR = 'mirror'
+EXPORT_ALBUM = 'album'
+EXPORT_LAYOUTS = (EXPORT_MIRROR, EXPORT_ALBUM)
+
+# Linux 上克隆文件内容（reflink，btrfs / xfs 等支持）的 ioctl
+FICLONE = 0x40049409
+
+
+def _reflink(source, target):
+    if not sys.platform.startswith('linux'):
+        return False
+    import fcntl
+
+    try:
+        with open(source, 'rb') as src, open(target, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return True
+    except OSError:
+        Path(target).unlink(missing_ok=True)
+        return False
+
+
+def clone_file(source, target, link=True):
+    """把 source 放到 target（先写临时文件再替换），返回使用的方式：reflink、hardlink 或 copy
+
+    link 为 True 且在同一文件系统上时，先尝试 reflink（不共享后续修改），再尝试硬链接。
+    """
+    target = Path(target)
+    tmp_path = target.with_name(target.name + '.part')
+    tmp_path.unlink(missing_ok=True)
+    method = 'copy'
+    if link and os.stat(source).st_dev == os.stat(target.parent).st_dev:
+        if _reflink(source, tmp_path):
+            method = 'reflink'
+        else:
+            try:
+                os.link(source, tmp_path)
+                method = 'hardlink'
+            except OSError:
+                pass
+    if method == 'copy':
+        shutil.copy2(source, tmp_path)
+    os.replace(tmp_path, target)
+    return method
+
+
+def audio_suffix(path):
+    """按文件头判断扩展名：B站下载的音频是 MP4 容器（m4a），文件名却是 .mp3，导出时改正而不转码"""
+    with open(path, 'rb') as f:
+        head = f.read(8)
+    if head[4:8] in (b'ftyp', b'styp'):
+        return '.m4a'
+    return Path(path).suffix.lower()
+
+
+def _clean_name(name):
+    """导出到 FAT/exFAT 等文件系统时，文件名末尾不能是空格或点"""
+    return safe_filename(name[:TITLE_MAX_LENGTH], suffix='').rstrip(' .') or '_'
+
+
+class LibraryExporter:
+    """按清单增量导出音乐库
+
+    清单保存在目标目录的 .bilibili_music_export.json 中，以目标相对路径为 key。来源的大小和修改时间与清单一致、
+    目标文件仍在时跳过；内容哈希与清单一致时只更新清单；曲目在音乐库中移动过时在目标目录中改名而不重新复制。
+    """
+
+    def __init__(self, music_service, content_index=None, favorites=None, max_workers=None):
+        self.music_service = music_service
+        self.content_index = content_index
+        self.favorites = favorites
+        self.max_workers = max_workers or EXPORT_WORKERS
+
+    @staticmethod
+    def load_manifest(target):
+        path = Path(target) / MANIFEST_NAME
+        if not path.exists():
+            return {'version': MANIFEST_VERSION, 'layout': None, 'entries': {}, 'playlists': []}
+        try:
+            manifest = read_json(path)
+        except Exception as e:
+            print(f"读取导出清单失败，将重新导出: {e}")
+            return {'version': MANIFEST_VERSION, 'layout': None, 'entries': {}, 'playlists': []}
+        manifest.setdefault('entries', {})
+        manifest.setdefault('playlists', [])
+        return manifest
+
+    @staticmethod
+    def save_manifest(target, manifest):
+        write_json(Path(target) / MANIFEST_NAME, manifest)
+
+    def _mirror_plan(self, tracks):
+        """mirror 布局：下载目录中的相对路径，下载目录以外的曲目放到 external/ 下
+
+        路径按字符串处理，json 是否存在从各目录的文件列表中查，大音乐库上不逐个构造 Path、不逐个 stat。
+        """
+        root = str(self.music_service.layout.root) + os.sep
+        files = set()
+        for directory in self.music_service.layout.iter_dirs():
+            with os.scandir(directory) as entries:
+                files.update(entry.path for entry in entries)
+
+        def relative(path):
+            if path.startswith(root):
+                return path[len(root):].replace(os.sep, '/')
+            return f"external/{os.path.basename(path)}"
+
+        plan = {}
+        for music in tracks:
+            source = str(music.file_path)
+            plan[relative(source)] = {'source': source, 'kind': 'audio', 'music': music}
+            sidecar = os.path.splitext(source)[0] + '.json'
+            if sidecar in files:
+                plan[relative(sidecar)] = {'source': sidecar, 'kind': 'sidecar'}
+            if music.cover_path and (music.cover_path in files or os.path.exists(music.cover_path)):
+                # 多P投稿的各分P共用一个封面，只导出一次
+                plan.setdefault(relative(music.cover_path), {'source': music.cover_path, 'kind': 'cover'})
+        return plan
+
+    def _album_plan(self, tracks, previous):
+        """album 布局：专辑目录下按分P序号和标题命名，音频按文件头改正扩展名，专辑封面为 cover.*"""
+        # 来源未变化的音频沿用清单中的扩展名，不必逐个打开文件
+        suffixes = {}
+        for relpath, entry in previous.items():
+            if entry.get('kind') == 'audio':
+                suffixes[(entry['source'], entry['size'], entry['mtime'])] = Path(relpath).suffix
+
+        plan = {}
+        used = set()
+        for music in sorted(tracks, key=lambda music: (music.album, music.page or 0, music.title)):
+            try:
+                stat = music.file_path.stat()
+            except OSError:
+                continue
+            suffix = suffixes.get((str(music.file_path), stat.st_size, stat.st_mtime)) \
+                or audio_suffix(music.file_path)
+            album = _clean_name(music.album or 'Unknown Album')
+            name = _clean_name(f"{music.page:02d} - {music.title}" if music.page else music.title)
+            relpath = f"{album}/{name}{suffix}"
+            if relpath.lower() in used:
+                relpath = f"{album}/{name} [{music.bv_id}-{music.cid}]{suffix}"
+            used.add(relpath.lower())
+            plan[relpath] = {'source': str(music.file_path), 'kind': 'audio', 'music': music}
+            if music.cover_path and os.path.exists(music.cover_path):
+                cover = f"{album}/cover{Path(music.cover_path).suffix.lower()}"
+                plan.setdefault(cover, {'source': music.cover_path, 'kind': 'cover'})
+        return plan
+
+    def _content_hashes(self, items):
+        """音频的内容哈希：内容索引中大小和修改时间一致的直接使用，其余先补全索引（并行计算）"""
+        if self.content_index is None:
+            return {}
+        stale = [(item['source'], item['music'].cid) for item in items
+                 if item['kind'] == 'audio' and not self._fresh_hash(item)]
+        if stale:
+            self.content_index.build(stale)
+        return {item['source']: self._fresh_hash(item) for item in items if item['kind'] == 'audio'}
+
+    def _fresh_hash(self, item):
+        entry = self.content_index.get(item['source'])
+        if entry and entry['size'] == item['size'] and entry['mtime'] == item['mtime']:
+            return entry['hash']
+        return None
+
+    @staticmethod
+    def _existing_files(target, relpaths):
+        """目标目录中已有的文件：每个用到的目录读取一次，不逐个 stat"""
+        existing = set()
+        for directory in {posix.rpartition('/')[0] for posix in relpaths}:
+            try:
+                with os.scandir(Path(target) / directory) as entries:
+                    for entry in entries:
+                        if entry.is_file():
+                            existing.add(f"{directory}/{entry.name}" if directory else entry.name)
+            except OSError:
+                continue
+        return existing
+
+    def export(self, target, layout=EXPORT_MIRROR, playlists=False, delete=True, link=True,
+               progress_callback=None, cancel_check=None):
+        """把音乐库导出到 target，返回统计信息
+
+        - layout：mirror 保持下载目录结构，album 按“专辑/曲目”重新命名
+        - playlists：为每个收藏夹在 target 下写一个 M3U 播放列表（只含已导出的曲目）
+        - delete：删除上次导出、但音乐库中已不存在的文件（只删除清单中记录的文件）
+        - link：同一文件系统上使用 reflink 或硬链接代替复制
+        """
+        if layout not in EXPORT_LAYOUTS:
+            raise ValueError(f'未知的导出布局: {layout}')
+        start = time.perf_counter()
+        target = Path(target)
+        target.mkdir(parents=True, exist_ok=True)
+        manifest = self.load_manifest(target)
+        if manifest.get('layout') in (None, layout):
+            previous, stale = manifest['entries'], {}
+        else:
+            # 布局改变后，旧布局下导出的文件都按删除处理（内容相同的改名到新位置）
+            previous, stale = {}, manifest['entries']
+
+        tracks = [music for music in list(self.music_service.music_library.values()) if not music.evicted]
+        if layout == EXPORT_ALBUM:
+            plan = self._album_plan(tracks, previous)
+        else:
+            plan = self._mirror_plan(tracks)
+
+        existing = self._existing_files(target, list(plan) + list(previous) + list(stale))
+        stats = {'unchanged': 0, 'copy': 0, 'reflink': 0, 'hardlink': 0, 'moved': 0, 'deleted': 0, 'failed': 0,
+                 'bytes': 0}
+        changed = []
+        for relpath, item in list(plan.items()):
+            try:
+                stat = os.stat(item['source'])
+            except OSError:
+                # 音频已缺失的记录不导出，上次导出的文件按删除处理
+                del plan[relpath]
+                continue
+            item['size'], item['mtime'] = stat.st_size, stat.st_mtime
+            entry = previous.get(relpath)
+            if entry and relpath in existing and entry['source'] == item['source'] \
+                    and entry['size'] == item['size'] and entry['mtime'] == item['mtime']:
+                stats['unchanged'] += 1
+                continue
+            changed.append((relpath, item))
+
+        hashes = self._content_hashes([item for _, item in changed])
+        entries = {relpath: entry for relpath, entry in previous.items() if relpath in plan}
+        # 清单中将被删除的文件按内容哈希索引，曲目在音乐库中移动后直接在目标目录中改名
+        removed = {relpath: entry for relpath, entry in {**stale, **previous}.items() if relpath not in plan}
+        movable = {entry['hash']: relpath for relpath, entry in removed.items()
+                   if entry.get('hash') and relpath in existing}
+
+        pending = []
+        for relpath, item in changed:
+            content_hash = hashes.get(item['source'])
+            entry = previous.get(relpath)
+            record = {'source': item['source'], 'kind': item['kind'], 'size': item['size'],
+                      'mtime': item['mtime'], 'hash': content_hash}
+            if entry and relpath in existing and content_hash and entry.get('hash') == content_hash:
+                # 内容没变（如只是修改时间变了），只更新清单
+                entries[relpath] = record
+                stats['unchanged'] += 1
+            elif content_hash in movable and relpath not in existing:
+                old = movable.pop(content_hash)
+                destination = target / relpath
+                try:
+                    destination.parent.mkdir(parents=True, exist_ok=True)
+                    os.replace(target / old, destination)
+                except OSError as e:
+                    # 改名失败（如目标目录中的文件被占用或已被删除）时改为重新复制，旧文件按过期文件处理
+                    print(f"导出目录中改名失败 {old} -> {relpath}: {e}，改为复制")
+                    pending.append((relpath, record))
+                    continue
+                removed.pop(old)
+                entries[relpath] = record
+                stats['moved'] += 1
+            else:
+                pending.append((relpath, record))
+
+        def copy(job):
+            relpath, record = job
+            if cancel_check and cancel_check():
+                return relpath, None
+            destination = target / relpath
+            try:
+                destination.parent.mkdir(parents=True, exist_ok=True)
+                return relpath, clone_file(record['source'], destination, link)
+            except OSError as e:
+                print(f"导出文件失败 {record['source']}: {e}")
+                return relpath, 'failed'
+
+        manifest = {'version': MANIFEST_VERSION, 'layout': layout, 'entries': entries,
+                    'playlists': manifest.get('playlists', [])}
+        if pending:
+            records = dict(pending)
+            workers = min(len(pending), self.max_workers)
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='export') as executor:
+                futures = [executor.submit(copy, job) for job in pending]
+                for index, future in enumerate(as_completed(futures), 1):
+                    relpath, method = future.result()
+                    if method is not None:
+                        stats[method] += 1
+                        if method != 'failed':
+                            entries[relpath] = dict(records[relpath], method=method)
+                            if method == 'copy':
+                                stats['bytes'] += records[relpath]['size']
+                    if index % MANIFEST_SAVE_INTERVAL == 0:
+                        self.save_manifest(target, manifest)
+                    if progress_callback:
+                        progress_callback(index, len(pending))
+
+        cancelled = bool(cancel_check and cancel_check())
+        if delete and not cancelled:
+            for relpath, entry in removed.items():
+                path = target / relpath
+                try:
+                    path.unlink()
+                    stats['deleted'] += 1
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print(f"删除导出文件失败 {path}: {e}")
+                    entries[relpath] = entry
+                    continue
+                self._remove_empty_dirs(target, path.parent)
+        else:
+            # 保留（或因中断未删除）的旧文件仍记在清单中，之后再同步时可以删除
+            for relpath, entry in removed.items():
+                entries.setdefault(relpath, entry)
+
+        written_playlists = 0
+        if playlists and self.favorites is not None and not cancelled:
+            written_playlists = self._write_playlists(target, entries, manifest, delete)
+        elif delete and not cancelled:
+            # 这次不导出播放列表，之前写的列表中的路径可能已失效
+            for name in manifest.get('playlists', []):
+                (target / name).unlink(missing_ok=True)
+            manifest['playlists'] = []
+        self.save_manifest(target, manifest)
+
+        duration = time.perf_counter() - start
+        result = {
+            'target': str(target),
+            'layout': layout,
+            'files': len(plan),
+            'copied': stats['copy'],
+            'reflinked': stats['reflink'],
+            'hardlinked': stats['hardlink'],
+            'moved': stats['moved'],
+            'unchanged': stats['unchanged'],
+            'deleted': stats['deleted'],
+            'failed': stats['failed'],
+            'copied_bytes': stats['bytes'],
+            'playlists': written_playlists,
+            'cancelled': cancelled,
+            'seconds': round(duration, 3)
+        }
+        log_event('library_export', **{key: value for key, value in result.items() if key != 'target'},
+                  duration_ms=round(duration * 1000, 3))
+        return result
+
+    @staticmethod
+    def _remove_empty_dirs(target, directory):
+        while directory != target:
+            try:
+                directory.rmdir()
+            except OSError:
+                return
+            directory = directory.parent
+
+    def _write_playlists(self, target, entries, manifest, delete):
+        """每个收藏夹一个 M3U 播放列表（UTF-8），按收藏顺序列出已导出的曲目；内容没变时不重写"""
+        by_bvid = {}
+        for relpath, entry in entries.items():
+            if entry.get('kind') != 'audio':
+                continue
+            music = self.music_service.get_music_by_path(entry['source'])
+            if music is not None and music.bv_id:
+                by_bvid.setdefault(music.bv_id, []).append((music.page or 0, relpath, music))
+
+        written = []
+        for folder in self.favorites.list_folders():
+            lines = ['#EXTM3U']
+            for video in self.favorites.folder_videos(folder['id']):
+                for _, relpath, music in sorted(by_bvid.get(video.get('bvid'), ())):
+                    lines.append(f"#EXTINF:{int(music.duration or 0)},{music.title}")
+                    lines.append(relpath)
+            if len(lines) == 1:
+                continue
+            name = f"{_clean_name(folder.get('title') or str(folder['id']))}.m3u8"
+            content = '\n'.join(lines) + '\n'
+            path = target / name
+            try:
+                if not path.exists() or path.read_text(encoding='utf-8') != content:
+                    path.write_text(content, encoding='utf-8')
+            except OSError as e:
+                print(f"写入播放列表失败 {path}: {e}")
+                continue
+            written.append(name)
+
+        if delete:
+            for name in set(manifest.get('playlists', [])) - set(written):
+                (target / name).unlink(missing_ok=True)
+            manifest['playlists'] = written
+        else:
+            manifest['playlists'] = sorted(set(manifest.get('playlists', [])) | set(written))
+        return len(written)
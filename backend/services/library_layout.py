@@ -0,0 +1,263 @@
+# File: backend/services/library_layout.py
+# 下载目录的布局：音频、json 和封面放在哪个目录、叫什么文件名，统一由这里决定
+# flat：全部放在下载目录下，按标题命名；sharded：按 BV 号的哈希分到 256 个子目录，文件名带 BV 号和 cid，不会重名
+# （旧版下载的曲目没有记录 cid，文件名只带 BV 号）
+import errno
+import hashlib
+import os
+import re
+import shutil
+import time
+from pathlib import Path
+from urllib.parse import quote
+
+from core.config import DOWNLOAD_DIR, LAYOUT_MIGRATION_BATCH, LIBRARY_LAYOUT
+from core.log import log_event
+from core.serialization import write_json
+
+LAYOUT_FLAT = 'flat'
+LAYOUT_SHARDED = 'sharded'
+
+# 分片子目录名：BV 号 SHA-1 的前两位十六进制
+SHARD_PATTERN = re.compile(r'^[0-9a-f]{2}$')
+# sharded 布局下文件名中标题部分的最大长度，避免超出文件系统的文件名长度限制
+TITLE_MAX_LENGTH = 80
+
+# 文件名中不允许出现的字符
+UNSAFE_FILENAME_CHARS = '/\\:*?"<>|'
+
+
+def safe_filename(title, suffix='.mp3'):
+    """根据视频标题生成下载文件名，非法字符替换为下划线"""
+    for char in UNSAFE_FILENAME_CHARS:
+        title = title.replace(char, '_')
+    return f"{title}{suffix}"
+
+
+def part_filename(title, page, suffix='.mp3'):
+    """多P投稿中单个分P的文件名，按序号命名以便判断是否已下载"""
+    return safe_filename(f"{title} - P{page:02d}", suffix)
+
+
+def shard_name(video_id):
+    return hashlib.sha1(str(video_id).encode('utf-8')).hexdigest()[:2]
+
+
+class LibraryLayout:
+    """音乐库下载目录的路径规则
+
+    下载、扫描、删除、淘汰和媒体服务器都通过这里得到文件位置；两种布局下的文件可以同时存在，
+    扫描时都会读取，便于从 flat 在线迁移到 sharded。
+    """
+
+    def __init__(self, root=None, mode=None):
+        self.root = Path(root or DOWNLOAD_DIR)
+        self.mode = mode or LIBRARY_LAYOUT
+        if self.mode not in (LAYOUT_FLAT, LAYOUT_SHARDED):
+            raise ValueError(f'未知的下载目录布局: {self.mode}')
+
+    @property
+    def unique_names(self):
+        """文件名是否由视频 ID 决定（不会与其他视频重名）"""
+        return self.mode == LAYOUT_SHARDED
+
+    def track_dir(self, video_id):
+        if self.mode == LAYOUT_FLAT:
+            return self.root
+        return self.root / shard_name(video_id)
+
+    def _track_path(self, title, album, video_id, cid, page):
+        if self.mode == LAYOUT_FLAT:
+            filename = part_filename(album or title, page) if page else safe_filename(title)
+        else:
+            # 分P以投稿标题加序号命名，与 flat 布局一致，再附上 BV 号和 cid
+            base = (album or title) if page else title
+            base = base[:TITLE_MAX_LENGTH]
+            if page:
+                base = f"{base} - P{page:02d}"
+            filename = safe_filename(f"{base} [{video_id}-{cid}]" if cid else f"{base} [{video_id}]")
+        return self.track_dir(video_id) / filename
+
+    def audio_path(self, video):
+        """新下载的视频（或分P）在音乐库中的音频路径"""
+        video_id = video.bvid or f"av{video.avid}"
+        return self._track_path(video.title, video.album, video_id, video.cid, video.page)
+
+    def _in_library(self, path):
+        parent = path.parent
+        return parent == self.root or (parent.parent == self.root and SHARD_PATTERN.match(parent.name))
+
+    def music_path(self, music):
+        """已有曲目在当前布局下应处的位置
+
+        下载目录以外的文件、缺少 BV 号的曲目保持原位；旧版下载的曲目没有 cid，按 BV 号分片、文件名只带 BV 号
+        （同一投稿的分P文件名中另有序号）。flat 布局下分片中的文件保留文件名移回下载目录。
+        """
+        path = music.file_path
+        if not self._in_library(path):
+            return path
+        if self.mode == LAYOUT_FLAT:
+            return self.root / path.name
+        if not music.bv_id:
+            return path
+        return self._track_path(music.title, music.album, music.bv_id, music.cid, music.page)
+
+    def shared_cover_base(self, video):
+        """多P投稿各分P共用的封面所在目录和文件名前缀"""
+        video_id = video.bvid or f"av{video.avid}"
+        if self.mode == LAYOUT_FLAT:
+            return self.root, safe_filename(video.title, suffix='')
+        return self.track_dir(video_id), safe_filename(f"{video.title[:TITLE_MAX_LENGTH]} [{video_id}]", suffix='')
+
+    @staticmethod
+    def sidecar_path(audio_path):
+        """与音频同名的 json 元数据文件"""
+        audio_path = Path(audio_path)
+        return audio_path.with_name(f"{audio_path.stem}.json")
+
+    def iter_dirs(self):
+        """下载目录本身和已有的分片子目录"""
+        if not self.root.exists():
+            return []
+        dirs = [self.root]
+        with os.scandir(self.root) as entries:
+            dirs.extend(Path(entry.path) for entry in entries
+                        if entry.is_dir() and SHARD_PATTERN.match(entry.name))
+        return dirs
+
+    def is_flat(self, path):
+        return Path(path).parent == self.root
+
+    def relative_url(self, path):
+        """文件相对于下载目录的路径（URL 编码），用于媒体服务器的地址；不在下载目录中时只取文件名"""
+        path = Path(path)
+        try:
+            relative = path.relative_to(self.root).as_posix()
+        except ValueError:
+            relative = path.name
+        return quote(relative)
+
+    def resolve(self, relative):
+        """把媒体服务器收到的相对路径转换为下载目录中的文件，路径越界或文件不存在时返回 None"""
+        root = os.path.realpath(self.root)
+        path = os.path.realpath(os.path.join(root, relative))
+        if os.path.commonpath([root, path]) != root or not os.path.isfile(path):
+            return None
+        return Path(path)
+
+    def _pending(self, music_service):
+        """位置与当前布局不符、需要迁移的曲目及其目标位置
+
+        音频文件已丢失（不是因磁盘预算移除）的曲目无法迁移，不计入；
+        音频已在目标位置的曲目（上次迁移中断）仍需补写记录，计入。
+        """
+        pending = []
+        for music in list(music_service.music_library.values()):
+            target = self.music_path(music)
+            if target != music.file_path and (music.evicted or music.file_path.exists() or target.exists()):
+                pending.append((music, target))
+        return pending
+
+    def pending_migration(self, music_service):
+        """位置与当前布局不符、需要迁移的曲目数"""
+        return len(self._pending(music_service))
+
+    @staticmethod
+    def _replace(source, target):
+        """移动文件；跨分区时改为复制后删除"""
+        try:
+            os.replace(source, target)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            shutil.move(str(source), str(target))
+
+    def _move_cover(self, cover_path, target_dir, keep_source=False):
+        if not cover_path or Path(cover_path).parent == target_dir:
+            return cover_path
+        source = Path(cover_path)
+        target = target_dir / source.name
+        if source.exists() and keep_source:
+            shutil.copy2(source, target)
+        elif source.exists():
+            self._replace(source, target)
+        elif not target.exists():
+            return cover_path
+        # 共用封面已随其他分P移动过（本次或之前中断的迁移中）
+        return str(target)
+
+    def move_track(self, music, target, keep_cover=False):
+        """移动一首曲目的音频、json 和封面，返回更新路径后的 Music；音频缺失或目标已存在时返回 None
+
+        先移动文件再写新 json、删旧 json，中途退出后重新迁移时：旧位置没有音频而新位置有，直接补写 json。
+        keep_cover 为 True 时封面复制到新位置，原封面留给仍在原处的其他分P。
+        """
+        from backend.models.music import Music
+
+        source = music.file_path
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if source.exists():
+            if target.exists():
+                print(f"目标位置已有同名文件，跳过: {target}")
+                return None
+            self._replace(source, target)
+        elif not target.exists() and not music.evicted:
+            return None
+        cover_path = self._move_cover(music.cover_path, target.parent, keep_cover)
+        moved = Music.from_dict(dict(music.to_dict(), file_path=str(target), cover_path=cover_path))
+        old_sidecar = self.sidecar_path(source)
+        if old_sidecar.exists():
+            write_json(self.sidecar_path(target), moved.to_dict())
+            old_sidecar.unlink()
+        return moved
+
+    def migrate(self, music_service, content_index=None, play_history=None, skip=None, batch_size=None,
+                progress_callback=None, cancel_check=None):
+        """把位置与当前布局不符的曲目移到新位置（在线、可中断）
+
+        每批移动 batch_size 首后保存音乐库和内容索引；中断或失败后再次调用会从尚未迁移的曲目继续。
+        skip 为暂不移动的音频路径集合（如正在播放的曲目），留到下次迁移。返回统计信息。
+        """
+        start = time.perf_counter()
+        batch_size = batch_size or LAYOUT_MIGRATION_BATCH
+        skip = {str(path) for path in skip or ()}
+        pending = [(music, target) for music, target in self._pending(music_service)
+                   if str(music.file_path) not in skip]
+
+        moved_count = 0
+        failed = 0
+        for index in range(0, len(pending), batch_size):
+            if cancel_check and cancel_check():
+                break
+            for music, target in pending[index:index + batch_size]:
+                old_key = str(music.file_path)
+                try:
+                    moved = self.move_track(music, target)
+                except OSError as e:
+                    print(f"移动文件失败 {music.file_path}: {e}")
+                    moved = None
+                if moved is None:
+                    failed += 1
+                    continue
+                music_service.move_music(old_key, moved, save=False)
+                if content_index is not None:
+                    content_index.move(old_key, moved.file_path)
+                if play_history is not None:
+                    play_history.rename(old_key, moved.file_path)
+                moved_count += 1
+            music_service.save_music_library()
+            if content_index is not None:
+                content_index.save()
+            if progress_callback:
+                progress_callback(min(index + batch_size, len(pending)), len(pending))
+
+        duration = time.perf_counter() - start
+        log_event('layout_migration', layout=self.mode, pending=len(pending), moved=moved_count, failed=failed,
+                  duration_ms=round(duration * 1000, 3))
+        return {
+            'pending': len(pending),
+            'moved': moved_count,
+            'failed': failed,
+            'remaining': len(pending) - moved_count,
+            'seconds': round(duration, 3)
+        }
@@ -0,0 +1,335 @@
+# File: backend/services/library_verifier.py
+# 音乐库完整性校验：并行检查每首曲目的音频是否缺失、为空、被截断或损坏，封面是否缺失或为空，
+# 以及下载目录中没有对应音频的 json 和中断下载留下的临时文件；通过校验的文件按大小和修改时间记入缓存，
+# 下次只检查变化过的文件
+import os
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+
+from core.config import VERIFY_CACHE_FILE, VERIFY_WORKERS
+from core.cover_archive import COVER_ARCHIVE, is_archived
+from core.log import log_event
+from core.metrics import VERIFY_FILES
+from core.serialization import read_json, write_json
+from backend.services.audio_tags import AUDIO_SUFFIXES, HAS_MUTAGEN
+from backend.services.content_index import hash_file, sample_hash
+
+# MP4 容器的顶层 box 类型，B站的 dash 音频以 ftyp（分段文件为 styp）开头
+MP4_FIRST_BOXES = {b'ftyp', b'styp'}
+# 顶层 box 数量的上限，超出时视为结构异常（正常的分段音频也只有几千个）
+MAX_TOP_LEVEL_BOXES = 100000
+# 下载和硬链接过程中的临时文件后缀，超过这个时间（秒）仍未改名的视为中断后遗留
+TEMP_SUFFIXES = ('.part', '.link')
+TEMP_FILE_MAX_AGE = 60 * 60
+
+# 问题类型与修复方式：redownload 重新下载音频，cover 重新下载封面
+PROBLEM_MISSING = 'missing'
+PROBLEM_EMPTY = 'empty'
+PROBLEM_TRUNCATED = 'truncated'
+PROBLEM_CORRUPT = 'corrupt'
+PROBLEM_COVER = 'cover'
+REPAIR_REDOWNLOAD = 'redownload'
+REPAIR_COVER = 'cover'
+
+
+def check_container(path, size):
+    """不读取音频数据，只沿着 MP4 顶层 box 的长度走到文件末尾，检查容器结构是否完整
+
+    返回 (结果, 说明)：ok 结构完整；truncated 最后一个 box 超出文件末尾（下载中断）；
+    invalid 结构损坏或缺少 moov / mdat；unknown 不是 MP4 容器（如 MP3），无法判断。
+    """
+    with open(path, 'rb') as f:
+        head = f.read(8)
+        if len(head) < 8 or head[4:8] not in MP4_FIRST_BOXES:
+            if head[:3] == b'ID3' or (len(head) >= 2 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+                return 'unknown', '非 MP4 容器'
+            return 'invalid', '文件头不是可识别的音频格式'
+        seen = set()
+        offset = 0
+        for _ in range(MAX_TOP_LEVEL_BOXES):
+            if offset == size:
+                break
+            f.seek(offset)
+            header = f.read(16)
+            if len(header) < 8:
+                return 'truncated', f'第 {offset} 字节处的 box 头不完整'
+            box_size, box_type = struct.unpack('>I4s', header[:8])
+            if box_size == 1:
+                if len(header) < 16:
+                    return 'truncated', f'第 {offset} 字节处的 box 头不完整'
+                box_size = struct.unpack('>Q', header[8:16])[0]
+            elif box_size == 0:
+                # 最后一个 box 延伸到文件末尾
+                box_size = size - offset
+            if box_size < 8:
+                return 'invalid', f'第 {offset} 字节处的 box 长度无效'
+            seen.add(box_type)
+            offset += box_size
+            if offset > size:
+                return 'truncated', f'{box_type.decode("latin-1")} 缺少 {offset - size} 字节'
+        else:
+            return 'invalid', 'box 数量异常'
+    if b'moov' not in seen:
+        return 'invalid', '缺少 moov（音轨信息）'
+    if b'mdat' not in seen:
+        return 'invalid', '缺少 mdat（音频数据）'
+    return 'ok', None
+
+
+def parse_audio(path):
+    """用 mutagen 完整解析音频，返回是否能读出音轨信息；没有 mutagen 时返回 None"""
+    if not HAS_MUTAGEN:
+        return None
+    import mutagen
+
+    try:
+        audio = mutagen.File(path)
+    except Exception:
+        return False
+    return audio is not None and getattr(audio, 'info', None) is not None
+
+
+class LibraryVerifier:
+    """并行校验音乐库中的曲目
+
+    每个文件先做廉价检查：与下载时记录的大小比较、走一遍容器的顶层结构、计算抽样哈希；
+    只有抽样哈希不符、没有下载记录或大小变化等可疑情况才计算完整哈希或完整解析。
+    通过校验的文件记下大小和修改时间，再次校验时未变化的文件直接跳过。
+    """
+
+    def __init__(self, music_service, content_index, cache_file=None, max_workers=None):
+        self.music_service = music_service
+        self.content_index = content_index
+        self.cache_file = Path(cache_file or VERIFY_CACHE_FILE)
+        self.max_workers = max_workers or VERIFY_WORKERS
+        self._lock = threading.Lock()
+        self._cache = self._load_cache()
+
+    def _load_cache(self):
+        if not self.cache_file.exists():
+            return {}
+        try:
+            return read_json(self.cache_file).get('entries', {})
+        except Exception as e:
+            print(f"加载校验缓存失败: {e}")
+            return {}
+
+    def save_cache(self):
+        with self._lock:
+            data = {'entries': dict(self._cache)}
+        try:
+            write_json(self.cache_file, data)
+        except Exception as e:
+            print(f"保存校验缓存失败: {e}")
+
+    def _problem(self, music, problem, message):
+        if problem == PROBLEM_COVER:
+            repair = REPAIR_COVER if music.pic else None
+        else:
+            repair = REPAIR_REDOWNLOAD if music.bv_id else None
+        return {
+            'file_path': str(music.file_path),
+            'title': music.title,
+            'bv_id': music.bv_id,
+            'problem': problem,
+            'message': message,
+            'repair': repair,
+        }
+
+    def _check_cover(self, music):
+        if not music.cover_path or music.cover_embedded:
+            return None
+        if is_archived(music.cover_path):
+            if music.cover_path not in COVER_ARCHIVE:
+                return self._problem(music, PROBLEM_COVER, '封面不在封面归档中')
+            return None
+        try:
+            size = os.path.getsize(music.cover_path)
+        except OSError:
+            return self._problem(music, PROBLEM_COVER, '封面文件缺失')
+        if size == 0:
+            return self._problem(music, PROBLEM_COVER, '封面文件为空')
+        return None
+
+    def check_track(self, key, music, full=False):
+        """检查一首曲目，返回 {'result', 'full_check', 'problems'}；result 为 ok、cached、evicted 或 broken"""
+        problems = []
+        cover_problem = self._check_cover(music)
+        if cover_problem:
+            problems.append(cover_problem)
+        if music.evicted:
+            return {'result': 'evicted', 'full_check': False, 'problems': problems}
+
+        try:
+            stat = music.file_path.stat()
+        except OSError:
+            problems.insert(0, self._problem(music, PROBLEM_MISSING, '音频文件缺失'))
+            return {'result': 'broken', 'full_check': False, 'problems': problems}
+        if stat.st_size == 0:
+            problems.insert(0, self._problem(music, PROBLEM_EMPTY, '音频文件为空'))
+            return {'result': 'broken', 'full_check': False, 'problems': problems}
+
+        with self._lock:
+            cached = self._cache.get(key)
+        if not full and cached and cached['size'] == stat.st_size and cached['mtime'] == stat.st_mtime:
+            return {'result': 'cached', 'full_check': False, 'problems': problems}
+
+        audio_problem, full_check = self._check_audio(key, music, stat, full)
+        if audio_problem:
+            problems.insert(0, audio_problem)
+            with self._lock:
+                self._cache.pop(key, None)
+            return {'result': 'broken', 'full_check': full_check, 'problems': problems}
+        with self._lock:
+            self._cache[key] = {'size': stat.st_size, 'mtime': stat.st_mtime,
+                                'verified_at': datetime.now().isoformat()}
+        return {'result': 'ok', 'full_check': full_check, 'problems': problems}
+
+    def _check_audio(self, key, music, stat, full):
+        """返回 (问题或 None, 是否做了完整检查)"""
+        size = stat.st_size
+        container, detail = check_container(music.file_path, size)
+        if container == 'truncated':
+            return self._problem(music, PROBLEM_TRUNCATED, f'音频不完整: {detail}'), False
+        if container == 'invalid':
+            return self._problem(music, PROBLEM_CORRUPT, f'音频已损坏: {detail}'), False
+
+        entry = self.content_index.get(key) if self.content_index is not None else None
+        if entry and size < entry['size']:
+            return self._problem(music, PROBLEM_TRUNCATED, f'音频比下载时少 {entry["size"] - size} 字节'), False
+        suspicious = (full or entry is None or container == 'unknown' or size != entry['size']
+                      or not entry.get('sample') or sample_hash(music.file_path, size) != entry['sample'])
+        if not suspicious:
+            return None, False
+
+        content_hash = hash_file(music.file_path)
+        if entry and content_hash == entry['hash'] and size == entry['size']:
+            if not entry.get('sample'):
+                # 旧版本索引没有抽样哈希，完整哈希相符后补上
+                self.content_index.record(key, content_hash, music.cid)
+            return None, True
+        if entry and stat.st_mtime == entry['mtime']:
+            # 修改时间没变而内容变了，不是正常的改写
+            return self._problem(music, PROBLEM_CORRUPT, '音频内容与下载时不一致'), True
+        # 没有下载记录，或文件被改写过（如外部工具修改了标签）：能完整解析即视为正常，并更新索引
+        if parse_audio(music.file_path) is False:
+            return self._problem(music, PROBLEM_CORRUPT, '音频无法解析'), True
+        if self.content_index is not None:
+            self.content_index.record(key, content_hash, music.cid)
+        return None, True
+
+    def find_orphans(self):
+        """下载目录中没有对应音频的 json，以及中断下载遗留的临时文件"""
+        layout = self.music_service.layout
+        # 扫描时每个 json 都会读入音乐库，音频缺失的记录已作为曲目的问题报告，这里只剩读不出记录的 json
+        known = {str(layout.sidecar_path(path)) for path in list(self.music_service.music_library)}
+        now = time.time()
+        orphans = []
+        for directory in layout.iter_dirs():
+            with os.scandir(directory) as entries:
+                names = {}
+                for entry in entries:
+                    if entry.is_file():
+                        names[entry.name] = entry
+            for name, entry in names.items():
+                stem, suffix = os.path.splitext(name)
+                if suffix.lower() == '.json':
+                    if entry.path in known or any(stem + audio in names for audio in AUDIO_SUFFIXES):
+                        continue
+                    orphans.append({'path': entry.path, 'kind': 'sidecar', 'size': entry.stat().st_size})
+                elif suffix in TEMP_SUFFIXES and now - entry.stat().st_mtime > TEMP_FILE_MAX_AGE:
+                    orphans.append({'path': entry.path, 'kind': 'temp', 'size': entry.stat().st_size})
+        return orphans
+
+    def verify(self, full=False, on_broken=None, progress_callback=None, cancel_check=None):
+        """校验音乐库中的所有曲目（含文件已缺失、对客户端隐藏的记录），返回报告
+
+        full 为 True 时忽略缓存，对每个文件计算完整哈希。on_broken(music, problem) 在发现可修复的问题时
+        立即调用（在工作线程中），用于把曲目放入修复队列。
+        """
+        start = time.perf_counter()
+        tracks = list(self.music_service.music_library.items())
+        counts = {'ok': 0, 'cached': 0, 'evicted': 0, 'broken': 0, 'error': 0}
+        problems = []
+        full_checks = 0
+
+        def check(item):
+            key, music = item
+            if cancel_check and cancel_check():
+                return None
+            try:
+                return self.check_track(key, music, full)
+            except OSError as e:
+                return {'result': 'error', 'full_check': False, 'problems': [], 'message': f'{key}: {e}'}
+
+        if tracks:
+            workers = min(len(tracks), self.max_workers)
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='verify') as executor:
+                futures = {executor.submit(check, item): item for item in tracks}
+                for index, future in enumerate(as_completed(futures), 1):
+                    result = future.result()
+                    if result is not None:
+                        counts[result['result']] += 1
+                        VERIFY_FILES.inc(result=result['result'])
+                        full_checks += result['full_check']
+                        if result['result'] == 'error':
+                            print(f"校验文件失败 {result['message']}")
+                        for problem in result['problems']:
+                            problems.append(problem)
+                            if on_broken and problem['repair']:
+                                on_broken(futures[future][1], problem)
+                    if progress_callback:
+                        progress_callback(index, len(tracks))
+
+        # 只保留仍在音乐库中的文件
+        keys = {key for key, _ in tracks}
+        with self._lock:
+            for key in [key for key in self._cache if key not in keys]:
+                del self._cache[key]
+        self.save_cache()
+        if self.content_index is not None:
+            self.content_index.save()
+        orphans = self.find_orphans()
+
+        duration = time.perf_counter() - start
+        checked = counts['ok'] + counts['broken']
+        log_event('library_verify', tracks=len(tracks), checked=checked, cached=counts['cached'],
+                  full_checks=full_checks, problems=len(problems), orphans=len(orphans),
+                  duration_ms=round(duration * 1000, 3))
+        return {
+            'tracks': len(tracks),
+            'checked': checked,
+            'cached': counts['cached'],
+            'evicted': counts['evicted'],
+            'errors': counts['error'],
+            'full_checks': full_checks,
+            'problems': sorted(problems, key=lambda problem: problem['file_path']),
+            'orphans': orphans,
+            'seconds': round(duration, 3)
+        }
+
+    def clean(self, report):
+        """删除报告中的孤立文件，并移除音频已缺失且无法重新下载的记录（连同其 json）；返回删除的文件数和记录数"""
+        unrepairable = [problem['file_path'] for problem in report['problems']
+                        if problem['problem'] == PROBLEM_MISSING and not problem['repair']]
+        paths = [orphan['path'] for orphan in report['orphans']]
+        paths += [str(self.music_service.layout.sidecar_path(path)) for path in unrepairable]
+        removed_files = 0
+        for path in paths:
+            try:
+                os.unlink(path)
+                removed_files += 1
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                print(f"删除文件失败 {path}: {e}")
+        removed_records = 0
+        with self.music_service.transaction():
+            for path in unrepairable:
+                removed_records += self.music_service.remove_music(path)
+        log_event('library_verify_clean', files=removed_files, records=removed_records)
+        return {'files': removed_files, 'records': removed_records}
@@ -1,71 +1,268 @@
 # File: backend/services/music.py
 import os
-import json
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 from datetime import datetime
-from core.config import DOWNLOAD_DIR
+from core.config import BULK_WORKERS, DOWNLOAD_DIR, TAG_READ_WORKERS
+from core.cover_archive import COVER_ARCHIVE, is_archived
+from core.log import log_event
+from core.metrics import LIBRARY_TRACKS, LIBRARY_SCAN_DURATION
+from core.serialization import load_document, read_json, save_document
 from backend.models.music import Music
+from backend.services.audio_tags import (AUDIO_SUFFIXES, HAS_MUTAGEN, STORAGE_TAGS, read_tags_parallel,
+                                         storage_mode, write_tags)
+from backend.services.content_index import hash_file
+from backend.services.library_layout import LibraryLayout
 
 class MusicService:
     """音乐库管理服务"""
+
+    # 变更日志最多保留的条数，超出后客户端需要重新获取完整快照
+    CHANGE_LOG_SIZE = 2000
     
-    def __init__(self):
-        self.download_dir = Path(DOWNLOAD_DIR)
-        self.music_db_file = self.download_dir.parent / "music_library.json"
+    def __init__(self, download_dir=None, music_db_file=None, metadata_storage=None, layout=None):
+        self.download_dir = Path(download_dir or DOWNLOAD_DIR)
+        # 下载目录布局：扫描时遍历下载目录和分片子目录，删除时按布局找到 json
+        self.layout = layout or LibraryLayout(self.download_dir)
+        self.metadata_storage = storage_mode(metadata_storage)
+        # tags 方式下已检查过标签的音频文件 -> 修改时间，之后只读取新增或变化的文件
+        self._tag_mtimes = {}
+        self.music_db_file = Path(music_db_file) if music_db_file else self.download_dir.parent / "music_library.json"
         self.music_library = self.load_music_library()
-    
-    def load_music_library(self):
-        """从JSON文件加载音乐库"""
-        if self.music_db_file.exists():
+        # 每次启动生成新的 epoch，客户端持有的旧版本号在新进程中失效
+        self.epoch = uuid.uuid4().hex[:8]
+        self.version = 0
+        self._changes = deque(maxlen=self.CHANGE_LOG_SIZE)
+        # 文件已缺失、对客户端不可见但仍保留记录的条目
+        self._missing = {key for key, music in self.music_library.items() if not self._is_present(music)}
+        self._change_lock = threading.RLock()
+        # 批量操作（transaction）的嵌套层数，期间的保存合并到最后一次
+        self._transaction_depth = 0
+        self._save_pending = False
+        self._listeners = []
+        self._update_size_metric()
+
+    @staticmethod
+    def _is_present(music):
+        """曲目是否对客户端可见：文件存在，或因磁盘预算被移除（可按需重新下载）"""
+        return music.evicted or music.file_path.exists()
+
+    def _update_size_metric(self):
+        LIBRARY_TRACKS.set(len(self.music_library) - len(self._missing))
+
+    def add_change_listener(self, callback):
+        """注册音乐库变更监听器，callback(version)"""
+        self._listeners.append(callback)
+
+    def _record_change(self, op, key, music=None):
+        """记录一条变更（add/update/remove），并递增版本号"""
+        with self._change_lock:
+            self.version += 1
+            self._changes.append({
+                'version': self.version,
+                'op': op,
+                'key': key,
+                'music': music
+            })
+            version = self.version
+            self._update_size_metric()
+        for listener in list(self._listeners):
             try:
-                with open(self.music_db_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    return {path: Music.from_dict(info) for path, info in data.items()}
+                listener(version)
             except Exception as e:
-                print(f"加载音乐库失败: {e}")
+                print(f"音乐库变更监听器执行失败: {e}")
+
+    def get_changes_since(self, since_version=None, epoch=None):
+        """返回 since_version 之后的变更；日志已被截断或 epoch 不匹配时返回完整快照"""
+        with self._change_lock:
+            oldest = self._changes[0]['version'] if self._changes else self.version + 1
+            needs_snapshot = (
+                since_version is None
+                or epoch != self.epoch
+                or since_version > self.version
+                or since_version < oldest - 1
+            )
+            if needs_snapshot:
+                return {
+                    'full': True,
+                    'epoch': self.epoch,
+                    'version': self.version,
+                    'music': self._visible_music()
+                }
+            changes = [change for change in self._changes if change['version'] > since_version]
+            return {
+                'full': False,
+                'epoch': self.epoch,
+                'version': self.version,
+                'changes': changes
+            }
+
+    def _visible_music(self):
+        """当前对客户端可见的音乐（文件存在或已被预算移除），按下载时间倒序"""
+        existing_music = [music for music in self.music_library.values() if self._is_present(music)]
+        existing_music.sort(key=lambda x: x.download_time, reverse=True)
+        return existing_music
+
+    def upsert_music(self, music, save=True):
+        """添加或更新一条音乐记录，只有内容变化时才记录变更"""
+        key = str(music.file_path)
+        with self._change_lock:
+            old = self.music_library.get(key)
+            exists = self._is_present(music)
+            if old is not None and old.to_dict() == music.to_dict() and exists == (key not in self._missing):
+                return False
+            self.music_library[key] = music
+            if not exists:
+                # 文件不存在的记录只保留，不通知客户端
+                if old is not None and key not in self._missing:
+                    self._record_change('remove', key)
+                self._missing.add(key)
+            else:
+                op = 'update' if old is not None and key not in self._missing else 'add'
+                self._missing.discard(key)
+                self._record_change(op, key, music)
+        if save:
+            self.save_music_library()
+        return True
+    
+    def move_music(self, old_key, music, save=True):
+        """曲目文件移动到新路径（布局迁移）：移除旧路径的记录，按新路径添加；客户端收到一次删除和一次添加"""
+        old_key = str(old_key)
+        with self._change_lock:
+            if self.music_library.pop(old_key, None) is not None:
+                if old_key in self._missing:
+                    self._missing.discard(old_key)
+                else:
+                    self._record_change('remove', old_key)
+            self.upsert_music(music, save=False)
+        if save:
+            self.save_music_library()
+
+    def load_music_library(self):
+        """加载音乐库：读取 JSON 文件或较新的二进制快照"""
+        try:
+            data = load_document(self.music_db_file, default={})
+            return {path: Music.from_dict(info) for path, info in data.items()}
+        except Exception as e:
+            print(f"加载音乐库失败: {e}")
         return {}
     
+    @contextmanager
+    def transaction(self):
+        """批量修改音乐库：期间的所有保存合并为退出时的一次写盘，变更日志仍逐条记录
+
+        可以嵌套，最外层退出时写盘；其他线程在此期间的保存也会推迟到这时。
+        """
+        with self._change_lock:
+            self._transaction_depth += 1
+        try:
+            yield self
+        finally:
+            with self._change_lock:
+                self._transaction_depth -= 1
+                commit = self._transaction_depth == 0 and self._save_pending
+                if commit:
+                    self._save_pending = False
+            if commit:
+                self.save_music_library()
+
     def save_music_library(self):
-        """保存音乐库到JSON文件"""
+        """保存音乐库（二进制快照或紧凑 JSON，见 core.serialization）；在 transaction 中时推迟到结束时"""
+        with self._change_lock:
+            if self._transaction_depth:
+                self._save_pending = True
+                return
         try:
-            data = {path: music.to_dict() for path, music in self.music_library.items()}
-            with open(self.music_db_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            with self._change_lock:
+                data = {path: music.to_dict() for path, music in self.music_library.items()}
+            save_document(self.music_db_file, data)
         except Exception as e:
             print(f"保存音乐库失败: {e}")
     
     def scan_download_folder(self):
-        """扫描下载文件夹，只加载json元数据文件"""
+        """扫描下载文件夹（含分片子目录）：读取json元数据文件；tags 方式下还从新增或变化的音频文件的标签中读取曲目信息"""
         if not self.download_dir.exists():
             return []
+        start = time.perf_counter()
         new_files = []
-        for file_path in self.download_dir.iterdir():
-            if file_path.is_file() and file_path.suffix.lower() == '.json':
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        music = Music.from_dict(data)
-                        self.music_library[str(music.file_path)] = music
-                        new_files.append(music)
-                except Exception as e:
-                    print(f"读取音乐json失败: {e}")
-        self.save_music_library()
+        changed = False
+        audio_files = []
+        for directory in self.layout.iter_dirs():
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if not entry.is_file():
+                        continue
+                    suffix = os.path.splitext(entry.name)[1].lower()
+                    if suffix == '.json':
+                        try:
+                            music = Music.from_dict(read_json(entry.path))
+                            changed = self.upsert_music(music, save=False) or changed
+                            new_files.append(music)
+                        except Exception as e:
+                            print(f"读取音乐json失败: {e}")
+                    elif suffix in AUDIO_SUFFIXES and self.metadata_storage == STORAGE_TAGS:
+                        audio_files.append((entry.path, entry.stat().st_mtime))
+        tagged = self._scan_tags(audio_files, {str(music.file_path) for music in new_files})
+        for music in tagged:
+            changed = self.upsert_music(music, save=False) or changed
+        new_files.extend(tagged)
+        changed = self._detect_missing_files() or changed
+        # 只有内容变化时才重写音乐库文件
+        if changed:
+            self.save_music_library()
+        duration = time.perf_counter() - start
+        LIBRARY_SCAN_DURATION.observe(duration)
+        log_event('library_scan', files=len(new_files), changed=changed, duration_ms=round(duration * 1000, 3))
         return new_files
+
+    def _scan_tags(self, audio_files, sidecar_paths):
+        """并行读取标签：只读取音乐库中还没有的文件，以及本次运行中见过之后又被修改的文件"""
+        pending = []
+        for path, mtime in audio_files:
+            seen = self._tag_mtimes.get(path)
+            self._tag_mtimes[path] = mtime
+            if path in sidecar_paths or seen == mtime:
+                continue
+            if seen is None and path in self.music_library and path not in self._missing:
+                continue
+            pending.append(path)
+        tracks = []
+        for path, info in read_tags_parallel(pending).items():
+            old = self.music_library.get(path)
+            if old is not None:
+                # 标签中不保存内容哈希，沿用已有记录
+                info['content_hash'] = old.content_hash
+            tracks.append(Music.from_dict(info))
+        return tracks
+
+    def _detect_missing_files(self):
+        """文件被外部删除时通知客户端移除，记录本身保留"""
+        changed = False
+        with self._change_lock:
+            for key, music in self.music_library.items():
+                exists = self._is_present(music)
+                if not exists and key not in self._missing:
+                    self._missing.add(key)
+                    self._record_change('remove', key)
+                    changed = True
+                elif exists and key in self._missing:
+                    self._missing.discard(key)
+                    self._record_change('add', key, music)
+                    changed = True
+        return changed
     
     def get_all_music(self):
         """获取所有音乐列表"""
         # 先扫描新文件
         self.scan_download_folder()
         
-        # 检查文件是否仍然存在
-        existing_music = []
-        for music in self.music_library.values():
-            if music.file_path.exists():
-                existing_music.append(music)
-        
-        # 按下载时间排序（最新的在前）
-        existing_music.sort(key=lambda x: x.download_time, reverse=True)
-        return existing_music
+        # 只返回文件仍然存在的音乐，按下载时间排序（最新的在前）
+        return self._visible_music()
     
     def get_music_by_path(self, file_path):
         """根据文件路径获取音乐信息"""
@@ -75,18 +272,245 @@ class MusicService:
         """添加音乐到库中"""
         music = Music(file_path, bv_id=bv_id, title=title)
         music.get_metadata()
-        self.music_library[str(file_path)] = music
-        self.save_music_library()
+        self.upsert_music(music)
         return music
     
-    def remove_music(self, file_path):
+    def evict_music(self, file_path, save=True):
+        """删除曲目的音频、封面和 json 文件以释放磁盘空间，音乐库中保留标记为 evicted 的记录
+
+        多P投稿的各分P共用封面，分P曲目的封面保留。返回释放的字节数。
+        """
+        music = self.get_music_by_path(file_path)
+        if not music or music.evicted:
+            return 0
+        paths = [music.file_path, self.layout.sidecar_path(music.file_path)]
+        if music.cover_path and not music.page and not is_archived(music.cover_path):
+            paths.append(Path(music.cover_path))
+        freed = 0
+        for path in paths:
+            try:
+                stat = path.stat()
+                path.unlink()
+                # 还有其他硬链接（去重时共用的文件）时空间没有释放
+                if stat.st_nlink == 1:
+                    freed += stat.st_size
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                print(f"删除文件失败 {path}: {e}")
+        cover_path = music.cover_path if music.page else None
+        evicted = Music.from_dict(dict(music.to_dict(), evicted=True, cover_path=cover_path, cover_embedded=False))
+        self.upsert_music(evicted, save=save)
+        log_event('library_evict', path=str(music.file_path), freed=freed)
+        return freed
+
+    def migrate_to_tags(self, content_index=None, max_workers=None, progress_callback=None, cancel_check=None):
+        """把下载目录中“音频 + json + 封面”的曲目转换为带标签的音频，转换成功后删除 json 和封面
+
+        多个分P共用的封面在所有分P都转换成功后才删除；写入标签会改变文件内容，新的内容哈希记入
+        content_index。未安装 mutagen 时返回 None，否则返回统计信息。
+        """
+        if not HAS_MUTAGEN:
+            return None
+        start = time.perf_counter()
+        tracks = []
+        info_paths = [path for directory in self.layout.iter_dirs() for path in directory.glob('*.json')]
+        for info_path in info_paths:
+            try:
+                music = Music.from_dict(read_json(info_path))
+            except Exception as e:
+                print(f"读取音乐json失败: {e}")
+                continue
+            if not music.evicted and music.file_path.exists():
+                tracks.append((info_path, music))
+        cover_users = Counter(music.cover_path for _, music in tracks if music.cover_path)
+
+        def migrate_one(item):
+            info_path, music = item
+            if cancel_check and cancel_check():
+                return None
+            cover = None
+            if is_archived(music.cover_path):
+                archived = COVER_ARCHIVE.get(music.cover_path)
+                cover = archived[0] if archived else None
+            elif music.cover_path:
+                try:
+                    cover = Path(music.cover_path).read_bytes()
+                except OSError:
+                    pass
+            migrated = Music.from_dict(dict(music.to_dict(), cover_path=None, cover_embedded=bool(cover)))
+            if not write_tags(migrated, cover):
+                return None
+            migrated.content_hash = hash_file(migrated.file_path)
+            info_path.unlink(missing_ok=True)
+            return music.cover_path, migrated
+
+        migrated_count = 0
+        migrated_covers = Counter()
+        if tracks:
+            workers = min(len(tracks), max_workers or TAG_READ_WORKERS)
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tag-writer') as executor:
+                for index, result in enumerate(executor.map(migrate_one, tracks), 1):
+                    if result is not None:
+                        cover_path, music = result
+                        self.upsert_music(music, save=False)
+                        if content_index is not None:
+                            content_index.record(music.file_path, music.content_hash, music.cid)
+                        if cover_path:
+                            migrated_covers[cover_path] += 1
+                        migrated_count += 1
+                    if progress_callback:
+                        progress_callback(index, len(tracks))
+
+        removed_covers = 0
+        for cover_path, users in cover_users.items():
+            # 归档中的封面不单独删除，整理封面归档时回收
+            if migrated_covers[cover_path] == users and not is_archived(cover_path):
+                Path(cover_path).unlink(missing_ok=True)
+                removed_covers += 1
+        if migrated_count:
+            self.save_music_library()
+
+        duration = time.perf_counter() - start
+        log_event('migrate_to_tags', tracks=len(tracks), migrated=migrated_count, covers_removed=removed_covers,
+                  duration_ms=round(duration * 1000, 3))
+        return {
+            'tracks': len(tracks),
+            'migrated': migrated_count,
+            'failed': len(tracks) - migrated_count,
+            'covers_removed': removed_covers,
+            'seconds': round(duration, 3)
+        }
+
+    def import_covers(self, archive=None, save_info=None, progress_callback=None, cancel_check=None):
+        """把曲目的 *_cover.* 封面文件导入封面归档，cover_path 改为归档中的位置，之后删除封面文件
+
+        save_info(music) 把更新后的曲目信息写回 json（见 DownloadService.save_music_info）；多个分P共用的
+        封面只导入一次，所有分P都更新后才删除文件。返回统计信息。
+        """
+        archive = archive or COVER_ARCHIVE
+        start = time.perf_counter()
+        self.scan_download_folder()
+        # 已移除本地文件的分P仍保留共用封面，一并导入
+        with self._change_lock:
+            tracks = [music for music in self.music_library.values()
+                      if music.cover_path and not is_archived(music.cover_path)]
+        cover_users = Counter(music.cover_path for music in tracks)
+        archived = {}
+        updated = Counter()
+        imported_bytes = 0
+        with self.transaction():
+            for index, music in enumerate(tracks, 1):
+                if cancel_check and cancel_check():
+                    break
+                source = music.cover_path
+                if source not in archived:
+                    try:
+                        data = Path(source).read_bytes()
+                        archived[source] = archive.put(data, ext=Path(source).suffix.lower(), save=False)
+                        imported_bytes += len(data)
+                    except OSError as e:
+                        print(f"读取封面失败 {source}: {e}")
+                        archived[source] = None
+                if archived[source] is not None:
+                    music = Music.from_dict(dict(music.to_dict(), cover_path=archived[source]))
+                    if save_info is not None and not music.evicted:
+                        save_info(music)
+                    self.upsert_music(music, save=False)
+                    updated[source] += 1
+                if progress_callback:
+                    progress_callback(index, len(tracks))
+            # 先保存归档索引，再删除封面文件
+            archive.save()
+
+        removed = 0
+        for source, users in cover_users.items():
+            if updated[source] == users:
+                Path(source).unlink(missing_ok=True)
+                removed += 1
+
+        duration = time.perf_counter() - start
+        log_event('cover_import', tracks=len(tracks), imported=sum(updated.values()), covers_removed=removed,
+                  bytes=imported_bytes, duration_ms=round(duration * 1000, 3))
+        return {
+            'tracks': len(tracks),
+            'imported': sum(updated.values()),
+            'failed': len(tracks) - sum(updated.values()),
+            'covers_removed': removed,
+            'bytes': imported_bytes,
+            'seconds': round(duration, 3)
+        }
+
+    def archived_covers(self):
+        """音乐库中仍在使用的归档封面（整理封面归档时保留）"""
+        with self._change_lock:
+            return {music.cover_path for music in self.music_library.values() if is_archived(music.cover_path)}
+
+    def remove_music(self, file_path, save=True):
         """从库中移除音乐"""
         file_key = str(file_path)
-        if file_key in self.music_library:
+        with self._change_lock:
+            if file_key not in self.music_library:
+                return False
             del self.music_library[file_key]
+            was_missing = file_key in self._missing
+            self._missing.discard(file_key)
+            if not was_missing:
+                self._record_change('remove', file_key)
+            self._update_size_metric()
+        if save:
+            self.save_music_library()
+        return True
+
+    def delete_music_files(self, file_paths, max_workers=None, progress_callback=None):
+        """批量删除曲目：并行删除各曲目的音频、json 和封面文件，最后一次性从音乐库移除并保存
+
+        多P投稿的共用封面只在没有其他曲目使用时删除。返回与 file_paths 顺序一致的结果列表（重复的路径只处理一次）。
+        """
+        start = time.perf_counter()
+        keys = list(dict.fromkeys(str(path) for path in file_paths))
+        targets = {key: self.get_music_by_path(key) for key in keys}
+        with self._change_lock:
+            cover_users = Counter(music.cover_path for key, music in self.music_library.items()
+                                  if music.cover_path and targets.get(key) is None)
+
+        def delete_one(key):
+            music = targets[key]
+            if music is None:
+                return {'file_path': key, 'status': 'error', 'message': '音乐不在库中'}
+            paths = [music.file_path, self.layout.sidecar_path(music.file_path)]
+            if music.cover_path and not cover_users[music.cover_path] and not is_archived(music.cover_path):
+                paths.append(Path(music.cover_path))
+            freed = 0
+            for path in paths:
+                try:
+                    size = path.stat().st_size
+                    path.unlink()
+                    freed += size
+                except FileNotFoundError:
+                    # 共用封面可能已被同一批中的其他分P删除
+                    continue
+                except OSError as e:
+                    return {'file_path': key, 'status': 'error', 'message': f'删除文件失败: {e}'}
+            return {'file_path': key, 'status': 'ok', 'message': f'{music.title} 已删除', 'freed': freed}
+
+        results = []
+        if keys:
+            workers = min(len(keys), max_workers or BULK_WORKERS)
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bulk-delete') as executor:
+                for index, result in enumerate(executor.map(delete_one, keys), 1):
+                    results.append(result)
+                    if progress_callback:
+                        progress_callback(index, len(keys))
+        deleted = [result['file_path'] for result in results if result['status'] == 'ok']
+        for key in deleted:
+            self.remove_music(key, save=False)
+        if deleted:
             self.save_music_library()
-            return True
-        return False
+        log_event('library_bulk_delete', tracks=len(keys), deleted=len(deleted),
+                  freed=sum(result.get('freed', 0) for result in results),
+                  duration_ms=round((time.perf_counter() - start) * 1000, 3))
+        return results
     
     def delete_music_file(self, file_path_str):
         """删除音乐文件及其所有关联文件和记录"""
@@ -100,7 +524,7 @@ class MusicService:
                 try:
                     file_to_delete.unlink()
                     # 尝试删除同名的 .json 和 .jpg
-                    json_path = file_to_delete.with_suffix('.json')
+                    json_path = self.layout.sidecar_path(file_to_delete)
                     if json_path.exists(): json_path.unlink()
                     cover_path = file_to_delete.with_suffix('.jpg')
                     if cover_path.exists(): cover_path.unlink()
@@ -109,32 +533,12 @@ class MusicService:
                     return {'status': 'error', 'message': f'直接删除文件时出错: {e}'}
             return {'status': 'error', 'message': f'音乐 {file_path_str} 不在库中，文件也不存在'}
 
-        try:
-            # 将路径字符串转换为 Path 对象
-            file_path_obj = Path(music.file_path)
-            cover_path_obj = Path(music.cover_path) if music.cover_path else None
-            json_path = file_path_obj.with_suffix('.json')
-
-            # 1. 删除音频文件
-            if file_path_obj.exists():
-                file_path_obj.unlink()
-
-            # 2. 删除封面文件
-            if cover_path_obj and cover_path_obj.exists():
-                cover_path_obj.unlink()
-
-            # 3. 删除元数据 .json 文件
-            if json_path.exists():
-                json_path.unlink()
-
-            # 4. 从音乐库中移除记录
-            self.remove_music(str(music.file_path))
-            
-            return {'status': 'ok', 'message': f'歌曲 {music.title} 已成功删除'}
-
-        except Exception as e:
-            print(f"删除音乐文件 {file_path_str} 失败: {e}")
-            return {'status': 'error', 'message': f'删除文件时出错: {e}'}
+        # 与批量删除共用逻辑：多P投稿的共用封面只在没有其他曲目使用时删除
+        result = self.delete_music_files([str(music.file_path)])[0]
+        if result['status'] != 'ok':
+            print(f"删除音乐文件 {file_path_str} 失败: {result['message']}")
+            return {'status': 'error', 'message': f"删除文件时出错: {result['message']}"}
+        return {'status': 'ok', 'message': f'歌曲 {music.title} 已成功删除'}
     
     def search_music(self, keyword):
         """搜索音乐"""
@@ -143,7 +547,6 @@ class MusicService:
         
         for music in self.get_all_music():
             if (keyword in music.title.lower() or 
-                keyword in music.artist.lower() or 
                 keyword in music.album.lower() or
                 keyword in music.file_path.name.lower()):
                 results.append(music)
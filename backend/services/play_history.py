@@ -0,0 +1,100 @@
+# File: backend/services/play_history.py
+# 播放记录：每首曲目最近播放时间和播放次数
+# 记录只更新内存，由后台线程延迟合并写盘，播放不等待磁盘
+import threading
+import time
+from pathlib import Path
+
+from core.config import PLAY_HISTORY_FILE, PLAY_HISTORY_FLUSH_INTERVAL
+from core.serialization import read_json, write_json
+
+
+class PlayHistory:
+    """按音频路径记录 last_played（时间戳）和 play_count"""
+
+    def __init__(self, history_file=None, flush_interval=PLAY_HISTORY_FLUSH_INTERVAL):
+        self.history_file = Path(history_file or PLAY_HISTORY_FILE)
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._entries = self._load()
+        self._dirty = False
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.last_key = None
+
+    def _load(self):
+        if not self.history_file.exists():
+            return {}
+        try:
+            return read_json(self.history_file)
+        except Exception as e:
+            print(f"加载播放记录失败: {e}")
+            return {}
+
+    def record(self, key, timestamp=None):
+        """记录一次播放，返回该曲目更新后的记录"""
+        key = str(key)
+        with self._lock:
+            entry = self._entries.setdefault(key, {'last_played': None, 'play_count': 0})
+            entry['last_played'] = timestamp or time.time()
+            entry['play_count'] += 1
+            self.last_key = key
+            self._dirty = True
+            result = dict(entry)
+        self._schedule_flush()
+        return result
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(str(key))
+            return dict(entry) if entry else None
+
+    def last_played(self, key):
+        entry = self._entries.get(str(key))
+        return entry['last_played'] if entry else None
+
+    def forget(self, key):
+        """曲目从音乐库删除时移除其播放记录"""
+        with self._lock:
+            if self._entries.pop(str(key), None) is not None:
+                self._dirty = True
+        self._schedule_flush()
+
+    def rename(self, old_key, new_key):
+        """曲目文件移动到新路径后，播放记录随之移动"""
+        old_key, new_key = str(old_key), str(new_key)
+        with self._lock:
+            entry = self._entries.pop(old_key, None)
+            if entry is not None:
+                self._entries[new_key] = entry
+                self._dirty = True
+            if self.last_key == old_key:
+                self.last_key = new_key
+        if entry is not None:
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='play-history-writer', daemon=True)
+            self._thread.start()
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            # 等待一段时间，把这期间的多次播放合并成一次写入
+            time.sleep(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """立即把未写盘的记录写入文件（退出前调用）"""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {key: dict(entry) for key, entry in self._entries.items()}
+            self._dirty = False
+        try:
+            write_json(self.history_file, data)
+        except Exception as e:
+            print(f"保存播放记录失败: {e}")
@@ -0,0 +1,171 @@
+# File: backend/services/prefetch.py
+# 播放队列预取：前端告知接下来要播放的几首曲目，后台预读本地文件、缓存封面和曲目开头，
+# 未下载（或已被磁盘预算移除）的曲目提前解析播放地址并取回开头的音频，切歌时直接从内存开始播放
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import unquote
+
+from core.bandwidth import PREFETCH
+from core.config import PLAYURL_TTL, PREFETCH_HEAD_SECONDS, PREFETCH_QUEUE_LENGTH
+from core.log import log_event
+from core.media_cache import MEDIA_CACHE
+
+# 不知道时长时缓存的开头字节数
+DEFAULT_HEAD_BYTES = 512 * 1024
+# 远程音频的码率未知，按 B站最高音质（约 320kbps）估算开头部分的字节数
+REMOTE_BYTES_PER_SECOND = 40 * 1024
+
+
+class Prefetcher:
+    """按播放队列预取曲目
+
+    每次 set_queue 都会取代上一次的队列，尚未开始的旧任务直接跳过；队列中的曲目依次处理，
+    先处理最先播放的一首。
+    """
+
+    def __init__(self, music_service, bilibili_service, download_service, cache=None,
+                 head_seconds=PREFETCH_HEAD_SECONDS, max_queue=PREFETCH_QUEUE_LENGTH):
+        self.music_service = music_service
+        self.bilibili_service = bilibili_service
+        self.download_service = download_service
+        self.cache = cache or MEDIA_CACHE
+        self.head_seconds = head_seconds
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._queue = []
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prefetch')
+
+    def set_queue(self, file_paths):
+        """设置接下来要播放的曲目（按播放顺序），返回实际预取的曲目数
+
+        file_paths 为音乐库中的曲目路径列表，不在音乐库中的路径和超出 max_queue 的部分忽略；不是列表时抛出 TypeError。
+        """
+        # 单个字符串也可迭代，逐字符当作路径会提交大量无效的预取任务
+        if file_paths is not None and not isinstance(file_paths, (list, tuple)):
+            raise TypeError('播放队列必须是曲目路径的列表')
+        keys = []
+        for path in file_paths or ():
+            if not isinstance(path, (str, Path)):
+                raise TypeError(f'播放队列中的曲目路径无效: {path!r}')
+            key = str(path)
+            if key not in keys and self.music_service.get_music_by_path(key) is not None:
+                keys.append(key)
+                if len(keys) >= self.max_queue:
+                    break
+        file_paths = keys
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+            self._queue = file_paths
+        for key in file_paths:
+            self._executor.submit(self._prefetch, generation, key)
+        return len(file_paths)
+
+    def queue(self):
+        with self._lock:
+            return list(self._queue)
+
+    def _prefetch(self, generation, key):
+        if generation != self._generation:
+            return
+        music = self.music_service.get_music_by_path(key)
+        if music is None:
+            return
+        start = time.perf_counter()
+        try:
+            if not music.evicted and music.file_path.exists():
+                source = 'local'
+                cached = self._warm_local(music)
+            else:
+                source = 'remote'
+                stream = self.resolve_stream(music)
+                cached = len(stream['head']) if stream else 0
+        except Exception as e:
+            print(f"预取曲目失败 {key}: {e}")
+            return
+        log_event('prefetch', source=source, bytes=cached, duration_ms=round((time.perf_counter() - start) * 1000, 3))
+
+    def head_bytes(self, size, duration):
+        """曲目开头 head_seconds 秒对应的字节数"""
+        if not duration:
+            return min(size, DEFAULT_HEAD_BYTES)
+        return min(size, int(size / duration * self.head_seconds))
+
+    def _warm_local(self, music):
+        """缓存音频开头和完整的封面，音频其余部分提示内核预读；返回缓存的字节数"""
+        size = os.path.getsize(music.file_path)
+        cached = self.cache.load_file(music.file_path, self.head_bytes(size, music.duration))
+        if music.cover_path and os.path.exists(music.cover_path):
+            cached += self.cache.load_file(music.cover_path)
+        elif music.cover_embedded:
+            cached += self._cache_embedded_cover(music.file_path)
+        return cached
+
+    def _cache_embedded_cover(self, path):
+        from backend.services.audio_tags import read_cover
+
+        path = os.path.realpath(path)
+        if self.cache.get(('cover', path), path, kind='prefetch') is not None:
+            return 0
+        cover = read_cover(path)
+        if cover is None:
+            return 0
+        data, mimetype = cover
+        self.cache.put(('cover', path), data, path, mimetype)
+        return len(data)
+
+    def stream_key(self, music):
+        """未下载曲目在媒体服务器 /stream/ 下的路径（与 /media/ 下的路径相同）"""
+        return unquote(self.music_service.layout.relative_url(music.file_path))
+
+    def resolve_stream(self, music):
+        """解析曲目的播放地址并取回开头部分，记入缓存；已解析且未过期时直接返回；失败时返回 None"""
+        key = self.stream_key(music)
+        stream = self.cache.get_stream(key)
+        if stream is not None:
+            return stream
+        if not music.bv_id:
+            return None
+        video = self.bilibili_service.load_video_info(music.bv_id)
+        if not video:
+            return None
+        if music.page:
+            page = next((page for page in video.pages if page['page'] == music.page), None)
+            if page is None:
+                return None
+            video = video.part_video(page)
+        url = self.download_service.resolve_audio_url(video)
+        if not url:
+            return None
+
+        session = self.download_service.session
+        bandwidth = self.download_service.bandwidth
+        head_bytes = REMOTE_BYTES_PER_SECOND * self.head_seconds
+        with session.get(url, headers={'Range': f'bytes=0-{head_bytes - 1}'}, timeout=30, stream=True) as res, \
+                bandwidth.transfer(PREFETCH):
+            if res.status_code not in (200, 206):
+                print(f"获取音频开头失败，状态码: {res.status_code}")
+                return None
+            # 不支持 Range 的服务器返回完整内容，只读取开头部分
+            head = bytearray()
+            for chunk in res.iter_content(64 * 1024):
+                head += chunk
+                bandwidth.consume(len(chunk), PREFETCH)
+                if len(head) >= head_bytes:
+                    break
+            head = bytes(head[:head_bytes])
+            content_range = res.headers.get('content-range', '')
+            if res.status_code == 206 and '/' in content_range:
+                size = int(content_range.rsplit('/', 1)[1])
+            else:
+                size = int(res.headers.get('content-length') or len(head))
+            mimetype = res.headers.get('content-type') or 'audio/mp4'
+        self.cache.put_stream(key, url, head, size, mimetype, session, PLAYURL_TTL)
+        return self.cache.get_stream(key)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
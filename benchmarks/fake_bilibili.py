@@ -0,0 +1,336 @@
+# File: benchmarks/fake_bilibili.py
+# 本地模拟的 Bilibili API 与 CDN，用于离线基准测试
+#
+# 模拟的接口：
+#   /x/web-interface/nav                  登录状态与 WBI 密钥
+#   /x/web-interface/view                 视频信息（含分P列表）
+#   /x/v3/fav/folder/created/list-all     收藏夹列表
+#   /x/v3/fav/resource/list               收藏夹内容（分页）
+#   /x/player/wbi/playurl                 音频流地址
+#   /cdn/audio/<cid>.m4s                  音频文件，支持 Range
+#   /cdn/cover/<n>.jpg                    封面图片
+#
+# 单独运行：python -m benchmarks.fake_bilibili --port 8790 --latency 50
+import argparse
+import json
+import random
+import re
+import struct
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# 最小的 MP4 ftyp 头，使生成的音频文件能通过容器头检查
+FTYP_HEADER = b'\x00\x00\x00\x18ftypdash\x00\x00\x00\x00iso6mp41'
+# 只含 mvhd（时长 180 秒）的 moov，之后是 mdat；结构完整，可以用 mutagen 写入标签
+MOOV_ATOM = struct.pack('>I4s', 8 + 108, b'moov') + struct.pack('>I4s', 108, b'mvhd') + \
+    b'\x00' * 12 + struct.pack('>II', 1000, 180000) + b'\x00' * 80
+
+
+class FakeBilibiliConfig:
+    """模拟服务器的行为参数"""
+
+    def __init__(self, latency_ms=20, jitter_ms=5, bandwidth=8 * 1024 * 1024, error_rate=0.0,
+                 folder_sizes=(50, 200), audio_size=1024 * 1024, cover_size=30 * 1024,
+                 parts_per_video=1, page_size=20, album_parts=40):
+        self.latency_ms = latency_ms          # 每个请求的基础延迟
+        self.jitter_ms = jitter_ms            # 延迟随机抖动
+        self.bandwidth = bandwidth            # 每个连接的带宽（字节/秒），0 表示不限速
+        self.error_rate = error_rate          # 随机失败的概率（HTTP 503 或接口错误码）
+        self.folder_sizes = list(folder_sizes)
+        self.audio_size = audio_size
+        self.cover_size = cover_size
+        self.parts_per_video = parts_per_video
+        self.page_size = page_size
+        self.album_parts = album_parts        # 专辑视频（序号 ALBUM_INDEX）的分P数量
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+# 专辑视频的序号，不属于任何收藏夹，分P数量由 album_parts 决定
+ALBUM_INDEX = 9_000_000
+
+
+def video_index(bvid):
+    """从模拟的 BV 号中取出序号"""
+    match = re.match(r'BV1f(\d{8})$', bvid or '')
+    return int(match.group(1)) if match else None
+
+
+def fake_bvid(n):
+    # 与真实 BV 号一样是 BV 加 10 位字符
+    return f"BV1f{n:08d}"
+
+
+def fake_audio(cid, size):
+    """生成确定性的音频内容，不同 cid 的内容不同"""
+    header = FTYP_HEADER + MOOV_ATOM
+    mdat_size = max(size - len(header), 16)
+    body = header + struct.pack('>I4s', mdat_size, b'mdat') + cid.to_bytes(8, 'big')
+    repeat = (mdat_size - 16) // 8 + 1
+    return (body + cid.to_bytes(8, 'big') * repeat)[:len(header) + mdat_size]
+
+
+class FakeBilibiliServer:
+    """在后台线程中运行的模拟服务器"""
+
+    def __init__(self, config=None, host='127.0.0.1', port=0):
+        self.config = config or FakeBilibiliConfig()
+        self.host = host
+        self.port = port
+        self.request_counts = Counter()
+        self._counts_lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+        self._cover = b'\xff\xd8\xff\xe0' + b'\x00' * max(0, self.config.cover_size - 4)
+        # 视频按收藏夹顺序连续编号
+        self.folders = []
+        start = 0
+        for i, size in enumerate(self.config.folder_sizes):
+            self.folders.append({'id': 1000 + i, 'title': f"测试收藏夹 {i + 1}", 'start': start, 'size': size})
+            start += size
+        self.total_videos = start
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        handler = type('Handler', (_FakeHandler,), {'server_state': self})
+        self._httpd = ThreadingHTTPServer((self.host, self.port), handler)
+        self._httpd.daemon_threads = True
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='fake-bilibili', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+
+    def count(self, endpoint):
+        with self._counts_lock:
+            self.request_counts[endpoint] += 1
+
+    def reset_counts(self):
+        with self._counts_lock:
+            self.request_counts.clear()
+
+    def video_info(self, n):
+        """第 n 个模拟视频的 view 接口数据"""
+        base_cid = 10_000_000 + n * 100
+        parts = self.config.album_parts if n == ALBUM_INDEX else self.config.parts_per_video
+        pages = [
+            {'cid': base_cid + p, 'page': p + 1, 'part': f"P{p + 1}", 'duration': 120 + (n + p) % 300}
+            for p in range(parts)
+        ]
+        return {
+            'aid': 100_000 + n,
+            'bvid': fake_bvid(n),
+            'cid': base_cid,
+            'title': f"测试视频 {n}",
+            'pic': f"{self.base_url}/cdn/cover/{n}.jpg",
+            'duration': sum(page['duration'] for page in pages),
+            'videos': len(pages),
+            'pages': pages,
+        }
+
+
+class _FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # 响应头和响应体分两次写出，不关闭 Nagle 算法时小响应会多等一个延迟 ACK（约 40ms）
+    disable_nagle_algorithm = True
+    server_state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    # ---- 工具方法 ----
+    def _delay(self):
+        config = self.server_state.config
+        delay = config.latency_ms + random.uniform(-config.jitter_ms, config.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    def _should_fail(self):
+        return random.random() < self.server_state.config.error_rate
+
+    def _send_bytes(self, status, body, content_type, extra_headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        bandwidth = self.server_state.config.bandwidth
+        chunk_size = 64 * 1024
+        for offset in range(0, len(body), chunk_size):
+            chunk = body[offset:offset + chunk_size]
+            self.wfile.write(chunk)
+            if bandwidth:
+                time.sleep(len(chunk) / bandwidth)
+
+    def _send_json(self, data, code=0, message='0'):
+        body = json.dumps({'code': code, 'message': message, 'ttl': 1, 'data': data}, ensure_ascii=False).encode()
+        self._send_bytes(200, body, 'application/json; charset=utf-8')
+
+    def _send_api_error(self):
+        # 一半返回 HTTP 503，一半返回风控错误码
+        if random.random() < 0.5:
+            self._send_bytes(503, b'Service Unavailable', 'text/plain')
+        else:
+            self._send_json(None, code=-412, message='请求被拦截')
+
+    # ---- 路由 ----
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        routes = {
+            '/x/web-interface/nav': self._nav,
+            '/x/web-interface/view': self._view,
+            '/x/v3/fav/folder/created/list-all': self._fav_folders,
+            '/x/v3/fav/resource/list': self._fav_resources,
+            '/x/player/wbi/playurl': self._playurl,
+        }
+        if url.path in routes:
+            self.server_state.count(url.path)
+            self._delay()
+            if self._should_fail():
+                return self._send_api_error()
+            return routes[url.path](query)
+        if url.path.startswith('/cdn/audio/'):
+            self.server_state.count('/cdn/audio')
+            return self._cdn_audio(url.path)
+        if url.path.startswith('/cdn/cover/'):
+            self.server_state.count('/cdn/cover')
+            self._delay()
+            return self._send_bytes(200, self.server_state._cover, 'image/jpeg')
+        self._send_bytes(404, b'Not Found', 'text/plain')
+
+    def _nav(self, query):
+        self._send_json({
+            'isLogin': True,
+            'mid': 12345,
+            'uname': 'benchmark',
+            'wbi_img': {
+                'img_url': 'https://i0.hdslb.com/bfs/wbi/7cd084941338484aae1ad9425b84077c.png',
+                'sub_url': 'https://i0.hdslb.com/bfs/wbi/4932caff0ff746eab6f01bf08b70ac45.png',
+            },
+        })
+
+    def _view(self, query):
+        n = video_index(query.get('bvid'))
+        if n is None or (n >= self.server_state.total_videos and n != ALBUM_INDEX):
+            return self._send_json(None, code=-404, message='啥都木有')
+        self._send_json(self.server_state.video_info(n))
+
+    def _fav_folders(self, query):
+        folders = [
+            {'id': f['id'], 'fid': f['id'] // 100, 'mid': 12345, 'title': f['title'], 'media_count': f['size']}
+            for f in self.server_state.folders
+        ]
+        self._send_json({'count': len(folders), 'list': folders})
+
+    def _fav_resources(self, query):
+        folder = next((f for f in self.server_state.folders if str(f['id']) == query.get('media_id')), None)
+        if folder is None:
+            return self._send_json(None, code=-400, message='请求错误')
+        page_size = int(query.get('ps', self.server_state.config.page_size))
+        page_num = int(query.get('pn', 1))
+        start = (page_num - 1) * page_size
+        end = min(start + page_size, folder['size'])
+        medias = []
+        for i in range(start, end):
+            info = self.server_state.video_info(folder['start'] + i)
+            medias.append({
+                'id': info['aid'],
+                'bvid': info['bvid'],
+                'title': info['title'],
+                'cover': info['pic'],
+                'duration': info['duration'],
+                'page': info['videos'],
+                'ugc': {'first_cid': info['cid']},
+            })
+        self._send_json({
+            'info': {'id': folder['id'], 'title': folder['title'], 'media_count': folder['size']},
+            'medias': medias,
+            'has_more': end < folder['size'],
+        })
+
+    def _playurl(self, query):
+        cid = int(query.get('cid') or 0)
+        self._send_json({
+            'dash': {
+                'audio': [{
+                    'id': 30280,
+                    'baseUrl': f"{self.server_state.base_url}/cdn/audio/{cid}.m4s",
+                    'bandwidth': 192000,
+                    'mimeType': 'audio/mp4',
+                }]
+            }
+        })
+
+    def _cdn_audio(self, path):
+        match = re.match(r'/cdn/audio/(\d+)\.m4s', path)
+        if not match:
+            return self._send_bytes(404, b'Not Found', 'text/plain')
+        self._delay()
+        if self._should_fail():
+            return self._send_bytes(503, b'Service Unavailable', 'text/plain')
+        body = fake_audio(int(match.group(1)), self.server_state.config.audio_size)
+
+        range_header = self.headers.get('Range')
+        range_match = re.match(r'bytes=(\d*)-(\d*)', range_header or '')
+        if range_match:
+            start = int(range_match.group(1) or 0)
+            end = int(range_match.group(2)) if range_match.group(2) else len(body) - 1
+            end = min(end, len(body) - 1)
+            if start > end:
+                return self._send_bytes(416, b'', 'audio/mp4', {'Content-Range': f'bytes */{len(body)}'})
+            return self._send_bytes(206, body[start:end + 1], 'audio/mp4', {
+                'Content-Range': f'bytes {start}-{end}/{len(body)}',
+                'Accept-Ranges': 'bytes',
+            })
+        self._send_bytes(200, body, 'audio/mp4', {'Accept-Ranges': 'bytes'})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟的 Bilibili API 与 CDN')
+    parser.add_argument('--port', type=int, default=8790)
+    parser.add_argument('--latency', type=float, default=20, help='每个请求的延迟（毫秒）')
+    parser.add_argument('--bandwidth', type=int, default=8 * 1024 * 1024, help='每个连接的带宽（字节/秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--folders', default='50,200', help='各收藏夹的视频数量，逗号分隔')
+    parser.add_argument('--audio-size', type=int, default=1024 * 1024)
+    parser.add_argument('--parts', type=int, default=1, help='每个视频的分P数量')
+    args = parser.parse_args()
+
+    config = FakeBilibiliConfig(
+        latency_ms=args.latency,
+        bandwidth=args.bandwidth,
+        error_rate=args.error_rate,
+        folder_sizes=[int(x) for x in args.folders.split(',') if x],
+        audio_size=args.audio_size,
+        parts_per_video=args.parts,
+    )
+    server = FakeBilibiliServer(config, port=args.port).start()
+    print(f"模拟服务器运行在 {server.base_url}")
+    print(f"设置 BILIBILI_API_BASE={server.base_url} 和 BILIBILI_PASSPORT_BASE={server.base_url} 即可连接")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1098 @@
+# File: benchmarks/run.py
+# 离线基准测试：在本地模拟服务器上测量收藏夹同步、下载、音乐库和媒体服务器的性能
+#
+# 用法：python -m benchmarks.run [--only favorites,library] [--library-sizes 1000,10000] [--output result.json]
+# 结果写入 JSON 文件，便于在不同版本之间对比
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from benchmarks.fake_bilibili import ALBUM_INDEX, FakeBilibiliConfig, FakeBilibiliServer, fake_audio, fake_bvid
+
+RESULTS_DIR = PROJECT_ROOT / "benchmarks" / "results"
+
+
+def summarize(samples):
+    """把耗时样本（秒）汇总为毫秒统计"""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    return {
+        'count': len(ordered),
+        'min_ms': round(ordered[0] * 1000, 3),
+        'median_ms': round(statistics.median(ordered) * 1000, 3),
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 3),
+        'p95_ms': round(percentile(95) * 1000, 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+class BenchContext:
+    """各项基准共享的服务实例和模拟服务器"""
+
+    def __init__(self, args, fake, data_dir):
+        self.args = args
+        self.fake = fake
+        self.data_dir = data_dir
+        # 环境变量已指向模拟服务器和临时目录，此时再导入服务
+        from backend.services import AuthService, BilibiliService, DownloadService
+        self.auth_service = AuthService()
+        self.bilibili_service = BilibiliService(self.auth_service)
+        self.download_service = DownloadService(self.auth_service)
+
+    def transport_stats(self):
+        return self.auth_service.transport.stats.snapshot()
+
+
+# ---- 各项基准 ----
+
+def bench_favorites(ctx):
+    """收藏夹全量同步（网络）与缓存读取"""
+    store = ctx.bilibili_service.favorites
+    store.retain_folders([])
+    ctx.fake.reset_counts()
+    seconds, folders = timed(ctx.bilibili_service.get_favorite_folders, True)
+    requests_made = dict(ctx.fake.request_counts)
+    cached_seconds, _ = timed(ctx.bilibili_service.get_favorite_folders, False)
+    return {
+        'folders': len(folders or []),
+        'videos': sum(folder['count'] for folder in folders or []),
+        'sync_seconds': round(seconds, 4),
+        'cached_load_seconds': round(cached_seconds, 4),
+        'requests': requests_made,
+    }
+
+
+def bench_favorites_browse(ctx):
+    """大量收藏的浏览：冷启动读取收藏夹列表、分页读取和跨收藏夹搜索的耗时"""
+    from backend.models.video import Video
+    from backend.services import FavoritesStore
+
+    size = ctx.args.favorites_size
+    folder_size = 1000
+    directory = ctx.data_dir / "bench_favorites_browse"
+    store = FavoritesStore(directory)
+    for folder in range(max(size // folder_size, 1)):
+        videos = [
+            Video(avid=n, bvid=fake_bvid(n), cid=10_000_000 + n, title=f"测试视频 {n} 第{n % 7}集",
+                  pic=f"https://i0.hdslb.com/bfs/archive/{n}.jpg", duration=60 + n % 600, page_count=1).to_dict()
+            for n in range(folder * folder_size, (folder + 1) * folder_size)
+        ]
+        store.write_folder({'id': folder, 'title': f"收藏夹 {folder}", 'media_count': folder_size}, videos)
+    downloaded = {fake_bvid(n) for n in range(0, size, 3)}
+
+    cold_seconds, store = timed(FavoritesStore, directory)
+    list_seconds, folders = timed(store.list_folders)
+    last_folder = folders[-1]['id']
+    first_page_seconds, page = timed(store.get_page, last_folder, 0, 50)
+    next_page_seconds, _ = timed(store.get_page, last_folder, page['next_cursor'], 50)
+    searches = {
+        'keyword': {'keyword': '第3集'},
+        'keyword_rare': {'keyword': f"测试视频 {size - 1} "},
+        'duration': {'min_duration': 300, 'max_duration': 360},
+        'not_downloaded': {'downloaded': False, 'downloaded_bvids': downloaded},
+        'combined': {'keyword': '第3集', 'min_duration': 300, 'downloaded': False, 'downloaded_bvids': downloaded},
+    }
+    search_results = {}
+    for name, query in searches.items():
+        seconds, result = min((timed(store.search, **query, limit=50) for _ in range(3)), key=lambda item: item[0])
+        search_results[name] = {'seconds': round(seconds, 4), 'hits': result['total']}
+    shutil.rmtree(directory, ignore_errors=True)
+    return {
+        'videos': size,
+        'folders': len(folders),
+        'cold_load_seconds': round(cold_seconds, 4),
+        'list_folders_seconds': round(list_seconds, 6),
+        'first_page_seconds': round(first_page_seconds, 4),
+        'next_page_seconds': round(next_page_seconds, 6),
+        'search': search_results,
+    }
+
+
+def bench_single_download(ctx):
+    """单个视频：加载信息并下载音频"""
+    output_dir = ctx.data_dir / "bench_single"
+    samples = []
+    total_bytes = 0
+    for i in range(ctx.args.repeat):
+        start = time.perf_counter()
+        video = ctx.bilibili_service.load_video_info(fake_bvid(i))
+        music = ctx.download_service.download_audio(video, output_dir=output_dir)
+        samples.append(time.perf_counter() - start)
+        if music:
+            total_bytes += music.file_size
+    return {
+        'latency': summarize(samples),
+        'mb_per_second': round(total_bytes / sum(samples) / 1024 / 1024, 3) if samples else 0,
+    }
+
+
+def bench_bulk_download(ctx):
+    """批量下载：并发下载一批视频的音频"""
+    output_dir = ctx.data_dir / "bench_bulk"
+    count = ctx.args.bulk_count
+    videos = [ctx.bilibili_service.load_video_info(fake_bvid(i)) for i in range(count)]
+    videos = [video for video in videos if video]
+
+    def download(video):
+        return ctx.download_service.download_audio(video, output_dir=output_dir)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=ctx.args.workers) as executor:
+        results = list(executor.map(download, videos))
+    seconds = time.perf_counter() - start
+    ok = [music for music in results if music]
+    total_bytes = sum(music.file_size for music in ok)
+    return {
+        'videos': len(videos),
+        'succeeded': len(ok),
+        'workers': ctx.args.workers,
+        'seconds': round(seconds, 4),
+        'tracks_per_second': round(len(ok) / seconds, 3) if seconds else 0,
+        'mb_per_second': round(total_bytes / seconds / 1024 / 1024, 3) if seconds else 0,
+    }
+
+
+def bench_batch_resolve(ctx):
+    """批量解析：一批链接（含重复）并发解析，以及会话内再次解析（命中缓存）"""
+    count = min(ctx.args.bulk_count * 5, ctx.fake.total_videos)
+    items = [f"https://www.bilibili.com/video/{fake_bvid(i)}" for i in range(count)]
+    items += [fake_bvid(i) for i in range(0, count, 4)]
+    ctx.fake.reset_counts()
+    first, results = timed(lambda: list(ctx.bilibili_service.resolve_videos(items)))
+    view_requests = ctx.fake.request_counts['/x/web-interface/view']
+    cached, _ = timed(lambda: list(ctx.bilibili_service.resolve_videos(items)))
+    return {
+        'inputs': len(items),
+        'unique': len(results),
+        'resolved': sum(1 for result in results if result['status'] == 'ok'),
+        'view_requests': view_requests,
+        'seconds': round(first, 4),
+        'cached_seconds': round(cached, 4),
+    }
+
+
+def bench_async_http(ctx):
+    """异步 HTTP 引擎与 requests + 线程池对比：批量解析大量视频、全量同步收藏夹的耗时和峰值线程数
+
+    为测量引擎本身的并发能力，测量期间关闭 API 限速。
+    """
+    from backend.services import BilibiliService
+    from core.async_http import HAS_HTTPX
+    from core.http import RateLimiter
+    if not HAS_HTTPX:
+        return {'skipped': '缺少依赖: httpx'}
+
+    count = min(ctx.args.async_requests, ctx.fake.total_videos)
+    transport = ctx.auth_service.transport
+    limiter = transport.api_limiter
+    transport.api_limiter = RateLimiter(0)
+    results = {'requests': count, 'rate_limit': 'disabled'}
+    try:
+        for mode in ('requests', 'async'):
+            service = BilibiliService(ctx.auth_service)
+            service.rate_limiter = transport.api_limiter
+            if mode == 'requests':
+                service.engine = None
+            peak = {'threads': threading.active_count()}
+            stop = threading.Event()
+
+            def sample():
+                while not stop.wait(0.01):
+                    peak['threads'] = max(peak['threads'], threading.active_count())
+
+            sampler = threading.Thread(target=sample, daemon=True)
+            sampler.start()
+            ctx.fake.reset_counts()
+            items = [fake_bvid(n) for n in range(count)]
+            resolve_seconds, resolved = timed(lambda: list(service.resolve_videos(items, max_workers=64)))
+            favorites_seconds, ok = timed(service.refresh_favorites)
+            stop.set()
+            sampler.join()
+            assert ok and all(result['status'] == 'ok' for result in resolved)
+            results[mode] = {
+                'resolve_seconds': round(resolve_seconds, 4),
+                'favorites_sync_seconds': round(favorites_seconds, 4),
+                'peak_threads': peak['threads'],
+                'server_requests': sum(ctx.fake.request_counts.values()),
+            }
+    finally:
+        transport.api_limiter = limiter
+    return results
+
+
+def bench_album_download(ctx):
+    """多P投稿：并行下载全部分P，与单个分P的耗时对比"""
+    output_dir = ctx.data_dir / "bench_album"
+    video = ctx.bilibili_service.load_video_info(fake_bvid(ALBUM_INDEX))
+    single_seconds, _ = timed(ctx.download_service.download_parts, video, [1], output_dir / "single")
+    seconds, results = timed(ctx.download_service.download_parts, video, None, output_dir / "all")
+    ok = [music for music in results if music]
+    return {
+        'parts': len(video.pages),
+        'succeeded': len(ok),
+        'single_part_seconds': round(single_seconds, 4),
+        'all_parts_seconds': round(seconds, 4),
+        'slowdown_vs_single_part': round(seconds / single_seconds, 2) if single_seconds else None,
+    }
+
+
+def bench_dedup(ctx):
+    """内容索引：重复下载同一批视频（按 cid 跳过）、下载到另一目录（硬链接），以及已有文件的并行哈希与重复报告"""
+    from backend.services import ContentIndex, DownloadService
+    index = ContentIndex(ctx.data_dir / "bench_content_index.json")
+    service = DownloadService(ctx.auth_service, content_index=index)
+    count = ctx.args.bulk_count
+    videos = [ctx.bilibili_service.load_video_info(fake_bvid(i)) for i in range(count)]
+    library_dir = ctx.data_dir / "bench_dedup" / "library"
+
+    def download_all(output_dir):
+        ctx.fake.reset_counts()
+        with ThreadPoolExecutor(max_workers=ctx.args.workers) as executor:
+            seconds, results = timed(lambda: list(executor.map(
+                lambda video: service.download_audio(video, output_dir=output_dir), videos)))
+        return {
+            'succeeded': sum(1 for music in results if music),
+            'seconds': round(seconds, 4),
+            'audio_requests': ctx.fake.request_counts['/cdn/audio'],
+        }
+
+    first = download_all(library_dir)
+    repeat = download_all(library_dir)
+    mirror = download_all(ctx.data_dir / "bench_dedup" / "mirror")
+
+    # 复制一份（独立的文件，不是硬链接）后从零建立索引，测量并行哈希的吞吐并生成重复报告
+    copies_dir = ctx.data_dir / "bench_dedup" / "copies"
+    shutil.copytree(library_dir, copies_dir)
+    tracks = [(path, None) for directory in (library_dir, copies_dir) for path in directory.glob('*.mp3')]
+    fresh_index = ContentIndex(ctx.data_dir / "bench_content_index_fresh.json")
+    build_seconds, stats = timed(fresh_index.build, tracks)
+    rebuild_seconds, _ = timed(fresh_index.build, tracks)
+    report = fresh_index.duplicate_report()
+    return {
+        'videos': len(videos),
+        'first_download': first,
+        'repeat_download': repeat,
+        'mirror_download': mirror,
+        'hash_files': stats['hashed'],
+        'hash_seconds': round(build_seconds, 4),
+        'hash_mb_per_second': round(stats['hashed_bytes'] / build_seconds / 1024 / 1024, 3) if build_seconds else 0,
+        'unchanged_rebuild_seconds': round(rebuild_seconds, 4),
+        'duplicate_files': report['duplicate_files'],
+        'reclaimable_bytes': report['reclaimable_bytes'],
+    }
+
+
+def generate_library(directory, size):
+    """生成 size 条音乐记录：空的音频文件加 json 元数据文件"""
+    directory.mkdir(parents=True, exist_ok=True)
+    for n in range(size):
+        audio_path = directory / f"track_{n:06d}.mp3"
+        audio_path.write_bytes(b'\x00' * 16)
+        info = {
+            'file_path': str(audio_path),
+            'title': f"测试歌曲 {n} {'lofi' if n % 100 == 0 else 'song'}",
+            'album': f"专辑 {n % 500}",
+            'duration': 120 + n % 300,
+            'bv_id': fake_bvid(n),
+            'download_time': datetime.fromtimestamp(1_700_000_000 + n).isoformat(),
+            'pic': None,
+            'cover_path': None,
+        }
+        with open(directory / f"track_{n:06d}.json", 'w', encoding='utf-8') as f:
+            json.dump(info, f, ensure_ascii=False)
+
+
+def bench_library(ctx):
+    """音乐库：冷加载、扫描、搜索、统计、快照"""
+    from backend.services import MusicService
+    from core.serialization import snapshot_path
+    results = {}
+    for size in ctx.args.library_sizes:
+        directory = ctx.data_dir / f"library_{size}" / "downloads"
+        generate_library(directory, size)
+        db_file = directory.parent / "music_library.json"
+
+        service = MusicService(download_dir=directory, music_db_file=db_file)
+        first_scan, _ = timed(service.scan_download_folder)
+        rescan, _ = timed(service.scan_download_folder)
+        cold_load, service = timed(MusicService, download_dir=directory, music_db_file=db_file)
+        search_samples = [timed(service.search_music, 'lofi')[0] for _ in range(ctx.args.repeat)]
+        stats_samples = [timed(service.get_statistics)[0] for _ in range(ctx.args.repeat)]
+        snapshot, _ = timed(service.get_changes_since, None)
+
+        results[str(size)] = {
+            'first_scan_seconds': round(first_scan, 4),
+            'rescan_seconds': round(rescan, 4),
+            'cold_load_seconds': round(cold_load, 4),
+            'search': summarize(search_samples),
+            'statistics': summarize(stats_samples),
+            'snapshot_seconds': round(snapshot, 4),
+            'library_file_bytes': sum(path.stat().st_size for path in (db_file, snapshot_path(db_file))
+                                      if path.exists()),
+        }
+        shutil.rmtree(directory.parent, ignore_errors=True)
+    return results
+
+
+def bench_metadata_storage(ctx):
+    """曲目信息保存方式：sidecar（音频 + json + 封面）与 tags（信息和封面写入音频标签）的下载、文件数、
+    从下载目录重建音乐库的耗时，以及把 sidecar 曲目转换为标签的耗时"""
+    from backend.services import DownloadService, MusicService
+    from backend.services.audio_tags import HAS_MUTAGEN
+    if not HAS_MUTAGEN:
+        return {'skipped': '缺少依赖: mutagen'}
+
+    count = ctx.args.tag_tracks
+    videos = [ctx.bilibili_service.load_video_info(fake_bvid(n)) for n in range(count)]
+    results = {'tracks': count}
+    for storage in ('sidecar', 'tags'):
+        directory = ctx.data_dir / f"bench_storage_{storage}"
+        service = DownloadService(ctx.auth_service, metadata_storage=storage)
+        with ThreadPoolExecutor(max_workers=ctx.args.workers) as executor:
+            download_seconds, tracks = timed(lambda: list(executor.map(
+                lambda video: service.download_audio(video, output_dir=directory), videos)))
+        assert all(tracks)
+        db_file = directory.parent / f"music_library_{storage}.json"
+        library = MusicService(download_dir=directory, music_db_file=db_file, metadata_storage=storage)
+        rebuild_seconds, scanned = timed(library.scan_download_folder)
+        assert len(library.music_library) == count
+        rescan_seconds, _ = timed(library.scan_download_folder)
+        results[storage] = {
+            'download_seconds': round(download_seconds, 4),
+            'files_per_track': round(sum(1 for _ in directory.iterdir()) / count, 2),
+            'rebuild_seconds': round(rebuild_seconds, 4),
+            'rescan_seconds': round(rescan_seconds, 4),
+        }
+
+    # 把 sidecar 目录转换为标签，转换后按标签重建
+    directory = ctx.data_dir / "bench_storage_sidecar"
+    library = MusicService(download_dir=directory, music_db_file=directory.parent / "music_library_migrated.json",
+                           metadata_storage='tags')
+    migrate_seconds, migrated = timed(library.migrate_to_tags)
+    rebuilt = MusicService(download_dir=directory, music_db_file=directory.parent / "music_library_rebuilt.json",
+                           metadata_storage='tags')
+    rebuilt.scan_download_folder()
+    assert len(rebuilt.music_library) == count
+    results['migration'] = {
+        'seconds': round(migrate_seconds, 4),
+        'migrated': migrated['migrated'],
+        'files_per_track_after': round(sum(1 for _ in directory.iterdir()) / count, 2),
+    }
+    for storage in ('sidecar', 'tags'):
+        shutil.rmtree(ctx.data_dir / f"bench_storage_{storage}", ignore_errors=True)
+    return results
+
+
+def bench_layout(ctx):
+    """下载目录布局：flat 目录中的曲目在线迁移到 sharded 布局的耗时，以及两种布局下扫描下载目录的耗时"""
+    from backend.models.music import Music
+    from backend.services import DownloadService, MusicService
+    from backend.services.library_layout import LAYOUT_FLAT, LAYOUT_SHARDED, LibraryLayout
+
+    count = ctx.args.layout_tracks
+    directory = ctx.data_dir / "bench_layout"
+    videos = [ctx.bilibili_service.load_video_info(fake_bvid(n)) for n in range(count)]
+    service = DownloadService(ctx.auth_service, layout=LibraryLayout(directory, LAYOUT_FLAT))
+    with ThreadPoolExecutor(max_workers=ctx.args.workers) as executor:
+        tracks = list(executor.map(service.download_audio, videos))
+    assert all(tracks)
+
+    results = {'tracks': count}
+    db_file = directory.parent / "music_library_layout.json"
+    flat = MusicService(download_dir=directory, music_db_file=db_file, layout=LibraryLayout(directory, LAYOUT_FLAT))
+    flat.scan_download_folder()
+    results['flat_rescan_seconds'] = round(timed(flat.scan_download_folder)[0], 4)
+
+    library = MusicService(download_dir=directory, music_db_file=db_file,
+                           layout=LibraryLayout(directory, LAYOUT_SHARDED))
+    migrate_seconds, stats = timed(library.layout.migrate, library, batch_size=50)
+    assert stats['moved'] == count and not library.layout.pending_migration(library)
+    results['migration'] = {'seconds': round(migrate_seconds, 4), 'moved': stats['moved'],
+                            'tracks_per_second': round(count / migrate_seconds, 1)}
+    rebuilt = MusicService(download_dir=directory, music_db_file=directory.parent / "music_library_sharded.json",
+                           layout=LibraryLayout(directory, LAYOUT_SHARDED))
+    results['sharded_rebuild_seconds'] = round(timed(rebuilt.scan_download_folder)[0], 4)
+    assert len(rebuilt._visible_music()) == count
+    results['sharded_rescan_seconds'] = round(timed(rebuilt.scan_download_folder)[0], 4)
+    results['flat_files_left'] = sum(1 for path in directory.iterdir() if path.is_file())
+    shutil.rmtree(directory, ignore_errors=True)
+
+    # 旧版下载的曲目：json 中没有 cid 和分P字段，封面为 标题_cover.jpg
+    legacy_dir = ctx.data_dir / "bench_layout_legacy"
+    legacy_dir.mkdir(parents=True, exist_ok=True)
+    for n in range(count):
+        title = f"旧版歌曲 {n}"
+        audio_path = legacy_dir / f"{title}.mp3"
+        audio_path.write_bytes(b'\x00' * 16)
+        cover_path = legacy_dir / f"{title}_cover.jpg"
+        cover_path.write_bytes(b'\xff\xd8\xff\xe0')
+        info = {'file_path': str(audio_path), 'title': title, 'album': title, 'duration': 0, 'bv_id': fake_bvid(n),
+                'download_time': datetime.fromtimestamp(1_600_000_000 + n).isoformat(), 'pic': None,
+                'cover_path': str(cover_path), 'file_size': 16, 'cover_url': None}
+        with open(legacy_dir / f"{title}.json", 'w', encoding='utf-8') as f:
+            json.dump(info, f, ensure_ascii=False, indent=2)
+    legacy = MusicService(download_dir=legacy_dir, music_db_file=legacy_dir.parent / "music_library_legacy.json",
+                          layout=LibraryLayout(legacy_dir, LAYOUT_SHARDED))
+    legacy.scan_download_folder()
+    pending = legacy.layout.pending_migration(legacy)
+    assert pending == count, pending
+    migrate_seconds, stats = timed(legacy.layout.migrate, legacy, batch_size=50)
+    assert stats['moved'] == count and not legacy.layout.pending_migration(legacy), stats
+    assert not any(path.is_file() for path in legacy_dir.iterdir())
+    assert all(Path(music.cover_path).exists() for music in legacy.music_library.values())
+    # 音频已丢失的曲目无法迁移，不计入待迁移的曲目
+    legacy.upsert_music(Music(legacy_dir / "已丢失的歌曲.mp3", bv_id=fake_bvid(count)), save=False)
+    assert not legacy.layout.pending_migration(legacy)
+    results['legacy_migration'] = {'seconds': round(migrate_seconds, 4), 'pending': pending, 'moved': stats['moved']}
+    shutil.rmtree(legacy_dir, ignore_errors=True)
+    return results
+
+
+def bench_bulk_delete(ctx):
+    """批量删除：逐首删除（每首重写一次音乐库）与一次批量删除（并行删除文件、只写一次音乐库）的耗时"""
+    from backend.services import MusicService
+
+    count = ctx.args.bulk_delete_tracks
+    results = {'tracks': count}
+    for mode in ('one_by_one', 'bulk'):
+        directory = ctx.data_dir / f"bench_bulk_delete_{mode}" / "downloads"
+        generate_library(directory, count)
+        service = MusicService(download_dir=directory, music_db_file=directory.parent / "music_library.json")
+        service.scan_download_folder()
+        paths = list(service.music_library)
+        if mode == 'bulk':
+            seconds, deleted = timed(service.delete_music_files, paths)
+            assert all(result['status'] == 'ok' for result in deleted)
+        else:
+            seconds, deleted = timed(lambda: [service.delete_music_file(path) for path in paths])
+        assert not service.music_library and not any(directory.iterdir())
+        results[mode] = {'seconds': round(seconds, 4), 'tracks_per_second': round(count / seconds, 1)}
+        shutil.rmtree(directory.parent, ignore_errors=True)
+
+    # 多P投稿逐首删除：删除一个分P时保留共用封面，最后一个分P删除后封面才删除
+    from backend.models.music import Music
+    directory = ctx.data_dir / "bench_bulk_delete_shared_cover" / "downloads"
+    directory.mkdir(parents=True, exist_ok=True)
+    service = MusicService(download_dir=directory, music_db_file=directory.parent / "music_library.json")
+    cover = directory / "shared_cover.jpg"
+    cover.write_bytes(b'\xff\xd8cover')
+    for page in (1, 2):
+        audio_path = directory / f"part_{page}.mp3"
+        audio_path.write_bytes(b'\x00' * 16)
+        service.upsert_music(Music(audio_path, bv_id=fake_bvid(0), page=page, cover_path=str(cover)), save=False)
+    assert service.delete_music_file(str(directory / "part_1.mp3"))['status'] == 'ok'
+    assert cover.exists() and len(service.music_library) == 1
+    assert service.delete_music_file(str(directory / "part_2.mp3"))['status'] == 'ok'
+    assert not cover.exists() and not service.music_library
+    shutil.rmtree(directory.parent, ignore_errors=True)
+    return results
+
+
+def bench_serialization(ctx):
+    """数据文件序列化：音乐库和收藏夹缓存在旧格式（json + indent）、各 JSON 后端和二进制快照下的读写耗时与大小"""
+    from backend.models.music import Music
+    from backend.models.video import Video
+    from backend.services import MusicService
+    from core import serialization
+
+    size = ctx.args.serialization_size
+    directory = ctx.data_dir / "bench_serialization"
+    directory.mkdir(parents=True, exist_ok=True)
+    library = {}
+    for n in range(size):
+        music = Music(directory / f"track_{n:06d}.mp3", title=f"测试歌曲 {n}", album=f"专辑 {n % 500}",
+                      duration=120 + n % 300, bv_id=fake_bvid(n), pic=f"https://i0.hdslb.com/bfs/archive/{n}.jpg",
+                      download_time=datetime.fromtimestamp(1_700_000_000 + n).isoformat(), cid=10_000_000 + n)
+        library[str(music.file_path)] = music.to_dict()
+    folder_size = 1000
+    favorites = [
+        {'id': folder, 'title': f"收藏夹 {folder}", 'media_count': folder_size, 'videos': [
+            Video(avid=n, bvid=fake_bvid(n), cid=10_000_000 + n, title=f"测试视频 {n}",
+                  pic=f"https://i0.hdslb.com/bfs/archive/{n}.jpg", duration=200, page_count=1).to_dict()
+            for n in range(folder * folder_size, (folder + 1) * folder_size)
+        ]}
+        for folder in range(size // folder_size)
+    ]
+
+    def measure(name, data, save, load):
+        path = directory / name
+        save_seconds = min(timed(save, path, data)[0] for _ in range(3))
+        load_seconds, loaded = min((timed(load, path) for _ in range(3)), key=lambda item: item[0])
+        assert loaded == data
+        return {'save_seconds': round(save_seconds, 4), 'load_seconds': round(load_seconds, 4),
+                'bytes': path.stat().st_size}
+
+    def legacy_save(path, data):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+    def legacy_load(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    results = {'entries': size, 'backends': serialization.available_backends()}
+    for label, data in (('library', library), ('favorites', favorites)):
+        formats = {'legacy_json_indent': measure(f"{label}.legacy.json", data, legacy_save, legacy_load)}
+        for backend in serialization.available_backends():
+            formats[f"json_{backend}"] = measure(
+                f"{label}.{backend}.json", data,
+                lambda path, obj, backend=backend: serialization.write_json(path, obj, backend),
+                lambda path, backend=backend: serialization.read_json(path, backend))
+        formats['snapshot'] = measure(f"{label}.snapshot", data, serialization.write_snapshot,
+                                      serialization.read_snapshot)
+        results[label] = formats
+
+    # MusicService 冷启动：旧格式的 music_library.json 与二进制快照
+    db_file = directory / "music_library.json"
+    legacy_save(db_file, library)
+    legacy_seconds, _ = timed(MusicService, download_dir=directory, music_db_file=db_file)
+    serialization.save_document(db_file, library, snapshot=True)
+    snapshot_seconds, service = timed(MusicService, download_dir=directory, music_db_file=db_file)
+    assert len(service.music_library) == size
+    # 快照由其他版本的 Python 写入时退回 JSON，读到的数据与保存的一致
+    snapshot_file = serialization.snapshot_path(db_file)
+    snapshot_file.write_bytes(serialization.SNAPSHOT_MAGIC + b'M' + bytes((2, 7)) + b'\0')
+    assert serialization.load_document(db_file) == library
+    results['music_service_cold_load'] = {
+        'legacy_json_seconds': round(legacy_seconds, 4),
+        'snapshot_seconds': round(snapshot_seconds, 4),
+    }
+    shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def bench_media_server(ctx):
+    """本地媒体服务器：并发请求封面和音频（含 Range 请求）"""
+    try:
+        from werkzeug.serving import make_server
+        from app.server import app
+    except ImportError as e:
+        return {'skipped': f'缺少依赖: {e}'}
+
+    media_dir = ctx.data_dir / "bench_media"
+    media_dir.mkdir(parents=True, exist_ok=True)
+    files = []
+    for n in range(50):
+        (media_dir / f"track_{n}.mp3").write_bytes(os.urandom(ctx.fake.config.audio_size))
+        (media_dir / f"track_{n}_cover.jpg").write_bytes(os.urandom(ctx.fake.config.cover_size))
+        files.append(n)
+
+    os.environ['DOWNLOAD_DIR'] = str(media_dir)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = f"http://127.0.0.1:{server.server_port}/media"
+    session = ctx.auth_service.session
+
+    def fetch(url, headers=None):
+        start = time.perf_counter()
+        res = session.get(url, headers=headers, timeout=30)
+        res.content
+        return time.perf_counter() - start
+
+    try:
+        with ThreadPoolExecutor(max_workers=ctx.args.workers) as executor:
+            covers = list(executor.map(lambda n: fetch(f"{base}/track_{n}_cover.jpg"), files * 4))
+            ranges = list(executor.map(lambda n: fetch(f"{base}/track_{n}.mp3", {'Range': 'bytes=0-65535'}), files))
+            full = list(executor.map(lambda n: fetch(f"{base}/track_{n}.mp3"), files))
+    finally:
+        server.shutdown()
+    return {
+        'cover': summarize(covers),
+        'audio_range_64k': summarize(ranges),
+        'audio_full': summarize(full),
+    }
+
+
+def bench_prefetch(ctx):
+    """播放队列预取：切到下一首时从媒体服务器取到开头 256KB 的耗时（未预取与已预取），
+    以及已被磁盘预算移除的曲目：先重新下载再播放与边下边播（按需解析或已预取）的对比"""
+    try:
+        from werkzeug.serving import make_server
+        from app.server import app
+    except ImportError as e:
+        return {'skipped': f'缺少依赖: {e}'}
+    from backend.models.music import Music
+    from backend.services import DownloadService, MusicService, Prefetcher
+    from backend.services.library_layout import LibraryLayout
+    from core.media_cache import MEDIA_CACHE
+
+    count = ctx.args.prefetch_tracks
+    directory = ctx.data_dir / "bench_prefetch"
+    layout = LibraryLayout(directory)
+    download_service = DownloadService(ctx.auth_service, layout=layout)
+    videos = [ctx.bilibili_service.load_video_info(fake_bvid(n)) for n in range(count)]
+    with ThreadPoolExecutor(max_workers=ctx.args.workers) as executor:
+        tracks = list(executor.map(download_service.download_audio, videos))
+    assert all(tracks)
+    library = MusicService(download_dir=directory, music_db_file=ctx.data_dir / "music_library_prefetch.json",
+                           layout=layout)
+    for music in tracks:
+        library.upsert_music(music, save=False)
+    prefetcher = Prefetcher(library, ctx.bilibili_service, download_service)
+
+    os.environ['DOWNLOAD_DIR'] = str(directory)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    session = ctx.auth_service.session
+    head = {'Range': 'bytes=0-262143'}
+
+    def first_bytes(url):
+        start = time.perf_counter()
+        res = session.get(url, headers=head, timeout=30)
+        assert res.status_code == 206 and len(res.content) == 262144, res.status_code
+        return time.perf_counter() - start
+
+    def prefetch(paths):
+        prefetcher.set_queue(paths)
+        # 预取在单个线程中依次执行，提交一个空任务等待之前的任务完成
+        prefetcher._executor.submit(lambda: None).result()
+
+    def media_url(music):
+        return f"{base}/media/{layout.relative_url(music.file_path)}"
+
+    def stream_url(music):
+        return f"{base}/stream/{layout.relative_url(music.file_path)}"
+
+    def evict(music):
+        music.file_path.unlink()
+        evicted = Music.from_dict(dict(music.to_dict(), evicted=True))
+        library.upsert_music(evicted, save=False)
+        return evicted
+
+    try:
+        cold = [first_bytes(media_url(music)) for music in tracks]
+        warm = []
+        for music in tracks:
+            prefetch([str(music.file_path)])
+            warm.append(first_bytes(media_url(music)))
+        assert MEDIA_CACHE.status()['entries'] > 0
+
+        half = count // 2
+        restore_first, on_demand, prefetched = [], [], []
+        for music in tracks[:half]:
+            evicted = evict(music)
+            start = time.perf_counter()
+            restored = download_service.download_audio(videos[tracks.index(music)], filename=music.file_path.name,
+                                                       output_dir=music.file_path.parent, reuse_existing=False)
+            assert restored
+            restore_first.append(time.perf_counter() - start + first_bytes(media_url(music)))
+            evicted = evict(music)
+            start = time.perf_counter()
+            assert prefetcher.resolve_stream(evicted)
+            on_demand.append(time.perf_counter() - start + first_bytes(stream_url(evicted)))
+        for music in tracks[half:]:
+            evicted = evict(music)
+            prefetch([str(evicted.file_path)])
+            prefetched.append(first_bytes(stream_url(evicted)))
+    finally:
+        server.shutdown()
+        prefetcher.close()
+        shutil.rmtree(directory, ignore_errors=True)
+    return {
+        'tracks': count,
+        'local_first_256k': {'cold': summarize(cold), 'prefetched': summarize(warm)},
+        'evicted_first_256k': {
+            'restore_then_play': summarize(restore_first),
+            'stream_on_demand': summarize(on_demand),
+            'stream_prefetched': summarize(prefetched),
+        },
+        'cache': MEDIA_CACHE.status(),
+    }
+
+
+def bench_bandwidth(ctx):
+    """带宽调度：总上限的实际吞吐、前台与后台同时下载时的分配、边下边播时后台让出带宽"""
+    from backend.services import DownloadService
+    from backend.services.library_layout import LibraryLayout
+    from core.bandwidth import FOREGROUND, MIRROR, PLAYBACK, BandwidthScheduler, traffic_scope
+
+    limit = int(ctx.args.bandwidth_limit_kb * 1024)
+    directory = ctx.data_dir / "bench_bandwidth"
+    videos = [ctx.bilibili_service.load_video_info(fake_bvid(n)) for n in range(ctx.args.bulk_count)]
+    results = {'limit_bytes_per_second': limit}
+
+    def download(service, traffic_class, batch):
+        """按流量类别下载一批视频，返回 (字节数, 秒)"""
+        def one(video):
+            with traffic_scope(traffic_class):
+                music = service.download_audio(video, output_dir=directory / traffic_class, reuse_existing=False)
+            return music.file_path.stat().st_size if music else 0
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=ctx.args.workers) as executor:
+            size = sum(executor.map(one, batch))
+        return size, time.perf_counter() - start
+
+    def rate(size, seconds):
+        return round(size / seconds)
+
+    half = len(videos) // 2
+    # 只有后台下载：吞吐应接近总上限
+    service = DownloadService(ctx.auth_service, layout=LibraryLayout(directory), bandwidth=BandwidthScheduler(limit))
+    size, seconds = download(service, MIRROR, videos[:half])
+    results['mirror_alone'] = {'bytes_per_second': rate(size, seconds), 'of_limit': round(size / seconds / limit, 3)}
+
+    # 前台与后台同时下载：按权重分配
+    scheduler = BandwidthScheduler(limit)
+    service = DownloadService(ctx.auth_service, layout=LibraryLayout(directory), bandwidth=scheduler)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        mirror = executor.submit(download, service, MIRROR, videos[half:])
+        foreground = executor.submit(download, service, FOREGROUND, videos[:4])
+        foreground_rate = rate(*foreground.result())
+        mirror_rate = rate(*mirror.result())
+    results['mixed'] = {'foreground_bytes_per_second': foreground_rate, 'mirror_bytes_per_second': mirror_rate,
+                        'expected_shares': scheduler.shares}
+
+    # 边下边播进行中：后台下载让出带宽
+    scheduler = BandwidthScheduler(limit)
+    service = DownloadService(ctx.auth_service, layout=LibraryLayout(directory), bandwidth=scheduler)
+    with scheduler.transfer(PLAYBACK):
+        allocation = scheduler.allocation(extra=MIRROR)
+        size, seconds = download(service, MIRROR, videos[:4])
+    results['mirror_during_playback'] = {'bytes_per_second': rate(size, seconds),
+                                         'allocated': round(allocation[MIRROR])}
+    shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def bench_verify(ctx):
+    """音乐库校验：每个文件计算完整哈希、首次校验（廉价检查）、重复校验（按缓存跳过）的耗时，
+    以及损坏几个文件后重复校验和完整校验分别能发现哪些问题"""
+    from backend.services import ContentIndex, LibraryVerifier, MusicService
+    from backend.services.content_index import hash_file
+
+    count = ctx.args.verify_tracks
+    root = ctx.data_dir / "bench_verify"
+    directory = root / "downloads"
+    directory.mkdir(parents=True, exist_ok=True)
+    content_index = ContentIndex(root / "content_index.json")
+    for n in range(count):
+        audio_path = directory / f"track_{n:06d}.mp3"
+        audio_path.write_bytes(fake_audio(10_000_000 + n, ctx.args.audio_size))
+        content_index.record(audio_path, hash_file(audio_path), 10_000_000 + n)
+        with open(directory / f"track_{n:06d}.json", 'w', encoding='utf-8') as f:
+            json.dump({'file_path': str(audio_path), 'title': f"测试歌曲 {n}", 'bv_id': fake_bvid(n),
+                       'cid': 10_000_000 + n}, f, ensure_ascii=False)
+    content_index.save()
+    service = MusicService(download_dir=directory, music_db_file=root / "music_library.json")
+    service.scan_download_folder()
+
+    def run(verifier, **kwargs):
+        seconds, report = timed(verifier.verify, **kwargs)
+        return {'seconds': round(seconds, 4), 'checked': report['checked'], 'cached': report['cached'],
+                'full_checks': report['full_checks'], 'problems': len(report['problems'])}, report
+
+    results = {'tracks': count, 'audio_size': ctx.args.audio_size}
+    results['full_hash'], _ = run(LibraryVerifier(service, content_index, root / "full_cache.json"), full=True)
+    verifier = LibraryVerifier(service, content_index, root / "verify_cache.json")
+    results['first_run'], _ = run(verifier)
+    results['repeat_run'], _ = run(verifier)
+
+    # 截断、同大小的静默损坏（修改时间不变）、删除、整段清零各制造一个问题
+    paths = sorted(service.music_library)
+    with open(paths[0], 'r+b') as f:
+        f.truncate(ctx.args.audio_size // 2)
+    stat = os.stat(paths[1])
+    with open(paths[1], 'r+b') as f:
+        f.seek(stat.st_size - 100)
+        f.write(b'\xff' * 16)
+    os.utime(paths[1], ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    os.unlink(paths[2])
+    with open(paths[3], 'r+b') as f:
+        f.write(b'\x00' * 64)
+    # 大小和修改时间都没变的静默损坏只有忽略缓存的完整校验才能发现
+    results['after_damage'], report = run(verifier)
+    found = {problem['file_path']: problem['problem'] for problem in report['problems']}
+    assert set(found) == {paths[0], paths[2], paths[3]}, found
+    results['after_damage_full'], report = run(verifier, full=True)
+    found = {problem['file_path']: problem['problem'] for problem in report['problems']}
+    assert set(found) == set(paths[:4]), found
+    results['detected'] = sorted(found.values())
+    shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def bench_export(ctx):
+    """增量导出：首次导出、无变化时再次同步、少量曲目增删改后同步，以及 album 布局和收藏夹播放列表"""
+    from backend.models.music import Music
+    from backend.services import ContentIndex, FavoritesStore, LibraryExporter, MusicService
+
+    count = ctx.args.export_tracks
+    root = ctx.data_dir / "bench_export"
+    directory = root / "downloads"
+    generate_library(directory, count)
+    service = MusicService(download_dir=directory, music_db_file=root / "music_library.json")
+    service.scan_download_folder()
+    favorites = FavoritesStore(root / "favorites")
+    favorites.write_folder({'id': 1, 'title': '默认收藏夹'}, [{'bvid': fake_bvid(n)} for n in range(0, count, 7)])
+    exporter = LibraryExporter(service, ContentIndex(root / "content_index.json"), favorites)
+
+    def run(target, **kwargs):
+        seconds, result = timed(exporter.export, root / target, **kwargs)
+        return dict({key: result[key] for key in ('copied', 'hardlinked', 'moved', 'unchanged', 'deleted', 'failed')},
+                    seconds=round(seconds, 4))
+
+    results = {'tracks': count}
+    results['first_export'] = run('mirror', link=False)
+    results['resync_unchanged'] = run('mirror', link=False)
+    assert results['resync_unchanged']['copied'] == 0
+
+    # 改写 10 首、从音乐库删除 10 首（音频和 json 都不再导出）、新增 10 首
+    paths = sorted(service.music_library)
+    for path in paths[:10]:
+        Path(path).write_bytes(b'\x01' * 32)
+    with service.transaction():
+        for path in paths[10:20]:
+            service.remove_music(path)
+    for n in range(count, count + 10):
+        audio_path = directory / f"track_{n:06d}.mp3"
+        audio_path.write_bytes(bytes([n % 256]) * 24)
+        service.upsert_music(Music(audio_path, bv_id=fake_bvid(n), title=f"新歌曲 {n}"))
+    results['resync_changed'] = run('mirror', link=False)
+    assert results['resync_changed']['copied'] == 20 and results['resync_changed']['deleted'] == 20, results
+
+    results['album_first_export'] = run('album', layout='album', playlists=True)
+    results['album_resync_unchanged'] = run('album', layout='album', playlists=True)
+    shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def bench_cover_archive(ctx):
+    """封面归档：冷加载封面网格时逐个文件返回与从映射的 pack 按切片返回，导入已有封面和整理归档的耗时"""
+    try:
+        from app.server import app
+    except ImportError as e:
+        return {'skipped': f'缺少依赖: {e}'}
+    from backend.models.music import Music
+    from backend.services import MusicService
+    from core.cover_archive import COVER_ARCHIVE
+    from core.serialization import write_json
+
+    count = ctx.args.cover_tracks
+    root = ctx.data_dir / "bench_covers"
+    directory = root / "downloads"
+    generate_library(directory, count)
+    service = MusicService(download_dir=directory, music_db_file=root / "music_library.json")
+    service.scan_download_folder()
+    cover_size = ctx.fake.config.cover_size
+
+    def save_info(music):
+        write_json(service.layout.sidecar_path(music.file_path), music.to_dict())
+
+    with service.transaction():
+        for music in list(service.music_library.values()):
+            cover_path = music.file_path.with_name(f"{music.file_path.stem}_cover.jpg")
+            cover_path.write_bytes(b'\xff\xd8\xff\xe0' + os.urandom(cover_size - 4))
+            music = Music.from_dict(dict(music.to_dict(), cover_path=str(cover_path)))
+            save_info(music)
+            service.upsert_music(music)
+
+    os.environ['DOWNLOAD_DIR'] = str(directory)
+    client = app.test_client()
+
+    def load_grid(urls):
+        total = 0
+        for url in urls:
+            res = client.get(url)
+            assert res.status_code == 200, (url, res.status_code)
+            total += len(res.data)
+        return total
+
+    tracks = sorted(service.music_library.values(), key=lambda music: str(music.file_path))
+    file_urls = [f"/media/{service.layout.relative_url(music.cover_path)}" for music in tracks]
+    results = {'covers': count, 'cover_size': cover_size}
+    files_seconds, files_bytes = timed(load_grid, file_urls)
+    results['grid_files'] = {'seconds': round(files_seconds, 4), 'per_cover_ms': round(files_seconds / count * 1000, 4)}
+
+    seconds, imported = timed(service.import_covers, COVER_ARCHIVE, save_info)
+    assert imported['imported'] == count and imported['covers_removed'] == count, imported
+    results['import'] = {'seconds': round(seconds, 4), 'bytes': imported['bytes']}
+
+    archive_urls = [f"/covers/{music.cover_path.split(':', 1)[1]}"
+                    for music in sorted(service.music_library.values(), key=lambda music: str(music.file_path))]
+    archive_seconds, archive_bytes = timed(load_grid, archive_urls)
+    assert archive_bytes == files_bytes
+    results['grid_archive'] = {'seconds': round(archive_seconds, 4),
+                               'per_cover_ms': round(archive_seconds / count * 1000, 4),
+                               'speedup': round(files_seconds / archive_seconds, 2) if archive_seconds else None}
+
+    # 删除一半曲目后整理归档
+    with service.transaction():
+        for music in tracks[::2]:
+            service.remove_music(music.file_path)
+    seconds, compacted = timed(COVER_ARCHIVE.compact, service.archived_covers())
+    assert compacted['kept'] == count - len(tracks[::2]), compacted
+    results['compact'] = {'seconds': round(seconds, 4), 'kept': compacted['kept'],
+                          'reclaimed_bytes': compacted['reclaimed_bytes']}
+    assert load_grid(archive_urls[1::2]) == compacted['size']
+
+    # 校验后只重新下载归档封面：新的 cover_path 写入保存的音乐库
+    from app.api import Api
+    api = Api(headless=True, warm_up=False)
+    api.__dict__.update(music_service=service, download_service=ctx.download_service)
+    key = str(tracks[1].file_path)
+    music = Music.from_dict(dict(service.get_music_by_path(key).to_dict(), pic=f"{ctx.fake.base_url}/cdn/cover/1.jpg"))
+    service.upsert_music(music)
+    assert api._repair_track(None, key, 'cover')['status'] == 'ok'
+    saved = MusicService(download_dir=directory, music_db_file=root / "music_library.json").get_music_by_path(key)
+    assert saved.cover_path != music.cover_path and COVER_ARCHIVE.get(saved.cover_path)[0] == ctx.fake._cover
+    shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def bench_startup(ctx):
+    """启动耗时：导入、构造 Api、冷启动到首帧可交互（见 benchmarks/startup.py）"""
+    from benchmarks.startup import run_startup_benchmarks
+    return run_startup_benchmarks(ctx.data_dir / "startup", max(ctx.args.library_sizes or [0]), ctx.args.repeat)
+
+
+BENCHMARKS = {
+    'startup': bench_startup,
+    'favorites': bench_favorites,
+    'favorites_browse': bench_favorites_browse,
+    'single_download': bench_single_download,
+    'bulk_download': bench_bulk_download,
+    'album_download': bench_album_download,
+    'batch_resolve': bench_batch_resolve,
+    'async_http': bench_async_http,
+    'dedup': bench_dedup,
+    'library': bench_library,
+    'serialization': bench_serialization,
+    'metadata_storage': bench_metadata_storage,
+    'layout': bench_layout,
+    'bulk_delete': bench_bulk_delete,
+    'media_server': bench_media_server,
+    'prefetch': bench_prefetch,
+    'bandwidth': bench_bandwidth,
+    'verify': bench_verify,
+    'export': bench_export,
+    'cover_archive': bench_cover_archive,
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Bilibili Music 离线基准测试')
+    parser.add_argument('--only', default='', help='只运行指定的基准，逗号分隔：' + ','.join(BENCHMARKS))
+    parser.add_argument('--output', help='结果文件路径，默认写入 benchmarks/results/')
+    parser.add_argument('--latency', type=float, default=20, help='模拟接口延迟（毫秒）')
+    parser.add_argument('--bandwidth', type=int, default=16 * 1024 * 1024, help='模拟每连接带宽（字节/秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='模拟接口随机失败概率')
+    parser.add_argument('--folders', default='50,200', help='各收藏夹的视频数量，逗号分隔')
+    parser.add_argument('--audio-size', type=int, default=1024 * 1024, help='模拟音频大小（字节）')
+    parser.add_argument('--library-sizes', default='1000,10000,100000', help='音乐库规模，逗号分隔')
+    parser.add_argument('--favorites-size', type=int, default=100000, help='收藏夹浏览基准的收藏视频数')
+    parser.add_argument('--tag-tracks', type=int, default=200, help='曲目信息保存方式基准的曲目数')
+    parser.add_argument('--layout-tracks', type=int, default=200, help='下载目录布局基准的曲目数')
+    parser.add_argument('--bulk-delete-tracks', type=int, default=1000, help='批量删除基准的曲目数')
+    parser.add_argument('--prefetch-tracks', type=int, default=20, help='播放队列预取基准的曲目数')
+    parser.add_argument('--export-tracks', type=int, default=10000, help='增量导出基准的曲目数')
+    parser.add_argument('--cover-tracks', type=int, default=2000, help='封面归档基准的曲目数')
+    parser.add_argument('--verify-tracks', type=int, default=500, help='音乐库校验基准的曲目数')
+    parser.add_argument('--bandwidth-limit-kb', type=float, default=4096, help='带宽调度基准的总速率上限（KB/s）')
+    parser.add_argument('--async-requests', type=int, default=500, help='异步 HTTP 基准中批量解析的视频数')
+    parser.add_argument('--serialization-size', type=int, default=100000, help='序列化基准的条目数')
+    parser.add_argument('--bulk-count', type=int, default=40, help='批量下载的视频数量')
+    parser.add_argument('--album-parts', type=int, default=40, help='多P投稿基准的分P数量')
+    parser.add_argument('--workers', type=int, default=8, help='并发线程数')
+    parser.add_argument('--repeat', type=int, default=5, help='重复测量次数')
+    args = parser.parse_args(argv)
+    args.library_sizes = [int(x) for x in args.library_sizes.split(',') if x]
+    args.only = [x for x in args.only.split(',') if x]
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    data_dir = Path(tempfile.mkdtemp(prefix='bilibili_music_bench_'))
+    config = FakeBilibiliConfig(
+        latency_ms=args.latency,
+        bandwidth=args.bandwidth,
+        error_rate=args.error_rate,
+        folder_sizes=[int(x) for x in args.folders.split(',') if x],
+        audio_size=args.audio_size,
+        album_parts=args.album_parts,
+    )
+    fake = FakeBilibiliServer(config).start()
+
+    # 服务通过环境变量连接模拟服务器，并把数据写到临时目录
+    os.environ['BILIBILI_API_BASE'] = fake.base_url
+    os.environ['BILIBILI_PASSPORT_BASE'] = fake.base_url
+    os.environ['BILIBILI_MUSIC_DATA_DIR'] = str(data_dir)
+
+    results = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'server_config': config.to_dict(),
+            'args': {k: v for k, v in vars(args).items() if k != 'output'},
+        },
+        'benchmarks': {},
+    }
+
+    try:
+        ctx = BenchContext(args, fake, data_dir)
+        for name, bench in BENCHMARKS.items():
+            if args.only and name not in args.only:
+                continue
+            print(f"运行基准: {name} ...")
+            try:
+                start = time.perf_counter()
+                results['benchmarks'][name] = bench(ctx)
+                results['benchmarks'][name]['wall_seconds'] = round(time.perf_counter() - start, 4)
+            except Exception as e:
+                print(f"基准 {name} 失败: {e}")
+                results['benchmarks'][name] = {'error': repr(e)}
+        results['transport'] = ctx.transport_stats()
+    finally:
+        fake.stop()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"bench-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"基准结果已写入 {output}")
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+# File: benchmarks/startup.py
+# 启动耗时基准：在全新的子进程中测量导入、构造 Api 以及冷启动到首帧可交互的耗时
+#
+# 用法：python -m benchmarks.startup [--library-size 10000] [--repeat 5] [--check]
+# “首帧可交互”以前端就绪后的第一个调用 get_music_library_changes 返回为准；--check 时超出预算返回非零退出码
+import argparse
+import json
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+# 启动预算（毫秒），均为子进程内从开始导入算起的耗时
+STARTUP_BUDGET_MS = {
+    'import_app_api': 60,
+    'api_construct': 10,
+    'first_interactive': 500,
+}
+
+# 在子进程中执行的测量脚本，输出各阶段耗时（毫秒）的 JSON
+_PROBE = r'''
+import json, sys, time
+begin = time.perf_counter()
+sys.path.insert(0, {root!r})
+marks = {{}}
+import app.api
+marks['import_app_api'] = time.perf_counter() - begin
+# 导入 app.api 之后、第一次调用之前已加载的模块
+loaded = set(sys.modules)
+from core.config import ensure_data_dirs
+ensure_data_dirs()
+start = time.perf_counter()
+api = app.api.Api()
+marks['api_construct'] = time.perf_counter() - start
+library = api.get_music_library_changes()
+marks['first_interactive'] = time.perf_counter() - begin
+marks['tracks'] = len(library['music'])
+heavy = ('requests', 'qrcode', 'mutagen', 'flask', 'cryptography', 'webview')
+marks['heavy_modules_before_first_call'] = [name for name in heavy if name in loaded]
+print(json.dumps({{k: (round(v * 1000, 3) if isinstance(v, float) else v) for k, v in marks.items()}}))
+'''
+
+
+def run_probe(env):
+    start = time.perf_counter()
+    script = _PROBE.format(root=str(PROJECT_ROOT))
+    output = subprocess.check_output([sys.executable, '-c', script], env=env, cwd=PROJECT_ROOT,
+                                     stderr=subprocess.DEVNULL)
+    wall = time.perf_counter() - start
+    result = json.loads(output.decode().strip().splitlines()[-1])
+    # 包含解释器自身启动的总耗时
+    result['process_wall'] = round(wall * 1000, 3)
+    return result
+
+
+def top_imports(env, module='app.api', limit=10):
+    """用 -X importtime 找出导入 module 时累计耗时最多的模块"""
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], env=env,
+                               cwd=PROJECT_ROOT, capture_output=True, text=True)
+    entries = []
+    for line in completed.stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)', line)
+        if match:
+            entries.append((int(match.group(2)), match.group(4)))
+    entries.sort(reverse=True)
+    return [{'module': name, 'cumulative_ms': round(us / 1000, 3)} for us, name in entries[:limit]]
+
+
+def time_command(args, env, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(args, env=env, cwd=PROJECT_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        samples.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(samples), 3)
+
+
+def run_startup_benchmarks(data_dir, library_size=10000, repeat=5):
+    """返回各阶段耗时的中位数、预算检查结果和最慢的导入模块"""
+    from benchmarks.run import generate_library
+
+    data_dir = Path(data_dir)
+    generate_library(data_dir / "downloads", library_size)
+    env = dict(os.environ, BILIBILI_MUSIC_DATA_DIR=str(data_dir))
+    # 首次运行时写入 music_library.json，之后的测量都是从已有音乐库冷启动
+    run_probe(env)
+
+    probes = [run_probe(env) for _ in range(repeat)]
+    phases = ('import_app_api', 'api_construct', 'first_interactive', 'process_wall')
+    medians = {phase: round(statistics.median(probe[phase] for probe in probes), 3) for phase in phases}
+
+    result = {
+        'library_size': library_size,
+        'median_ms': medians,
+        'budget_ms': STARTUP_BUDGET_MS,
+        'over_budget': [phase for phase, budget in STARTUP_BUDGET_MS.items() if medians[phase] > budget],
+        'heavy_modules_before_first_call': probes[-1]['heavy_modules_before_first_call'],
+        'top_imports': top_imports(env),
+        'cli_help_ms': time_command([sys.executable, 'cli.py', '--help'], env, repeat),
+    }
+    try:
+        import webview  # noqa: F401
+        result['import_webview_ms'] = time_command([sys.executable, '-c', 'import webview'], env, repeat)
+    except ImportError:
+        result['import_webview_ms'] = None
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bilibili Music 启动耗时基准')
+    parser.add_argument('--library-size', type=int, default=10000, help='冷启动时已有音乐库的规模')
+    parser.add_argument('--repeat', type=int, default=5, help='重复测量次数，取中位数')
+    parser.add_argument('--check', action='store_true', help='超出启动预算时返回非零退出码')
+    args = parser.parse_args(argv)
+
+    data_dir = Path(tempfile.mkdtemp(prefix='bilibili_music_startup_'))
+    try:
+        result = run_startup_benchmarks(data_dir, args.library_size, args.repeat)
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.check and result['over_budget']:
+        print(f"超出启动预算: {', '.join(result['over_budget'])}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,429 @@
+# File: cli.py
+# 无界面入口：不启动 pywebview，直接基于 Api 和各服务完成同步、镜像、导出、扫描、校验和媒体服务
+#
+# 用法：
+#   python cli.py login                              # 终端中扫码登录
+#   python cli.py sync-favorites [--folder 默认收藏夹]  # 下载收藏夹中尚未入库的音频
+#   python cli.py mirror --output /srv/music          # 按收藏夹分目录镜像到指定位置
+#   python cli.py export --output /mnt/phone/Music [--layout album] [--playlists]  # 增量导出本地音乐库
+#   python cli.py scan | verify [--redownload] [--full] [--clean] | dedup | migrate-tags | migrate-layout | serve [--port 8765]
+#   python cli.py covers import | compact | status     # 把封面文件导入封面归档、回收已删除曲目的封面
+#   python cli.py daemon --interval 3600 --serve      # 定时同步，同时提供媒体服务和 /metrics
+import argparse
+import signal
+import sys
+import threading
+import time
+from pathlib import Path
+
+from app.api import Api
+from backend.models.video import Video
+from backend.services.content_index import format_size
+from backend.services.download import safe_filename, part_filename
+from core.bandwidth import BANDWIDTH, MIRROR, parse_schedule, traffic_scope
+from core.config import DOWNLOAD_DIR, MEDIA_SERVER_PORT, ensure_data_dirs
+from core.log import configure as configure_log, log_event
+from core.metrics import SYNC_RUNS, SYNC_LAST_SUCCESS
+
+
+class ProgressPrinter:
+    """订阅事件通道，把任务进度输出到标准输出；同一任务的进度每秒最多输出一次"""
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self._last = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        data = event['data'] or {}
+        if event['type'] == 'job_progress':
+            now = time.time()
+            with self._lock:
+                if now - self._last.get(data['job_id'], 0) < self.interval:
+                    return
+                self._last[data['job_id']] = now
+            current, total = data.get('current'), data.get('total')
+            if current is not None and total:
+                self._write(f"[{data['kind']}] {data.get('message') or ''} {current * 100 // total}%")
+            elif data.get('message'):
+                self._write(f"[{data['kind']}] {data['message']}")
+        elif event['type'] == 'job_done':
+            with self._lock:
+                self._last.pop(data['job_id'], None)
+            result = data.get('result') or {}
+            message = result.get('message') if isinstance(result, dict) else None
+            self._write(f"[{data['kind']}] {data['status']}{': ' + message if message else ''}")
+
+    @staticmethod
+    def _write(line):
+        # 事件来自工作线程，整行一次写出，避免与主线程的输出交错
+        sys.stdout.write(line + '\n')
+        sys.stdout.flush()
+
+
+def run_jobs(api, job_ids):
+    """等待一批任务完成，返回各任务的结果"""
+    # _jobs 只是对前端隐藏，无界面入口直接使用
+    return [api._jobs.wait(job_id) for job_id in job_ids]
+
+
+def select_folders(favorites, names):
+    """按收藏夹 ID 或名称筛选，names 为空时返回全部"""
+    if not names:
+        return favorites
+    wanted = {str(name) for name in names}
+    return [folder for folder in favorites if str(folder['id']) in wanted or folder['title'] in wanted]
+
+
+def load_favorites(api, refresh=True):
+    """收藏夹列表（不含视频），视频在处理到该收藏夹时再逐个读取"""
+    favorites = api.bilibili_service.get_favorite_folders(force_refresh=refresh)
+    if not favorites:
+        print("获取收藏夹失败，请先运行 `python cli.py login` 登录")
+    return favorites or []
+
+
+def sync_favorites(api, folder_names=None, refresh=True):
+    """下载所选收藏夹中尚未入库的视频音频，返回是否全部成功"""
+    folders = select_folders(load_favorites(api, refresh), folder_names)
+    if not folders:
+        SYNC_RUNS.inc(status='error')
+        return False
+
+    known = {music.bv_id for music in api.music_service.get_all_music() if music.bv_id}
+    pending = {}
+    store = api.bilibili_service.favorites
+    for folder in folders:
+        for video in store.folder_videos(folder['id']):
+            if video.get('bvid') and video['bvid'] not in known:
+                pending.setdefault(video['bvid'], video)
+    print(f"收藏夹 {len(folders)} 个，待下载 {len(pending)} 个", flush=True)
+
+    tickets = [api.download_audio(video, background=True) for video in pending.values()]
+    results = run_jobs(api, [ticket['job_id'] for ticket in tickets if ticket.get('job_id')])
+    failed = sum(1 for result in results if not result or result.get('status') != 'ok')
+
+    SYNC_RUNS.inc(status='ok' if not failed else 'partial')
+    if not failed:
+        SYNC_LAST_SUCCESS.set(time.time())
+    log_event('sync_favorites', folders=len(folders), downloaded=len(results) - failed, failed=failed)
+    print(f"同步完成：成功 {len(results) - failed} 个，失败 {failed} 个", flush=True)
+    return failed == 0
+
+
+def expected_filenames(video_dict):
+    """视频下载后的音频文件名，多P投稿每个分P一个文件"""
+    page_count = video_dict.get('page_count') or 1
+    if page_count > 1:
+        return [part_filename(video_dict['title'], page) for page in range(1, page_count + 1)]
+    return [safe_filename(video_dict['title'])]
+
+
+def _mirror_download(job, api, video_dict, output_dir):
+    """镜像任务：下载到指定目录，不写入音乐库"""
+    with traffic_scope(MIRROR):
+        return _mirror_video(job, api, video_dict, output_dir)
+
+
+def _mirror_video(job, api, video_dict, output_dir):
+    video = Video.from_dict(video_dict)
+    job.progress(0, None, video.title)
+    progress_callback = lambda done, total: job.progress(done, total, video.title)
+    if video.is_multi_part:
+        video = api.bilibili_service.load_video_info(video.bvid) or video
+        # 已镜像的分P不再下载
+        missing = [page['page'] for page in video.pages
+                   if not (Path(output_dir) / part_filename(video.title, page['page'])).exists()]
+        if not missing:
+            return {'status': 'ok', 'message': f'已是最新: {video.title}'}
+        results = api.download_service.download_parts(video, missing, output_dir=output_dir,
+                                                      progress_callback=progress_callback,
+                                                      cancel_check=lambda: job.cancelled)
+        if results and all(results):
+            return {'status': 'ok', 'message': f'已保存 {len(results)} 个分P: {video.title}'}
+        return {'status': 'error', 'message': f'部分分P下载失败: {video.title}'}
+
+    music = api.download_service.download_audio(
+        video,
+        output_dir=output_dir,
+        progress_callback=progress_callback,
+        cancel_check=lambda: job.cancelled
+    )
+    if music:
+        return {'status': 'ok', 'message': f'已保存到 {music.file_path}'}
+    return {'status': 'error', 'message': f'下载失败: {video.title}'}
+
+
+def mirror_folders(api, output, folder_names=None, refresh=True):
+    """把收藏夹按“输出目录/收藏夹名称/”的结构镜像到本地，已存在的文件跳过"""
+    folders = select_folders(load_favorites(api, refresh), folder_names)
+    if not folders:
+        return False
+
+    store = api.bilibili_service.favorites
+    job_ids = []
+    for folder in folders:
+        folder_dir = Path(output) / safe_filename(folder['title'], suffix='')
+        for video in store.folder_videos(folder['id']):
+            if not video.get('title') or all((folder_dir / name).exists() for name in expected_filenames(video)):
+                continue
+            job_ids.append(api._jobs.submit('mirror_download', _mirror_download, api, video, folder_dir))
+    print(f"收藏夹 {len(folders)} 个，待镜像 {len(job_ids)} 个", flush=True)
+
+    results = run_jobs(api, job_ids)
+    api.content_index.save()
+    failed = sum(1 for result in results if not result or result.get('status') != 'ok')
+    log_event('mirror_folders', output=str(output), folders=len(folders), downloaded=len(results) - failed,
+              failed=failed)
+    print(f"镜像完成：成功 {len(results) - failed} 个，失败 {failed} 个", flush=True)
+    return failed == 0
+
+
+def verify_library(api, redownload=False, full=False, clean=False):
+    """校验音乐库文件是否完整，redownload 时等待修复队列完成；返回是否没有遗留问题"""
+    result = run_jobs(api, [api.verify_library(repair=redownload, full=full, clean=clean)['job_id']])[0] or {}
+    if result.get('status') != 'ok':
+        print(f"校验音乐库失败: {result.get('message')}")
+        return False
+    for problem in result['problems']:
+        print(f"{problem['message']}: {problem['title']} ({problem['file_path']})")
+    for orphan in result['orphans']:
+        print(f"孤立文件: {orphan['path']}")
+    print(result['message'], flush=True)
+    if result['cleaned']:
+        print(f"已删除 {result['cleaned']['files']} 个文件，移除 {result['cleaned']['records']} 条记录", flush=True)
+
+    if redownload:
+        repaired = run_jobs(api, result['repair_jobs'])
+        failed = sum(1 for item in repaired if not item or item.get('status') != 'ok')
+        print(f"修复完成：成功 {len(repaired) - failed} 首，失败 {failed} 首", flush=True)
+        unrepairable = sum(1 for problem in result['problems'] if not problem['repair'])
+        return failed == 0 and unrepairable == 0 and (clean or not result['orphans'])
+    return not result['problems'] and (clean or not result['orphans'])
+
+
+def duplicate_report(api, limit=20):
+    """补全内容索引后输出重复文件报告"""
+    report = run_jobs(api, [api.get_duplicate_report()['job_id']])[0] or {}
+    if report.get('status') != 'ok':
+        print(f"生成重复文件报告失败: {report.get('message')}")
+        return False
+    for group in report['groups'][:limit]:
+        print(f"{format_size(group['size'])} × {len(group['paths'])}（独立副本 {group['copies']} 个，"
+              f"可释放 {format_size(group['reclaimable'])}）")
+        for path in group['paths']:
+            print(f"    {path}")
+    print(report['message'], flush=True)
+    return True
+
+
+def start_server(port, background=False):
+    # 只在需要时导入 Flask
+    from app.server import start_media_server
+    if not background:
+        start_media_server(DOWNLOAD_DIR, port)
+        return
+    threading.Thread(target=start_media_server, args=(DOWNLOAD_DIR, port), daemon=True).start()
+
+
+def login(api):
+    """在终端中显示二维码并等待扫码登录"""
+    user_info = api.auth_service.check_login_status()
+    if user_info:
+        print(f"已登录用户: {user_info['uname']}")
+        return True
+    qrcode_data = api.auth_service.get_login_qrcode()
+    if not qrcode_data:
+        return False
+
+    import qrcode
+    qr = qrcode.QRCode()
+    qr.add_data(qrcode_data['url'])
+    qr.print_ascii(invert=True)
+    print("请使用B站手机客户端扫描二维码登录")
+    # 与图形界面共用同一个轮询任务，状态变化通过事件输出
+    api._login_watch_key = qrcode_data['qrcode_key']
+    job_id = api._jobs.submit('login_watch', api._watch_login, qrcode_data['qrcode_key'])
+    result = api._jobs.wait(job_id) or {}
+    print(result.get('message', ''))
+    return result.get('status') == 'ok'
+
+
+def run_daemon(api, args):
+    """按固定间隔重复同步，收到 SIGTERM/SIGINT 后在当前轮结束时退出"""
+    stop = threading.Event()
+
+    def handle_signal(signum, frame):
+        print("收到退出信号，正在停止...", flush=True)
+        stop.set()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    if args.serve:
+        start_server(args.port, background=True)
+    if args.budget_mb:
+        # 超出预算时按最近播放时间在后台移除本地文件，已移除的曲目同步时不会重新下载
+        print(f"磁盘预算: {args.budget_mb:g} MB", flush=True)
+        api.set_library_budget(args.budget_mb)
+
+    while not stop.is_set():
+        started = time.time()
+        try:
+            if args.output:
+                mirror_folders(api, args.output, args.folder)
+            else:
+                sync_favorites(api, args.folder)
+        except Exception as e:
+            SYNC_RUNS.inc(status='error')
+            print(f"同步失败: {e}", flush=True)
+            log_event('sync_failed', level='error', error=str(e))
+        next_run = started + args.interval
+        print(f"下次同步: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(next_run))}", flush=True)
+        stop.wait(max(0, next_run - time.time()))
+    api.auth_service.stop_auto_refresh()
+    return True
+
+
+def positive_float(value):
+    """argparse 类型：大于 0 的数"""
+    try:
+        number = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'无效的数值: {value}')
+    if not 0 < number < float('inf'):
+        raise argparse.ArgumentTypeError(f'必须大于 0: {value}')
+    return number
+
+
+def bandwidth_schedule(text):
+    """argparse 类型：按时段的速率上限，规则无效时给出出错的规则"""
+    try:
+        parse_schedule(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return text
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Bilibili Music 无界面模式')
+    parser.add_argument('--workers', type=int, default=4, help='同时下载的任务数')
+    parser.add_argument('--log-stdout', action='store_true', help='同时把结构化日志输出到标准输出')
+    parser.add_argument('--limit-rate', type=positive_float, help='下载总速率上限（KB/s）')
+    parser.add_argument('--bandwidth-schedule', type=bandwidth_schedule, help='按时段的速率上限，如 "01:00-07:00=0,09:00-18:00=512"（KB/s，0 为不限制）')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('login', help='扫码登录')
+
+    sync = subparsers.add_parser('sync-favorites', help='下载收藏夹中尚未入库的音频')
+    sync.add_argument('--folder', action='append', help='只同步指定的收藏夹（ID 或名称，可重复）')
+    sync.add_argument('--cached', action='store_true', help='使用缓存的收藏夹列表，不重新获取')
+
+    mirror = subparsers.add_parser('mirror', help='按收藏夹分目录镜像到指定位置')
+    mirror.add_argument('--output', required=True, help='镜像目录')
+    mirror.add_argument('--folder', action='append', help='只镜像指定的收藏夹（ID 或名称，可重复）')
+    mirror.add_argument('--cached', action='store_true', help='使用缓存的收藏夹列表，不重新获取')
+
+    export = subparsers.add_parser('export', help='把本地音乐库增量导出到外部目录（手机、NAS 等）')
+    export.add_argument('--output', required=True, help='导出目录')
+    export.add_argument('--layout', choices=('mirror', 'album'), default='mirror',
+                        help='mirror 保持下载目录结构，album 按“专辑/曲目”命名（扩展名按实际格式改为 .m4a）')
+    export.add_argument('--playlists', action='store_true', help='为每个收藏夹写一个 M3U 播放列表')
+    export.add_argument('--keep-deleted', action='store_true', help='保留音乐库中已删除曲目的导出文件')
+    export.add_argument('--no-link', action='store_true', help='总是复制，不使用 reflink 或硬链接')
+
+    subparsers.add_parser('scan', help='扫描下载目录，更新音乐库')
+
+    dedup = subparsers.add_parser('dedup', help='列出内容重复的音频及可释放的磁盘空间')
+    dedup.add_argument('--limit', type=int, default=20, help='最多列出的重复组数')
+
+    subparsers.add_parser('migrate-tags', help='把已有曲目的 json 和封面文件转换为音频标签（需要 mutagen）')
+    subparsers.add_parser('migrate-layout', help='把已有曲目移到当前下载目录布局（BILIBILI_MUSIC_LIBRARY_LAYOUT）下的位置')
+
+    verify = subparsers.add_parser('verify', help='检查音乐库文件是否完整')
+    verify.add_argument('--redownload', action='store_true', help='重新下载缺失、不完整或损坏的音频和封面')
+    verify.add_argument('--full', action='store_true', help='忽略校验缓存，对每个文件计算完整哈希')
+    verify.add_argument('--clean', action='store_true', help='删除孤立的 json 和临时文件，移除无法重新下载的缺失记录')
+
+    covers = subparsers.add_parser('covers', help='封面归档：导入已有的封面文件、整理归档或查看状态')
+    covers.add_argument('action', choices=('import', 'compact', 'status'),
+                        help='import 导入 *_cover.* 文件并删除原文件，compact 回收已删除曲目的封面，status 查看归档大小')
+
+    serve = subparsers.add_parser('serve', help='只启动媒体服务器（含 /metrics）')
+    serve.add_argument('--port', type=int, default=MEDIA_SERVER_PORT)
+
+    daemon = subparsers.add_parser('daemon', help='定时同步收藏夹')
+    daemon.add_argument('--interval', type=float, default=3600, help='同步间隔（秒）')
+    daemon.add_argument('--folder', action='append', help='只同步指定的收藏夹（ID 或名称，可重复）')
+    daemon.add_argument('--output', help='指定时改为镜像到该目录，而不是下载到音乐库')
+    daemon.add_argument('--serve', action='store_true', help='同时启动媒体服务器（含 /metrics）')
+    daemon.add_argument('--budget-mb', type=positive_float, help='音乐库的磁盘预算（MB），超出时移除最久未播放曲目的本地文件')
+    daemon.add_argument('--port', type=int, default=MEDIA_SERVER_PORT)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.log_stdout:
+        configure_log(stream=sys.stdout)
+    ensure_data_dirs()
+    if args.limit_rate:
+        BANDWIDTH.set_limit(int(args.limit_rate * 1024))
+    if args.bandwidth_schedule:
+        BANDWIDTH.set_schedule(args.bandwidth_schedule)
+
+    if args.command == 'serve':
+        start_server(args.port)
+        return 0
+
+    api = Api(headless=True, max_workers=args.workers)
+    api._events.subscribe(ProgressPrinter())
+
+    if args.command == 'login':
+        ok = login(api)
+    elif args.command == 'sync-favorites':
+        ok = sync_favorites(api, args.folder, refresh=not args.cached)
+    elif args.command == 'mirror':
+        ok = mirror_folders(api, args.output, args.folder, refresh=not args.cached)
+    elif args.command == 'export':
+        ticket = api.export_library(args.output, args.layout, args.playlists, delete=not args.keep_deleted,
+                                    link=not args.no_link)
+        result = run_jobs(api, [ticket['job_id']])[0] if ticket.get('job_id') else ticket
+        print((result or {}).get('message', '导出失败'), flush=True)
+        ok = bool(result) and result.get('status') == 'ok'
+    elif args.command == 'scan':
+        result = run_jobs(api, [api.refresh_music_library()['job_id']])[0] or {}
+        statistics = api.get_music_statistics()
+        print(f"扫描完成：{result.get('count', 0)} 个文件，共 {statistics['total_count']} 首，"
+              f"{statistics['total_size_readable']}，{statistics['total_duration_readable']}")
+        ok = result.get('status') == 'ok'
+    elif args.command == 'dedup':
+        ok = duplicate_report(api, args.limit)
+    elif args.command == 'migrate-tags':
+        result = run_jobs(api, [api.migrate_to_tags()['job_id']])[0] or {}
+        print(result.get('message', '转换失败'), flush=True)
+        ok = result.get('status') == 'ok'
+    elif args.command == 'migrate-layout':
+        result = run_jobs(api, [api.migrate_layout()['job_id']])[0] or {}
+        print(result.get('message', '迁移失败'), flush=True)
+        ok = result.get('status') == 'ok'
+    elif args.command == 'verify':
+        ok = verify_library(api, args.redownload, args.full, args.clean)
+    elif args.command == 'covers':
+        if args.action == 'status':
+            status = api.get_cover_archive_status()
+            print(f"封面归档 {status['pack']}：{status['covers']} 张封面，{format_size(status['size'])}，"
+                  f"可回收 {format_size(status['garbage_bytes'])}", flush=True)
+            ok = True
+        else:
+            ticket = api.import_covers() if args.action == 'import' else api.compact_cover_archive()
+            result = run_jobs(api, [ticket['job_id']])[0] or {}
+            print(result.get('message', '处理封面归档失败'), flush=True)
+            ok = result.get('status') == 'ok'
+    else:
+        ok = run_daemon(api, args)
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,172 @@
+# File: core/async_http.py
+# 异步 HTTP 引擎：在一个后台线程中运行 asyncio 事件循环，接口请求通过 httpx 多路复用少量连接（HTTPS 下为 HTTP/2）
+# 同步代码通过 run / get / map 调用，不需要自己管理事件循环；需要 httpx，未安装时服务退回 requests
+import asyncio
+import concurrent.futures
+import importlib.util
+import threading
+import time
+from urllib.parse import urlparse
+
+from core.config import ASYNC_HTTP_CONFIG, DEFAULT_HEADERS
+
+HAS_HTTPX = importlib.util.find_spec('httpx') is not None
+HAS_H2 = importlib.util.find_spec('h2') is not None
+
+if not HAS_HTTPX:
+    print("Warning: httpx not installed. 接口请求改用 requests，每个在途请求占用一个线程。")
+
+
+class AsyncEngine:
+    """共享的异步请求引擎
+
+    - 所有请求在同一个事件循环线程中执行，同时在途的请求数由 max_in_flight 限制，连接数由 max_connections 限制
+    - Cookie 与 HttpTransport 的 Session 共用同一个 CookieJar，登录和刷新 Cookie 后立即生效
+    - 每个请求有总时限，超时或被取消时中止；请求耗时记入 HttpTransport 的统计
+    """
+
+    def __init__(self, transport, config=None):
+        import httpx
+
+        config = config or ASYNC_HTTP_CONFIG
+        self.transport = transport
+        self.timeout = config['timeout']
+        self.max_in_flight = config['max_in_flight']
+        # 请求失败时可能抛出的异常，调用方据此与其他错误区分
+        self.errors = (httpx.HTTPError, asyncio.TimeoutError)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='http-async', daemon=True)
+        self._thread.start()
+        self._client = None
+        self._semaphore = None
+        self.run(self._setup(httpx, config))
+
+    async def _setup(self, httpx, config):
+        # 客户端和信号量在事件循环中创建
+        self._client = httpx.AsyncClient(
+            http2=HAS_H2,
+            headers=DEFAULT_HEADERS,
+            cookies=self.transport.session.cookies,
+            limits=httpx.Limits(max_connections=config['max_connections'],
+                                max_keepalive_connections=config['max_connections']),
+            follow_redirects=True
+        )
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+
+    def run(self, coro, timeout=None):
+        """在引擎的事件循环中运行协程并等待结果；超过 timeout 秒时取消协程并抛出 TimeoutError"""
+        if threading.current_thread() is self._thread:
+            raise RuntimeError('不能在引擎的事件循环中同步等待，请直接 await')
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    def get(self, url, **kwargs):
+        """同步发送 GET 请求，参数同 request"""
+        return self.run(self.request('GET', url, **kwargs))
+
+    def map(self, func, items, cancel_check=None, poll_interval=0.2):
+        """对每个元素并发运行协程 func(item)，按完成顺序产出 (item, 结果)，协程抛出的异常作为结果产出
+
+        cancel_check() 返回 True 或调用方提前停止迭代时，取消其余尚未完成的协程。
+        """
+        futures = {asyncio.run_coroutine_threadsafe(func(item), self._loop): item for item in items}
+        pending = set(futures)
+        try:
+            while pending:
+                done, pending = concurrent.futures.wait(pending, timeout=poll_interval,
+                                                        return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    if future.cancelled():
+                        continue
+                    error = future.exception()
+                    yield futures[future], error if error is not None else future.result()
+                if cancel_check and cancel_check():
+                    break
+        finally:
+            for future in pending:
+                future.cancel()
+
+    async def _wait_rate_limit(self, limiter):
+        while True:
+            delay = limiter.reserve()
+            if not delay:
+                return
+            await asyncio.sleep(delay)
+
+    async def request(self, method, url, params=None, timeout=None, rate_limited=False, **kwargs):
+        """发送请求并读完响应体，返回 httpx.Response
+
+        timeout 为从发出请求到读完响应的总时限（秒），排队等待不计入；rate_limited 为 True 时先从
+        传输层的 API 限速器取令牌。
+        """
+        timeout = timeout or self.timeout
+        if rate_limited:
+            await self._wait_rate_limit(self.transport.api_limiter)
+        async with self._semaphore:
+            parsed = urlparse(url)
+            record = {
+                'method': method.upper(),
+                'host': parsed.netloc,
+                'path': parsed.path,
+                'status': None,
+                'new_connection': False,
+                'error': False,
+                'bytes': 0,
+                'dns': 0.0, 'connect': 0.0, 'tls': 0.0, 'ttfb': 0.0, 'transfer': 0.0, 'total': 0.0,
+                'start': time.perf_counter(),
+            }
+            try:
+                response = await asyncio.wait_for(self._send(method, url, params, timeout, kwargs, record), timeout)
+            except BaseException:
+                # 包括超时和取消，都记为失败的请求
+                record['error'] = True
+                self._finish(record)
+                raise
+            record['status'] = response.status_code
+            record['error'] = response.status_code >= 400
+            record['bytes'] = len(response.content)
+            record['http_version'] = response.http_version
+            self._finish(record)
+            return response
+
+    async def _send(self, method, url, params, timeout, kwargs, record):
+        started = {}
+
+        async def trace(event, info):
+            # httpcore 的连接事件：TCP 连接（含 DNS 解析）和 TLS 握手，复用连接时不会出现
+            now = time.perf_counter()
+            if event.endswith('.started'):
+                started[event[:-len('.started')]] = now
+            elif event == 'connection.connect_tcp.complete':
+                record['new_connection'] = True
+                record['connect'] += now - started.get('connection.connect_tcp', now)
+            elif event == 'connection.start_tls.complete':
+                record['tls'] += now - started.get('connection.start_tls', now)
+
+        request = self._client.build_request(method, url, params=params, timeout=timeout,
+                                             extensions={'trace': trace}, **kwargs)
+        response = await self._client.send(request, stream=True)
+        record['ttfb'] = time.perf_counter() - record['start']
+        try:
+            await response.aread()
+        finally:
+            await response.aclose()
+        return response
+
+    def _finish(self, record):
+        record['total'] = time.perf_counter() - record['start']
+        if record['ttfb']:
+            record['transfer'] = record['total'] - record['ttfb']
+        self.transport.stats.record(record)
+
+    def close(self):
+        """关闭所有连接并停止事件循环（退出前调用）"""
+        try:
+            self.run(self._client.aclose(), timeout=5)
+        except Exception as e:
+            print(f"关闭异步 HTTP 引擎失败: {e}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
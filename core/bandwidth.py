@@ -0,0 +1,243 @@
+# File: core/bandwidth.py
+# 带宽调度：所有音频和封面下载共享一个总速率上限，按流量类别的权重分配；
+# 有曲目正在从 CDN 边下边播时，后台类流量自动让出带宽；上限可按时段调整
+import contextvars
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+from core.config import (BANDWIDTH_LIMIT, BANDWIDTH_PLAYBACK_BACKGROUND_RATE, BANDWIDTH_PLAYBACK_FACTOR,
+                         BANDWIDTH_PLAYBACK_RESERVE, BANDWIDTH_SCHEDULE, BANDWIDTH_SHARES)
+from core.metrics import BANDWIDTH_ALLOCATION, BANDWIDTH_BYTES, BANDWIDTH_LIMIT_RATE, BANDWIDTH_WAIT, PLAYBACK_STREAMS
+
+FOREGROUND = 'foreground'
+MIRROR = 'mirror'
+COVER = 'cover'
+PREFETCH = 'prefetch'
+# 边下边播本身不限速，只用于判断是否需要让出带宽
+PLAYBACK = 'playback'
+
+# 令牌桶最多积累多少秒的额度，空闲后恢复传输时的突发量
+BURST_SECONDS = 0.5
+# 扣除播放预留后，限速类流量至少保留的速率（字节/秒）
+MIN_RATE = 16 * 1024
+
+_traffic_class = contextvars.ContextVar('traffic_class', default=FOREGROUND)
+
+
+def current_class():
+    return _traffic_class.get()
+
+
+@contextmanager
+def traffic_scope(traffic_class):
+    """在代码块内把下载计入指定的流量类别（线程池中的任务需要在任务内重新设置）"""
+    token = _traffic_class.set(traffic_class)
+    try:
+        yield traffic_class
+    finally:
+        _traffic_class.reset(token)
+
+
+def _parse_clock(text):
+    """解析 HH:MM（00:00 至 24:00），返回从零点起的分钟数；格式或范围无效时抛出 ValueError"""
+    hour, sep, minute = text.strip().partition(':')
+    if not sep or not hour.isdigit() or not minute.isdigit() or len(minute) != 2:
+        raise ValueError(f'时间应为 HH:MM: {text.strip()!r}')
+    hour, minute = int(hour), int(minute)
+    if hour > 24 or minute > 59 or (hour == 24 and minute):
+        raise ValueError(f'时间超出范围: {text.strip()!r}')
+    return hour * 60 + minute
+
+
+def check_limit(limit):
+    """校验总速率上限（字节/秒）：None 或 0 表示不限制，负数或非有限值抛出 ValueError"""
+    if limit is None or limit == 0:
+        return None
+    if not 0 < limit < float('inf'):
+        raise ValueError(f'速率上限必须大于等于 0: {limit}')
+    return limit
+
+
+def parse_schedule(text):
+    """解析 "01:00-07:00=0,09:00-18:00=512" 形式的时段规则（KB/s，0 为不限制），返回规则列表
+
+    格式无效、时间超出范围或上限为负数时抛出 ValueError，错误信息中带有出错的规则。
+    """
+    rules = []
+    for item in (text or '').split(','):
+        if not item.strip():
+            continue
+        window, sep, limit = item.partition('=')
+        start, dash, end = window.partition('-')
+        try:
+            if not sep or not dash:
+                raise ValueError('应为 HH:MM-HH:MM=KB/s')
+            try:
+                kb = float(limit)
+            except ValueError:
+                raise ValueError(f'速率上限不是数字: {limit.strip()!r}')
+            if not 0 <= kb < float('inf'):
+                raise ValueError(f'速率上限必须大于等于 0: {limit.strip()}')
+            start, end = _parse_clock(start), _parse_clock(end)
+        except ValueError as e:
+            raise ValueError(f'无效的时段规则 "{item.strip()}": {e}') from None
+        rules.append({
+            'start': start,
+            'end': end,
+            'limit': int(kb * 1024) if kb > 0 else None,
+            'text': item.strip(),
+        })
+    return rules
+
+
+class BandwidthScheduler:
+    """按类别分配总速率的令牌桶
+
+    - 只在同时活跃的类别之间按 shares 的权重分配，某一类空闲时其余类别分到更多
+    - 边下边播进行中时，后台类别（foreground 以外）的权重乘以 playback_factor，总上限中为播放预留
+      playback_reserve，且后台类别合计不超过 playback_background_rate
+    - schedule 中命中当前时刻的第一条规则覆盖总上限
+    """
+
+    def __init__(self, limit=BANDWIDTH_LIMIT, shares=None, schedule=None,
+                 playback_factor=BANDWIDTH_PLAYBACK_FACTOR, playback_reserve=BANDWIDTH_PLAYBACK_RESERVE,
+                 playback_background_rate=BANDWIDTH_PLAYBACK_BACKGROUND_RATE):
+        self.limit = check_limit(limit)
+        self.shares = dict(shares or BANDWIDTH_SHARES)
+        if schedule is None:
+            # 环境变量中的规则无效时不影响启动，只是不按时段调整
+            try:
+                self.schedule = parse_schedule(BANDWIDTH_SCHEDULE)
+            except ValueError as e:
+                print(f"警告: 环境变量 BILIBILI_MUSIC_BANDWIDTH_SCHEDULE 无效，已忽略: {e}")
+                self.schedule = []
+        else:
+            self.schedule = parse_schedule(schedule)
+        self.playback_factor = playback_factor
+        self.playback_reserve = playback_reserve
+        self.playback_background_rate = playback_background_rate
+        self._lock = threading.Lock()
+        self._active = defaultdict(int)
+        self._buckets = {}
+
+    def set_limit(self, limit):
+        """设置总速率上限（字节/秒），None 或 0 表示不限制；负数抛出 ValueError"""
+        self.limit = check_limit(limit)
+        self.publish()
+
+    def set_schedule(self, text):
+        """替换时段规则；规则无效时抛出 ValueError，原有规则不变"""
+        self.schedule = parse_schedule(text)
+        self.publish()
+
+    def effective_limit(self, now=None):
+        """当前时刻生效的总上限：命中的时段规则优先"""
+        now = now or datetime.now()
+        minute = now.hour * 60 + now.minute
+        for rule in self.schedule:
+            start, end = rule['start'], rule['end']
+            inside = start <= minute < end if start <= end else (minute >= start or minute < end)
+            if inside:
+                return rule['limit']
+        return self.limit
+
+    def allocation(self, extra=None, now=None):
+        """各活跃类别当前分到的速率（字节/秒），None 表示不限制；extra 为即将开始传输的类别"""
+        with self._lock:
+            active = {name for name, count in self._active.items() if count > 0 and name != PLAYBACK}
+            playing = self._active[PLAYBACK] > 0
+        if extra and extra != PLAYBACK:
+            active.add(extra)
+        limit = self.effective_limit(now)
+        weights = {}
+        for name in active:
+            weight = self.shares.get(name, 1)
+            if playing and name != FOREGROUND:
+                weight *= self.playback_factor
+            weights[name] = weight
+
+        if limit is None:
+            rates = {name: None for name in active}
+        else:
+            available = max(MIN_RATE, limit - (self.playback_reserve if playing else 0))
+            total = sum(weights.values()) or 1
+            rates = {name: available * weight / total for name, weight in weights.items()}
+        if playing:
+            # 后台类别合计不超过 playback_background_rate，按权重分摊
+            background = {name: weight for name, weight in weights.items() if name != FOREGROUND}
+            total = sum(background.values()) or 1
+            for name, weight in background.items():
+                capped = self.playback_background_rate * weight / total
+                rates[name] = capped if rates[name] is None else min(rates[name], capped)
+        return rates
+
+    @contextmanager
+    def transfer(self, traffic_class=None):
+        """标记一次传输的开始和结束，活跃的类别参与分配"""
+        traffic_class = traffic_class or current_class()
+        with self._lock:
+            self._active[traffic_class] += 1
+        self.publish()
+        try:
+            yield traffic_class
+        finally:
+            with self._lock:
+                self._active[traffic_class] -= 1
+            self.publish()
+
+    def consume(self, nbytes, traffic_class=None):
+        """记入已传输的 nbytes 字节，超出所属类别的速率时阻塞等待；返回等待的秒数"""
+        traffic_class = traffic_class or current_class()
+        BANDWIDTH_BYTES.inc(nbytes, traffic_class=traffic_class)
+        if traffic_class == PLAYBACK:
+            return 0.0
+        rate = self.allocation(extra=traffic_class).get(traffic_class)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.setdefault(traffic_class, {'tokens': 0.0, 'updated': now})
+            if rate is None:
+                bucket['tokens'], bucket['updated'] = 0.0, now
+                return 0.0
+            bucket['tokens'] = min(rate * BURST_SECONDS, bucket['tokens'] + (now - bucket['updated']) * rate)
+            bucket['updated'] = now
+            bucket['tokens'] -= nbytes
+            wait = -bucket['tokens'] / rate if bucket['tokens'] < 0 else 0.0
+        if wait:
+            BANDWIDTH_WAIT.inc(wait, traffic_class=traffic_class)
+            time.sleep(wait)
+        return wait
+
+    def publish(self):
+        """把当前的总上限和各类别的分配写入指标"""
+        limit = self.effective_limit()
+        BANDWIDTH_LIMIT_RATE.set(limit or 0)
+        allocation = self.allocation()
+        for name in set(self.shares) | set(allocation):
+            if name not in allocation:
+                BANDWIDTH_ALLOCATION.set(0, traffic_class=name)
+            else:
+                rate = allocation[name]
+                BANDWIDTH_ALLOCATION.set(-1 if rate is None else round(rate), traffic_class=name)
+        with self._lock:
+            PLAYBACK_STREAMS.set(self._active[PLAYBACK])
+
+    def status(self):
+        with self._lock:
+            active = {name: count for name, count in self._active.items() if count > 0}
+        limit = self.effective_limit()
+        return {
+            'limit': self.limit,
+            'effective_limit': limit,
+            'schedule': [rule['text'] for rule in self.schedule],
+            'shares': dict(self.shares),
+            'active': active,
+            'playback': active.get(PLAYBACK, 0) > 0,
+            'allocation': {name: None if rate is None else round(rate) for name, rate in self.allocation().items()},
+        }
+
+
+# 进程内共享的调度器，下载服务、预取和媒体服务器共用
+BANDWIDTH = BandwidthScheduler()
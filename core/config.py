@@ -19,32 +19,177 @@ APP_ROOT = get_app_path()
 # 项目根目录
 PROJECT_ROOT = Path(APP_ROOT)
 
-# 数据目录
-DATA_DIR = PROJECT_ROOT / "data"
+def _positive_env(name, scale, zero_unlimited=False):
+    """读取以 KB、MB 等为单位的正数环境变量，乘以 scale 换算为字节；未设置或无效时返回 None（无效时给出警告）
+
+    zero_unlimited 为 True 时 0 也表示不限制，返回 None 且不警告。
+    """
+    value = os.environ.get(name)
+    if not value:
+        return None
+    try:
+        number = float(value)
+    except ValueError:
+        number = None
+    if zero_unlimited and number == 0:
+        return None
+    if number is None or not 0 < number < float('inf'):
+        print(f"警告: 环境变量 {name}={value!r} 无效，应为大于 0 的数，已忽略")
+        return None
+    return int(number * scale)
+
+# 数据目录，可通过环境变量 BILIBILI_MUSIC_DATA_DIR 改到其他位置（基准测试使用临时目录）
+DATA_DIR = Path(os.environ.get('BILIBILI_MUSIC_DATA_DIR') or PROJECT_ROOT / "data")
 SESSION_DIR = DATA_DIR / "sessions"
 DOWNLOAD_DIR = DATA_DIR / "downloads"
 QRCODE_DIR = DATA_DIR / "qrcodes"
 
-# 确保目录存在
-for dir_path in [DATA_DIR, SESSION_DIR, DOWNLOAD_DIR, QRCODE_DIR]:
-    dir_path.mkdir(parents=True, exist_ok=True)
+
+def ensure_data_dirs():
+    """创建数据目录；由程序入口在启动时调用，导入本模块不再产生副作用"""
+    for dir_path in [DATA_DIR, SESSION_DIR, DOWNLOAD_DIR, QRCODE_DIR]:
+        dir_path.mkdir(parents=True, exist_ok=True)
 
 # 默认配置
 DEFAULT_SESSION_FILE = SESSION_DIR / "bilibili_session.json"
 DEFAULT_QRCODE_FILE = QRCODE_DIR / "bilibili_qrcode.png"
+# 旧版整体缓存的收藏夹文件，启动时自动转换到 FAVORITES_DIR
 FAVORITES_CACHE_FILE = DATA_DIR / "favorites_cache.json"
+FAVORITES_DIR = DATA_DIR / "favorites"
+CONTENT_INDEX_FILE = DATA_DIR / "content_index.json"
+PLAY_HISTORY_FILE = DATA_DIR / "play_history.json"
+# 校验音乐库时记录每个文件通过校验时的大小和修改时间，未变化的文件下次不再检查
+VERIFY_CACHE_FILE = DATA_DIR / "verify_cache.json"
+# 封面归档：所有封面打包在一个追加写入的文件中，索引记录偏移和长度，媒体服务器通过 mmap 按切片返回
+COVER_ARCHIVE_DIR = DATA_DIR / "covers"
 
 # API配置
+# 接口地址可通过环境变量覆盖，用于连接本地的模拟服务器（见 benchmarks/）
+API_BASE_URL = os.environ.get('BILIBILI_API_BASE', 'https://api.bilibili.com')
+PASSPORT_BASE_URL = os.environ.get('BILIBILI_PASSPORT_BASE', 'https://passport.bilibili.com')
+
 BILIBILI_API = {
-    'base_url': 'https://api.bilibili.com',
-    'login_base': 'https://passport.bilibili.com',
-    'get_fav': 'https://api.bilibili.com/x/v3/fav/folder/created/list-all',
-    'get_fav_videos': 'https://api.bilibili.com/x/v3/fav/resource/list',
-    'get_fav_videos_detail': 'https://api.bilibili.com/x/v3/fav/resource/list',
-    'play_url': 'https://api.bilibili.com/x/player/playurl',
-    'subtitle_url': 'https://api.bilibili.com/x/player/v2',
+    'base_url': API_BASE_URL,
+    'login_base': PASSPORT_BASE_URL,
+    'get_fav': f'{API_BASE_URL}/x/v3/fav/folder/created/list-all',
+    'get_fav_videos': f'{API_BASE_URL}/x/v3/fav/resource/list',
+    'get_fav_videos_detail': f'{API_BASE_URL}/x/v3/fav/resource/list',
+    'play_url': f'{API_BASE_URL}/x/player/playurl',
+    'subtitle_url': f'{API_BASE_URL}/x/player/v2',
     'user_agent': "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
 }
 
+# 所有请求共用的默认请求头，在传输层中预先设置，不再每次请求时构造
+DEFAULT_HEADERS = {
+    "User-Agent": BILIBILI_API['user_agent'],
+    "Referer": "https://www.bilibili.com/"
+}
+
+# HTTP 连接池配置：每个主机保持的最大连接数，应不小于同时访问该主机的工作线程数
+# 未单独列出的主机（音频 CDN、封面图床等）使用 default
+HTTP_POOL_CONFIG = {
+    'default': 16,
+    'hosts': {
+        API_BASE_URL: 16,
+        PASSPORT_BASE_URL: 4,
+        'https://www.bilibili.com': 4,
+    }
+}
+
+# 对 API 主机的请求速率限制（令牌桶）：每秒请求数和允许的突发数，所有服务共享
+API_RATE_LIMIT = {
+    'rate': 10,
+    'burst': 20,
+}
+
+# 异步 HTTP 引擎（需要 httpx，另装 h2 时 HTTPS 接口使用 HTTP/2）：接口请求在一个事件循环线程中多路复用少量连接，
+# 不再每个在途请求占用一个线程；设置环境变量 BILIBILI_MUSIC_ASYNC_HTTP=0 时改回 requests
+ASYNC_HTTP = os.environ.get('BILIBILI_MUSIC_ASYNC_HTTP', '1') != '0'
+ASYNC_HTTP_CONFIG = {
+    'max_connections': 8,    # 所有主机合计的最大连接数；HTTP/2 下每个主机只用一个连接，HTTP/1.1 下每个在途请求一个
+    'max_in_flight': 256,    # 同时在途的请求数上限，其余请求在引擎中排队
+    'timeout': 10,           # 默认的单个请求总时限（秒）
+}
+
+# 多P投稿同时下载的分P数，不超过上面音频 CDN 所用的连接池大小
+PART_DOWNLOAD_WORKERS = 16
+
+# 后台计算已有文件内容哈希时同时读取的文件数
+CONTENT_HASH_WORKERS = 4
+
+# 批量操作（删除、改标签、移动、重新下载多首曲目）同时处理的曲目数
+BULK_WORKERS = 8
+
+# 耗时较长的后台任务（整理、校验、导出音乐库等）同时运行的个数，它们使用单独的线程池，不占用下载等普通任务的线程
+LONG_JOB_WORKERS = 2
+
+# 校验音乐库时同时检查的文件数
+VERIFY_WORKERS = 8
+
+# 导出音乐库到外部目录时同时复制的文件数；目标是 U 盘、手机或网络共享时并发过高反而更慢
+EXPORT_WORKERS = 4
+
+# 新下载的封面是否写入封面归档（而不是单独的 *_cover.* 文件），已有的封面可通过 covers import 导入
+COVER_ARCHIVE_ENABLED = os.environ.get('BILIBILI_MUSIC_COVER_ARCHIVE') == '1'
+
+# 播放记录：是否记录最近播放时间和次数，以及记录写回磁盘的最长延迟（秒）
+PLAY_TRACKING = True
+PLAY_HISTORY_FLUSH_INTERVAL = 5
+
+# 音乐库占用磁盘的上限（字节），None 表示不限制；可用环境变量 BILIBILI_MUSIC_LIBRARY_BUDGET_MB 设置
+# 超出时在后台按最近播放时间淘汰最久未播放的曲目，只删除本地文件，元数据保留以便重新下载
+LIBRARY_SIZE_BUDGET = _positive_env('BILIBILI_MUSIC_LIBRARY_BUDGET_MB', 1024 * 1024)
+
+# 下载的内容与已有文件相同时，把新文件换成已有文件的硬链接，共用磁盘空间
+DEDUP_HARDLINK = True
+
+# 数据文件使用的 JSON 库：orjson、msgspec 或 json，None 表示自动选择已安装的最快者
+JSON_BACKEND = os.environ.get('BILIBILI_MUSIC_JSON_BACKEND') or None
+
+# 音乐库和收藏夹缓存在紧凑 JSON 之外再保存一份二进制快照（.snapshot），冷启动加载更快；
+# 快照无法读取（如升级了 Python）时读取 JSON
+USE_BINARY_SNAPSHOTS = True
+
+# 分页浏览收藏夹时保留在内存中的收藏夹数，其余收藏夹的视频列表用到时才从磁盘读取
+FAVORITES_CACHED_FOLDERS = 4
+
+# 曲目信息的保存方式：sidecar 为音频旁的 json 和封面文件；tags 为写入音频文件自身的标签（需要 mutagen），
+# 可用环境变量 BILIBILI_MUSIC_METADATA_STORAGE 设置，已有曲目用 `python cli.py migrate-tags` 转换
+METADATA_STORAGE = os.environ.get('BILIBILI_MUSIC_METADATA_STORAGE') or 'sidecar'
+
+# 从音频标签重建音乐库时同时读取的文件数
+TAG_READ_WORKERS = 8
+
+# 下载目录布局：flat 为全部放在下载目录下；sharded 为按 BV 号分到 256 个子目录、文件名带 BV 号和 cid。
+# 可用环境变量 BILIBILI_MUSIC_LIBRARY_LAYOUT 设置；已有曲目不会自动移动，用 `python cli.py migrate-layout` 迁移
+LIBRARY_LAYOUT = os.environ.get('BILIBILI_MUSIC_LIBRARY_LAYOUT') or 'flat'
+
+# 布局迁移时每移动多少首曲目保存一次音乐库，中断后从未保存的部分继续
+LAYOUT_MIGRATION_BATCH = 200
+
 # 媒体服务器端口
-MEDIA_SERVER_PORT = 8765
\ No newline at end of file
+MEDIA_SERVER_PORT = 8765
+
+# 带宽调度：所有音频和封面下载共享的总速率上限（字节/秒），None 表示不限制；
+# 可用环境变量 BILIBILI_MUSIC_BANDWIDTH_LIMIT_KB（KB/s，0 为不限制）设置
+BANDWIDTH_LIMIT = _positive_env('BILIBILI_MUSIC_BANDWIDTH_LIMIT_KB', 1024, zero_unlimited=True)
+# 各类流量同时活跃时按权重分配总速率：界面发起的下载、批量/无人值守的同步和镜像、封面、播放队列预取
+BANDWIDTH_SHARES = {'foreground': 8, 'mirror': 3, 'cover': 1, 'prefetch': 2}
+# 从 CDN 边下边播时让出带宽：后台类流量（除 foreground 以外）的权重乘以该系数，总上限中为播放预留一部分，
+# 并且后台类流量合计不超过 BANDWIDTH_PLAYBACK_BACKGROUND_RATE
+BANDWIDTH_PLAYBACK_FACTOR = 0.1
+BANDWIDTH_PLAYBACK_RESERVE = 512 * 1024
+BANDWIDTH_PLAYBACK_BACKGROUND_RATE = 1024 * 1024
+# 按时段调整上限，如 "01:00-07:00=0,09:00-18:00=512" 表示凌晨不限速、白天 512KB/s（0 为不限制），时段可跨午夜；
+# 可用环境变量 BILIBILI_MUSIC_BANDWIDTH_SCHEDULE 设置
+BANDWIDTH_SCHEDULE = os.environ.get('BILIBILI_MUSIC_BANDWIDTH_SCHEDULE') or ''
+
+# 播放队列预取：前端告知接下来要播放的曲目（默认 3 首），媒体服务器预读本地文件、缓存封面和曲目开头，
+# 未下载的曲目提前解析播放地址并缓存开头的音频，切歌时不必等待磁盘或网络
+PREFETCH_QUEUE_LENGTH = 3
+# 内存中缓存的封面和曲目开头的总大小上限（字节），超出时淘汰最久未使用的
+MEDIA_CACHE_BYTES = 64 * 1024 * 1024
+# 每首预取曲目缓存开头多少秒的音频，按文件大小和时长换算为字节数
+PREFETCH_HEAD_SECONDS = 15
+# 预解析的播放地址的有效期（秒），B站音频地址签发后约两小时失效，这里留足余量
+PLAYURL_TTL = 30 * 60
\ No newline at end of file
@@ -0,0 +1,194 @@
+# File: core/cover_archive.py
+# 封面归档：所有封面追加写入同一个 pack 文件，索引记录每张封面的偏移、长度和类型，按内容哈希寻址；
+# 读取时整个 pack 通过 mmap 映射，媒体服务器按切片返回封面，不再为每张封面打开、stat 一个小文件
+import hashlib
+import mmap
+import os
+import threading
+import time
+from pathlib import Path
+
+from core.config import COVER_ARCHIVE_DIR
+from core.log import log_event
+from core.metrics import COVER_ARCHIVE_BYTES
+from core.serialization import read_json, write_json
+
+# 归档封面在曲目记录中的 cover_path：前缀加内容哈希和扩展名
+ARCHIVE_PREFIX = 'pack:'
+INDEX_NAME = 'index.json'
+
+MIMETYPES = {'.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png', '.webp': 'image/webp',
+             '.gif': 'image/gif'}
+
+
+def is_archived(cover_path):
+    return bool(cover_path) and str(cover_path).startswith(ARCHIVE_PREFIX)
+
+
+def archive_key(cover_path):
+    """从 cover_path（或媒体服务器 URL 中的 哈希.扩展名）取出内容哈希"""
+    name = str(cover_path)
+    if name.startswith(ARCHIVE_PREFIX):
+        name = name[len(ARCHIVE_PREFIX):]
+    return os.path.splitext(name)[0]
+
+
+class CoverArchive:
+    """追加写入的封面 pack 文件和它的索引
+
+    - 同一内容只保存一次（多P投稿共用封面、重复下载的封面）
+    - 删除曲目不改动 pack，compact 时只保留仍被引用的封面，写入新的 pack 后切换索引，中途退出不会损坏旧数据
+    - 索引和 pack 在第一次使用时才加载
+    """
+
+    def __init__(self, directory=None):
+        self.directory = Path(directory or COVER_ARCHIVE_DIR)
+        self.index_file = self.directory / INDEX_NAME
+        self._lock = threading.Lock()
+        self._entries = None
+        self._pack = None
+        self._garbage = 0
+        self._map = None
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        self._entries = {}
+        self._pack = 'covers-1.pack'
+        if self.index_file.exists():
+            try:
+                data = read_json(self.index_file)
+                self._pack = data['pack']
+                self._entries = data['entries']
+                self._garbage = data.get('garbage', 0)
+            except Exception as e:
+                print(f"加载封面归档索引失败: {e}")
+        # 写入 pack 后、保存索引前退出时，pack 末尾多出的数据不在索引中，compact 时回收
+        size = self._pack_size()
+        for key in [key for key, entry in self._entries.items() if entry['offset'] + entry['length'] > size]:
+            del self._entries[key]
+        self._publish()
+
+    def _pack_path(self):
+        return self.directory / self._pack
+
+    def _pack_size(self):
+        try:
+            return os.path.getsize(self._pack_path())
+        except OSError:
+            return 0
+
+    def _save(self):
+        write_json(self.index_file, {'pack': self._pack, 'entries': self._entries, 'garbage': self._garbage})
+
+    def _publish(self):
+        live = sum(entry['length'] for entry in self._entries.values())
+        COVER_ARCHIVE_BYTES.set(live, state='live')
+        COVER_ARCHIVE_BYTES.set(max(self._pack_size() - live, 0), state='garbage')
+
+    def _mapping(self, end):
+        """覆盖到 end 字节的只读映射；pack 追加后重新映射（旧映射在没有引用后自动释放）"""
+        if self._map is None or len(self._map) < end:
+            with open(self._pack_path(), 'rb') as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def __len__(self):
+        with self._lock:
+            self._load()
+            return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            self._load()
+            return archive_key(key) in self._entries
+
+    def put(self, data, mimetype=None, ext=None, save=True):
+        """保存一张封面，返回可以存入曲目记录的 cover_path（pack:哈希.扩展名）；内容已存在时不再写入"""
+        key = hashlib.sha256(data).hexdigest()
+        ext = ext or next((suffix for suffix, value in MIMETYPES.items() if value == mimetype), '.jpg')
+        mimetype = mimetype or MIMETYPES.get(ext, 'image/jpeg')
+        with self._lock:
+            self._load()
+            if key not in self._entries:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                with open(self._pack_path(), 'ab') as f:
+                    offset = f.tell()
+                    f.write(data)
+                self._entries[key] = {'offset': offset, 'length': len(data), 'mimetype': mimetype}
+                if save:
+                    self._save()
+                    self._publish()
+        return f"{ARCHIVE_PREFIX}{key}{ext}"
+
+    def save(self):
+        with self._lock:
+            if self._entries is not None:
+                self._save()
+                self._publish()
+
+    def get(self, key):
+        """按 cover_path 或内容哈希读取封面，返回 (数据, mimetype)，不存在时返回 None"""
+        key = archive_key(key)
+        with self._lock:
+            self._load()
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            offset, length = entry['offset'], entry['length']
+            mapping = self._mapping(offset + length)
+        return mapping[offset:offset + length], entry['mimetype']
+
+    def compact(self, live_keys, keep_from=None):
+        """只保留 live_keys 中的封面，写入新的 pack 后切换索引并删除旧 pack；返回统计信息
+
+        keep_from 为收集 live_keys 之前的 pack 大小：之后写入的封面可能属于尚未记入音乐库的下载，一律保留。
+        """
+        start = time.perf_counter()
+        live_keys = {archive_key(key) for key in live_keys}
+        with self._lock:
+            self._load()
+            old_pack = self._pack_path()
+            old_size = self._pack_size()
+            kept = {key: entry for key, entry in self._entries.items()
+                    if key in live_keys or (keep_from is not None and entry['offset'] >= keep_from)}
+            number = int(self._pack.split('-')[1].split('.')[0]) + 1
+            new_pack = f"covers-{number}.pack"
+            entries = {}
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with open(self.directory / new_pack, 'wb') as out:
+                if kept:
+                    mapping = self._mapping(max(entry['offset'] + entry['length'] for entry in kept.values()))
+                    for key, entry in sorted(kept.items(), key=lambda item: item[1]['offset']):
+                        entries[key] = dict(entry, offset=out.tell())
+                        out.write(mapping[entry['offset']:entry['offset'] + entry['length']])
+                out.flush()
+                os.fsync(out.fileno())
+            removed = len(self._entries) - len(kept)
+            # 先切换索引，再删除旧 pack；释放旧映射后 Windows 上才能删除
+            self._pack, self._entries, self._garbage = new_pack, entries, 0
+            self._save()
+            self._map = None
+            try:
+                old_pack.unlink(missing_ok=True)
+            except OSError as e:
+                print(f"删除旧的封面归档失败 {old_pack}: {e}")
+            new_size = self._pack_size()
+            self._publish()
+        duration = time.perf_counter() - start
+        log_event('cover_archive_compact', kept=len(entries), removed=removed, reclaimed=old_size - new_size,
+                  duration_ms=round(duration * 1000, 3))
+        return {'kept': len(entries), 'removed': removed, 'reclaimed_bytes': old_size - new_size,
+                'size': new_size, 'seconds': round(duration, 3)}
+
+    def status(self):
+        with self._lock:
+            self._load()
+            live = sum(entry['length'] for entry in self._entries.values())
+            size = self._pack_size()
+            return {'covers': len(self._entries), 'pack': str(self._pack_path()), 'size': size,
+                    'live_bytes': live, 'garbage_bytes': max(size - live, 0)}
+
+
+# 进程内共享的封面归档，下载服务、媒体服务器与 Api 共用
+COVER_ARCHIVE = CoverArchive()
@@ -0,0 +1,312 @@
+# File: core/http.py
+# 统一的 HTTP 传输层：所有服务共享一个带连接池的 Session，并统计每个请求的耗时
+import socket
+import threading
+import time
+from collections import defaultdict, deque
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from core.config import API_RATE_LIMIT, ASYNC_HTTP, DEFAULT_HEADERS, HTTP_POOL_CONFIG
+from core.metrics import observe_http_request
+
+# 当前线程正在进行的请求的计时记录，由连接类在建立新连接时写入
+_current = threading.local()
+
+
+def _current_record():
+    return getattr(_current, 'record', None)
+
+
+class _TimedConnectionMixin:
+    """建立新连接时分别记录 DNS 解析和 TCP 连接耗时"""
+
+    def _new_conn(self):
+        record = _current_record()
+        host = self._dns_host
+        start = time.perf_counter()
+        address = None
+        try:
+            address = socket.getaddrinfo(host, self.port, 0, socket.SOCK_STREAM)[0][4][0]
+        except OSError:
+            pass
+        resolved = time.perf_counter()
+
+        # 用解析好的地址建立连接，TLS 的 SNI 和证书校验仍然使用 self.host
+        if address:
+            self._dns_host = address
+        try:
+            sock = super()._new_conn()
+        except Exception:
+            if not address:
+                raise
+            # 第一个地址连接失败时交回 urllib3 自己解析，以便尝试其他地址
+            self._dns_host = host
+            sock = super()._new_conn()
+        finally:
+            self._dns_host = host
+
+        if record is not None:
+            record['new_connection'] = True
+            record['dns'] += resolved - start
+            record['connect'] += time.perf_counter() - resolved
+        return sock
+
+
+class TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+
+    def connect(self):
+        record = _current_record()
+        if record is None:
+            return super().connect()
+        before = record['dns'] + record['connect']
+        start = time.perf_counter()
+        super().connect()
+        # 整个 connect 减去 DNS 和 TCP 的部分即为 TLS 握手耗时
+        record['tls'] += max(0.0, time.perf_counter() - start - (record['dns'] + record['connect'] - before))
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """使用计时连接类的适配器，send 返回时响应头已到达，据此计算首字节时间"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool,
+        }
+
+    def send(self, request, **kwargs):
+        record = _current_record()
+        response = super().send(request, **kwargs)
+        if record is not None:
+            record['ttfb'] = time.perf_counter() - record['start']
+        return response
+
+
+class TransportStats:
+    """按主机汇总请求耗时和连接复用情况"""
+
+    FIELDS = ('dns', 'connect', 'tls', 'ttfb', 'transfer', 'total')
+
+    def __init__(self, recent_size=200):
+        self._lock = threading.Lock()
+        self._hosts = defaultdict(self._empty)
+        self.recent = deque(maxlen=recent_size)
+        self._observers = []
+
+    @classmethod
+    def _empty(cls):
+        data = {field: 0.0 for field in cls.FIELDS}
+        data.update({'requests': 0, 'new_connections': 0, 'errors': 0, 'bytes': 0, 'http2': 0})
+        return data
+
+    def add_observer(self, callback):
+        """注册观察者，每个请求结束时调用 callback(record)"""
+        self._observers.append(callback)
+
+    def record(self, record):
+        with self._lock:
+            host = self._hosts[record['host']]
+            host['requests'] += 1
+            host['bytes'] += record['bytes']
+            if record['new_connection']:
+                host['new_connections'] += 1
+            if record['error']:
+                host['errors'] += 1
+            if record.get('http_version') == 'HTTP/2':
+                host['http2'] += 1
+            for field in self.FIELDS:
+                host[field] += record[field]
+            self.recent.append(record)
+        for observer in list(self._observers):
+            try:
+                observer(record)
+            except Exception as e:
+                print(f"请求统计观察者执行失败: {e}")
+
+    def snapshot(self):
+        """返回每个主机的请求数、连接复用率和各阶段平均耗时（毫秒）"""
+        with self._lock:
+            result = {}
+            for host, data in self._hosts.items():
+                count = data['requests'] or 1
+                result[host] = {
+                    'requests': data['requests'],
+                    'errors': data['errors'],
+                    'bytes': data['bytes'],
+                    'new_connections': data['new_connections'],
+                    'reused_connections': data['requests'] - data['new_connections'],
+                    'reuse_ratio': round(1 - data['new_connections'] / count, 3),
+                    'http2_requests': data['http2'],
+                    'avg_ms': {field: round(data[field] / count * 1000, 2) for field in self.FIELDS},
+                }
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._hosts.clear()
+            self.recent.clear()
+
+
+class InstrumentedSession(requests.Session):
+    """记录每个请求各阶段耗时的 Session，流式响应在关闭时才结束计时"""
+
+    def __init__(self, stats):
+        super().__init__()
+        self.stats = stats
+
+    def request(self, method, url, *args, **kwargs):
+        record = {
+            'method': method.upper(),
+            'host': urlparse(url).netloc,
+            'path': urlparse(url).path,
+            'status': None,
+            'new_connection': False,
+            'error': False,
+            'bytes': 0,
+            'dns': 0.0, 'connect': 0.0, 'tls': 0.0, 'ttfb': 0.0, 'transfer': 0.0, 'total': 0.0,
+            'start': time.perf_counter(),
+        }
+        previous = _current_record()
+        _current.record = record
+        try:
+            response = super().request(method, url, *args, **kwargs)
+        except Exception:
+            record['error'] = True
+            self._finish(record)
+            raise
+        finally:
+            _current.record = previous
+
+        record['status'] = response.status_code
+        record['error'] = response.status_code >= 400
+        if kwargs.get('stream'):
+            # 流式下载：等调用方读完并关闭响应后再统计传输耗时
+            original_close = response.close
+
+            def close():
+                if record['total'] == 0.0:
+                    record['bytes'] = response.raw.tell() if response.raw is not None else 0
+                    self._finish(record)
+                original_close()
+
+            response.close = close
+        else:
+            record['bytes'] = len(response.content or b'')
+            self._finish(record)
+        return response
+
+    def _finish(self, record):
+        record['total'] = time.perf_counter() - record['start']
+        if record['ttfb']:
+            record['transfer'] = record['total'] - record['ttfb']
+        self.stats.record(record)
+
+
+class RateLimiter:
+    """令牌桶限速器，多个线程共享同一个速率"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or rate
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """尝试取得一个令牌，不阻塞：取到时返回 0，否则返回大约还需等待的秒数（异步调用方自行等待后重试）"""
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """取得一个令牌，必要时阻塞等待；返回等待的秒数"""
+        waited = 0.0
+        while True:
+            delay = self.reserve()
+            if not delay:
+                return waited
+            time.sleep(delay)
+            waited += delay
+
+
+class HttpTransport:
+    """共享的 HTTP 传输层：按主机配置连接池大小，预置请求头，收集请求统计"""
+
+    def __init__(self, pool_config=None, headers=None, rate_limit=None):
+        pool_config = pool_config or HTTP_POOL_CONFIG
+        rate_limit = rate_limit or API_RATE_LIMIT
+        # 访问 API 接口前取令牌，CDN 下载不受限
+        self.api_limiter = RateLimiter(rate_limit['rate'], rate_limit.get('burst'))
+        self.stats = TransportStats()
+        self.stats.add_observer(observe_http_request)
+        self.session = InstrumentedSession(self.stats)
+        self.session.headers.update(headers or DEFAULT_HEADERS)
+
+        hosts = pool_config.get('hosts', {})
+        default_size = pool_config.get('default', 16)
+        default_adapter = TimedHTTPAdapter(pool_connections=max(len(hosts), 10), pool_maxsize=default_size)
+        self.session.mount('https://', default_adapter)
+        self.session.mount('http://', default_adapter)
+        # requests 按最长前缀匹配适配器，单独配置的主机使用各自的连接池大小
+        for prefix, size in hosts.items():
+            self.session.mount(prefix, TimedHTTPAdapter(pool_connections=1, pool_maxsize=size))
+        self._engine = None
+        self._engine_lock = threading.Lock()
+
+    def async_engine(self):
+        """与本传输层共用 Cookie、限速和请求统计的异步引擎，第一次调用时启动；未安装 httpx 或已关闭时返回 None"""
+        if not ASYNC_HTTP:
+            return None
+        from core.async_http import HAS_HTTPX, AsyncEngine
+        if not HAS_HTTPX:
+            return None
+        if self._engine is None:
+            with self._engine_lock:
+                if self._engine is None:
+                    self._engine = AsyncEngine(self)
+        return self._engine
+
+    def get(self, url, **kwargs):
+        return self.session.get(url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.session.post(url, **kwargs)
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    """获取进程内共享的传输层实例"""
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = HttpTransport()
+    return _transport
@@ -0,0 +1,106 @@
+# File: core/log.py
+# 结构化日志：每行一个 JSON 对象，自动带上当前任务/调用的关联ID
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40}
+
+_correlation_id = contextvars.ContextVar('correlation_id', default=None)
+
+
+def get_correlation_id():
+    return _correlation_id.get()
+
+
+@contextmanager
+def correlation_scope(correlation_id=None):
+    """在代码块内设置关联ID；已处于某个关联ID中且未指定新ID时沿用外层的"""
+    if correlation_id is None and _correlation_id.get() is not None:
+        yield _correlation_id.get()
+        return
+    token = _correlation_id.set(correlation_id or uuid.uuid4().hex[:12])
+    try:
+        yield _correlation_id.get()
+    finally:
+        _correlation_id.reset(token)
+
+
+class JsonLogger:
+    """把事件写成 JSON 行，文件超过 max_bytes 时轮转一次"""
+
+    def __init__(self, path=None, level='info', stream=None, max_bytes=10 * 1024 * 1024):
+        self.path = path
+        self.level = LEVELS.get(level, 20)
+        self.stream = stream
+        self.max_bytes = max_bytes
+        self._file = None
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def log(self, event, level='info', **fields):
+        if LEVELS.get(level, 20) < self.level:
+            return
+        record = {
+            'ts': round(time.time(), 6),
+            'level': level,
+            'event': event,
+            'cid': _correlation_id.get(),
+            'thread': threading.current_thread().name,
+        }
+        record.update(fields)
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            if self.stream is not None:
+                self.stream.write(line + '\n')
+                self.stream.flush()
+            if self.path is not None:
+                try:
+                    self._write_file(line)
+                except OSError:
+                    pass
+
+    def _write_file(self, line):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._file = open(self.path, 'a', encoding='utf-8', buffering=1)
+        self._file.write(line + '\n')
+        self._writes += 1
+        if self._writes % 1000 == 0 and self._file.tell() > self.max_bytes:
+            self._file.close()
+            os.replace(self.path, f"{self.path}.1")
+            self._file = None
+
+
+_logger = None
+_logger_lock = threading.Lock()
+
+
+def configure(path=None, level=None, stream=None):
+    """配置全局日志；未指定 path 时写入 DATA_DIR/logs/events.jsonl"""
+    global _logger
+    if path is None:
+        from core.config import DATA_DIR
+        path = str(DATA_DIR / "logs" / "events.jsonl")
+    level = level or os.environ.get('BILIBILI_MUSIC_LOG_LEVEL', 'info')
+    if stream is None and os.environ.get('BILIBILI_MUSIC_LOG_STDOUT'):
+        stream = sys.stdout
+    with _logger_lock:
+        _logger = JsonLogger(path, level, stream)
+    return _logger
+
+
+def get_logger():
+    if _logger is None:
+        configure()
+    return _logger
+
+
+def log_event(event, level='info', **fields):
+    """记录一条结构化日志"""
+    get_logger().log(event, level, **fields)
@@ -0,0 +1,150 @@
+# File: core/media_cache.py
+# 媒体服务器的内存缓存：封面的完整内容、即将播放的曲目开头部分，以及未下载曲目预解析的播放地址
+# 由播放队列预取（backend/services/prefetch.py）填充，媒体服务器（app/server.py）读取
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from core.config import MEDIA_CACHE_BYTES
+from core.metrics import MEDIA_CACHE_REQUESTS, MEDIA_CACHE_SIZE
+
+READ_CHUNK_SIZE = 256 * 1024
+
+
+def advise_willneed(path, offset=0, length=0):
+    """提示内核预读文件（posix_fadvise WILLNEED），不支持的平台上什么也不做；返回是否已提示"""
+    if not hasattr(os, 'posix_fadvise'):
+        return False
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return False
+    try:
+        os.posix_fadvise(fd, offset, length, os.POSIX_FADV_WILLNEED)
+        return True
+    except OSError:
+        return False
+    finally:
+        os.close(fd)
+
+
+class MediaCache:
+    """按 key 缓存文件内容（完整内容或开头部分），总大小不超过 max_bytes，超出时淘汰最久未使用的条目
+
+    每个条目记录来源文件的大小和修改时间，文件变化后不再命中。未下载的曲目另外记录播放地址
+    （stream），其开头部分的音频同样计入缓存大小。
+    """
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes or MEDIA_CACHE_BYTES
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._streams = {}
+
+    def _store(self, key, entry):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old['data'])
+            if len(entry['data']) > self.max_bytes:
+                MEDIA_CACHE_SIZE.set(self._bytes)
+                return
+            self._entries[key] = entry
+            self._bytes += len(entry['data'])
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted['data'])
+            MEDIA_CACHE_SIZE.set(self._bytes)
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def discard(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= len(entry['data'])
+                MEDIA_CACHE_SIZE.set(self._bytes)
+
+    def put(self, key, data, path, mimetype=None):
+        """缓存 data，以 path 当前的大小和修改时间作为有效性依据"""
+        stat = os.stat(path)
+        self._store(key, {'data': data, 'size': stat.st_size, 'mtime': stat.st_mtime, 'mimetype': mimetype})
+
+    def get(self, key, path, kind='file'):
+        """返回 {'data', 'size', 'mtime', 'mimetype'}；未缓存或 path 已变化时返回 None"""
+        entry = self._lookup(key)
+        if entry is not None:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                stat = None
+            if stat is None or stat.st_size != entry['size'] or stat.st_mtime != entry['mtime']:
+                self.discard(key)
+                entry = None
+        MEDIA_CACHE_REQUESTS.inc(kind=kind, result='hit' if entry is not None else 'miss')
+        return entry
+
+    def load_file(self, path, head_bytes=None):
+        """读取文件开头 head_bytes 字节（None 为整个文件）放入缓存，其余部分提示内核预读；返回缓存的字节数
+
+        以文件的真实路径为 key，与媒体服务器解析出的路径一致。
+        """
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        length = stat.st_size if head_bytes is None else min(head_bytes, stat.st_size)
+        entry = self._lookup(path)
+        if entry is None or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime \
+                or len(entry['data']) < length:
+            with open(path, 'rb') as f:
+                data = f.read(length)
+            entry = {'data': data, 'size': stat.st_size, 'mtime': stat.st_mtime, 'mimetype': None}
+            self._store(path, entry)
+        if len(entry['data']) < stat.st_size:
+            advise_willneed(path, len(entry['data']))
+        return len(entry['data'])
+
+    def put_stream(self, key, url, head, size, mimetype, session, ttl):
+        """记录未下载曲目的播放地址和已取回的开头部分，ttl 秒后失效"""
+        with self._lock:
+            self._streams[key] = {'url': url, 'size': size, 'mimetype': mimetype, 'session': session,
+                                  'expires': time.time() + ttl}
+        self._store(('stream', key), {'data': head, 'size': size, 'mtime': None, 'mimetype': mimetype})
+
+    def get_stream(self, key):
+        """返回 {'url', 'size', 'mimetype', 'session', 'head'}，没有或已过期时返回 None"""
+        with self._lock:
+            stream = self._streams.get(key)
+            if stream is not None and stream['expires'] <= time.time():
+                del self._streams[key]
+                stream = None
+        if stream is None:
+            self.discard(('stream', key))
+            return None
+        entry = self._lookup(('stream', key))
+        MEDIA_CACHE_REQUESTS.inc(kind='stream', result='hit' if entry is not None else 'miss')
+        return dict(stream, head=entry['data'] if entry is not None else b'')
+
+    def drop_stream(self, key):
+        with self._lock:
+            self._streams.pop(key, None)
+        self.discard(('stream', key))
+
+    def status(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'streams': len(self._streams),
+            }
+
+
+# 进程内共享的缓存，媒体服务器与 Api 在同一进程中运行
+MEDIA_CACHE = MediaCache()
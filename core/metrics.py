@@ -0,0 +1,298 @@
+# File: core/metrics.py
+# 轻量级指标：计数器、直方图、仪表盘，可输出 Prometheus 文本格式
+# 每次记录只是一次加锁的字典更新，可以常开
+import bisect
+import contextvars
+import functools
+import inspect
+import threading
+import time
+
+from core.log import correlation_scope, log_event
+from core.profiling import PROFILER
+
+# 默认的耗时直方图分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, '')) for name in labelnames)
+
+
+def _format_labels(labelnames, key, extra=None):
+    pairs = list(zip(labelnames, key))
+    if extra:
+        pairs.extend(extra)
+    if not pairs:
+        return ''
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        escaped.append(f'{name}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+    def snapshot(self):
+        with self._lock:
+            return {','.join(key) or '': value for key, value in self._values.items()}
+
+
+class Counter(_Metric):
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type_name = 'gauge'
+
+    def set(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            data['counts'][index] += 1
+            data['sum'] += value
+            data['count'] += 1
+
+    def time(self, **labels):
+        """上下文管理器，记录代码块的耗时"""
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        with self._lock:
+            items = [(key, dict(data, counts=list(data['counts']))) for key, data in self._values.items()]
+        for key, data in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), data['counts']):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(float(bound)))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(data["sum"])}')
+            lines.append(f'{self.name}_count{labels} {data["count"]}')
+        return lines
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                ','.join(key) or '': {'count': data['count'], 'sum': round(data['sum'], 6)}
+                for key, data in self._values.items()
+            }
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class MetricsRegistry:
+    """指标注册表，同名指标只创建一次"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render_prometheus(self):
+        """输出 Prometheus 文本格式"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """以字典形式返回所有指标，供前端或命令行查看"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+
+REGISTRY = MetricsRegistry()
+
+# ---- 各模块共用的指标 ----
+API_CALLS = REGISTRY.counter('bilibili_music_api_calls_total', 'Api 方法调用次数', ('method', 'status'))
+API_DURATION = REGISTRY.histogram('bilibili_music_api_call_duration_seconds', 'Api 方法耗时', ('method',))
+JOBS = REGISTRY.counter('bilibili_music_jobs_total', '后台任务完成数', ('kind', 'status'))
+JOB_DURATION = REGISTRY.histogram('bilibili_music_job_duration_seconds', '后台任务耗时', ('kind',))
+JOB_QUEUE_DEPTH = REGISTRY.gauge('bilibili_music_job_queue_depth', '等待或正在执行的后台任务数', ('state',))
+HTTP_REQUESTS = REGISTRY.counter('bilibili_music_http_requests_total', '对外 HTTP 请求数', ('endpoint', 'status'))
+HTTP_DURATION = REGISTRY.histogram('bilibili_music_http_request_duration_seconds', '对外 HTTP 请求各阶段耗时',
+                                   ('endpoint', 'phase'))
+HTTP_NEW_CONNECTIONS = REGISTRY.counter('bilibili_music_http_new_connections_total', '新建的 HTTP 连接数', ('endpoint',))
+DOWNLOAD_BYTES = REGISTRY.counter('bilibili_music_download_bytes_total', '已下载的音频字节数')
+DOWNLOAD_SPEED = REGISTRY.histogram('bilibili_music_download_speed_bytes_per_second', '单个音频的下载速度（字节/秒）',
+                                    buckets=(64e3, 256e3, 512e3, 1e6, 2e6, 4e6, 8e6, 16e6, 32e6))
+LIBRARY_TRACKS = REGISTRY.gauge('bilibili_music_library_tracks', '音乐库中的曲目数')
+LIBRARY_BYTES = REGISTRY.gauge('bilibili_music_library_bytes', '音乐库本地文件占用的磁盘空间（磁盘预算统计口径）')
+LIBRARY_EVICTIONS = REGISTRY.counter('bilibili_music_library_evictions_total', '超出磁盘预算被移除本地文件的曲目数')
+LIBRARY_SCAN_DURATION = REGISTRY.histogram('bilibili_music_library_scan_duration_seconds', '扫描下载目录的耗时')
+SYNC_RUNS = REGISTRY.counter('bilibili_music_sync_runs_total', '无界面模式的收藏夹同步次数', ('status',))
+SYNC_LAST_SUCCESS = REGISTRY.gauge('bilibili_music_sync_last_success_timestamp_seconds', '最近一次同步成功的时间')
+MEDIA_CACHE_REQUESTS = REGISTRY.counter('bilibili_music_media_cache_requests_total', '媒体服务器请求是否命中内存缓存',
+                                        ('kind', 'result'))
+MEDIA_CACHE_SIZE = REGISTRY.gauge('bilibili_music_media_cache_bytes', '媒体服务器内存缓存占用的字节数')
+BANDWIDTH_LIMIT_RATE = REGISTRY.gauge('bilibili_music_bandwidth_limit_bytes_per_second', '当前生效的总速率上限，0 表示不限制')
+BANDWIDTH_ALLOCATION = REGISTRY.gauge('bilibili_music_bandwidth_allocation_bytes_per_second',
+                                      '各类流量当前分到的速率，-1 表示不限制，0 表示没有传输', ('traffic_class',))
+BANDWIDTH_BYTES = REGISTRY.counter('bilibili_music_bandwidth_bytes_total', '各类流量已传输的字节数', ('traffic_class',))
+BANDWIDTH_WAIT = REGISTRY.counter('bilibili_music_bandwidth_wait_seconds_total', '各类流量因限速等待的时间',
+                                  ('traffic_class',))
+PLAYBACK_STREAMS = REGISTRY.gauge('bilibili_music_playback_streams', '正在从 CDN 边下边播的请求数')
+VERIFY_FILES = REGISTRY.counter('bilibili_music_verify_files_total', '校验音乐库时检查的文件数', ('result',))
+COVER_ARCHIVE_BYTES = REGISTRY.gauge('bilibili_music_cover_archive_bytes', '封面归档中仍被引用（live）和可回收（garbage）的字节数',
+                                     ('state',))
+
+
+def endpoint_class(host, path):
+    """把请求地址归类为有限的接口类别，避免指标标签无限增长"""
+    if path.startswith('/x/web-interface/nav'):
+        return 'nav'
+    if path.startswith('/x/web-interface/view'):
+        return 'view'
+    if path.startswith('/x/v3/fav/folder'):
+        return 'fav_folders'
+    if path.startswith('/x/v3/fav/resource'):
+        return 'fav_resources'
+    if 'playurl' in path:
+        return 'playurl'
+    if path.startswith('/x/passport-login') or 'passport' in host:
+        return 'passport'
+    if path.endswith('.m4s') or 'bilivideo' in host or path.startswith('/cdn/audio'):
+        return 'cdn_audio'
+    if path.endswith(('.jpg', '.jpeg', '.png', '.webp')) or 'hdslb' in host:
+        return 'cover'
+    return 'other'
+
+
+def observe_http_request(record):
+    """HttpTransport 的请求观察者，把每个请求的耗时记入指标"""
+    endpoint = endpoint_class(record['host'], record['path'])
+    HTTP_REQUESTS.inc(endpoint=endpoint, status=record['status'] or 'error')
+    if record['new_connection']:
+        HTTP_NEW_CONNECTIONS.inc(endpoint=endpoint)
+    for phase in ('dns', 'connect', 'tls', 'ttfb', 'transfer', 'total'):
+        if record[phase]:
+            HTTP_DURATION.observe(record[phase], endpoint=endpoint, phase=phase)
+
+
+# 标记当前是否已处于被统计的方法调用中，内部互相调用时不重复统计
+_in_instrumented_call = contextvars.ContextVar('in_instrumented_call', default=False)
+
+
+def instrument_methods(cls):
+    """类装饰器：为所有公开方法记录调用次数与耗时"""
+    for name, func in list(vars(cls).items()):
+        if name.startswith('_') or not callable(func):
+            continue
+        setattr(cls, name, _instrument(name, func))
+    return cls
+
+
+def _instrument(name, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _in_instrumented_call.get():
+            return func(*args, **kwargs)
+        token = _in_instrumented_call.set(True)
+        start = time.perf_counter()
+        status = 'ok'
+        with correlation_scope():
+            try:
+                # 性能采集进行中时，这次调用会被 cProfile 统计
+                result = PROFILER.call(func, *args, **kwargs)
+                if isinstance(result, dict) and result.get('status') == 'error':
+                    status = 'error'
+                return result
+            except Exception:
+                status = 'exception'
+                raise
+            finally:
+                duration = time.perf_counter() - start
+                _in_instrumented_call.reset(token)
+                API_CALLS.inc(method=name, status=status)
+                API_DURATION.observe(duration, method=name)
+                log_event('api_call', method=name, status=status, duration_ms=round(duration * 1000, 3))
+
+    # 保留原方法签名，pywebview 依据签名生成前端调用接口
+    wrapper.__signature__ = inspect.signature(func)
+    return wrapper
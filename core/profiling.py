@@ -0,0 +1,214 @@
+# File: core/profiling.py
+# 运行中按需采集性能数据：定时的 cProfile 采集和覆盖所有线程的低开销栈采样
+# 结果写入 DATA_DIR/profiles，无需重启程序
+import io
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from core.log import log_event
+
+# 可选的采集方式
+PROFILE_MODES = ('all', 'sample', 'cprofile')
+MAX_PROFILE_SECONDS = 600
+
+
+class StackSampler:
+    """定时抓取所有线程的调用栈，按折叠栈（collapsed stacks）格式计数
+
+    每行形如 `线程名;外层函数;...;内层函数 次数`，可直接交给 flamegraph.pl 或 speedscope 生成火焰图。
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.counts = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, f'thread-{ident}'))
+                self.counts[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def write_collapsed(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class Profiler:
+    """管理一次定时采集：期间的 Api 调用和后台任务用 cProfile 统计，同时对所有线程做栈采样"""
+
+    def __init__(self, output_dir=None):
+        self.output_dir = output_dir
+        self._lock = threading.Lock()
+        self._active = None
+        self._last_result = None
+
+    @property
+    def running(self):
+        return self._active is not None
+
+    def start(self, duration=30, mode='all', interval=0.01):
+        """开始采集，duration 秒后自动结束并写出结果"""
+        if mode not in PROFILE_MODES:
+            return {'status': 'error', 'message': f'未知的采集方式: {mode}'}
+        try:
+            duration = float(duration)
+        except (TypeError, ValueError):
+            return {'status': 'error', 'message': f'采集时长无效: {duration}'}
+        if duration != duration:
+            return {'status': 'error', 'message': '采集时长无效: nan'}
+        duration = max(1, min(duration, MAX_PROFILE_SECONDS))
+
+        with self._lock:
+            if self._active is not None:
+                return {'status': 'error', 'message': '已有正在进行的性能采集', 'profile': self._describe(self._active)}
+            session = {
+                'id': time.strftime('%Y%m%d-%H%M%S'),
+                'mode': mode,
+                'duration': duration,
+                'started_at': time.time(),
+                'stats': None,
+                'calls': 0,
+                'skipped_calls': 0,
+                'sampler': StackSampler(interval) if mode in ('all', 'sample') else None,
+            }
+            # 计时器和采样线程在公开 session 之前就绪，同时调用的 stop() 总能取消它们
+            timer = threading.Timer(duration, self.stop)
+            timer.name = 'profile-timer'
+            timer.daemon = True
+            session['timer'] = timer
+            if session['sampler'] is not None:
+                session['sampler'].start()
+            timer.start()
+            self._active = session
+
+        log_event('profile_start', profile_id=session['id'], mode=mode, duration=duration)
+        return {'status': 'ok', 'message': f'开始性能采集，{duration:g} 秒后结束', 'profile': self._describe(session)}
+
+    def stop(self):
+        """结束当前采集并写出结果文件"""
+        with self._lock:
+            session = self._active
+            self._active = None
+        if session is None:
+            return self._last_result or {'status': 'error', 'message': '没有正在进行的性能采集'}
+
+        session['timer'].cancel()
+        if session['sampler'] is not None:
+            session['sampler'].stop()
+
+        try:
+            files = self._write(session)
+        except OSError as e:
+            print(f"写入性能采集结果失败: {e}")
+            self._last_result = {'status': 'error', 'message': f'写入性能采集结果失败: {e}'}
+            return self._last_result
+
+        result = self._describe(session)
+        result['elapsed'] = round(time.time() - session['started_at'], 3)
+        result['files'] = files
+        self._last_result = {'status': 'ok', 'message': '性能采集已完成', 'profile': result}
+        log_event('profile_done', profile_id=session['id'], elapsed=result['elapsed'],
+                  samples=result['samples'], calls=result['calls'], files=files)
+        return self._last_result
+
+    def status(self):
+        session = self._active
+        if session is not None:
+            return {'status': 'running', 'profile': self._describe(session)}
+        return self._last_result or {'status': 'idle'}
+
+    def call(self, func, *args, **kwargs):
+        """执行函数；采集进行中时用 cProfile 统计这次调用并合并到本次结果"""
+        session = self._active
+        if session is None or session['mode'] == 'sample':
+            return func(*args, **kwargs)
+
+        # cProfile/pstats 只在采集时才导入，不拖慢启动
+        import cProfile
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12 起同一时刻只能有一个 cProfile 生效，并发的调用不重复统计
+            session['skipped_calls'] += 1
+            return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+            self._merge(session, profile)
+
+    def _merge(self, session, profile):
+        import pstats
+        with self._lock:
+            if session['stats'] is None:
+                session['stats'] = pstats.Stats(profile)
+            else:
+                session['stats'].add(profile)
+            session['calls'] += 1
+
+    def _write(self, session):
+        output_dir = self.output_dir
+        if output_dir is None:
+            from core.config import DATA_DIR
+            output_dir = DATA_DIR / "profiles"
+        os.makedirs(output_dir, exist_ok=True)
+        base = os.path.join(str(output_dir), session['id'])
+
+        files = {}
+        if session['sampler'] is not None:
+            files['collapsed'] = f"{base}.collapsed"
+            session['sampler'].write_collapsed(files['collapsed'])
+        if session['stats'] is not None:
+            files['pstats'] = f"{base}.prof"
+            session['stats'].dump_stats(files['pstats'])
+            # 同时输出按累计耗时排序的文本摘要，方便直接查看
+            buffer = io.StringIO()
+            session['stats'].stream = buffer
+            session['stats'].sort_stats('cumulative').print_stats(60)
+            files['summary'] = f"{base}.txt"
+            with open(files['summary'], 'w', encoding='utf-8') as f:
+                f.write(buffer.getvalue())
+        return files
+
+    @staticmethod
+    def _describe(session):
+        sampler = session['sampler']
+        return {
+            'id': session['id'],
+            'mode': session['mode'],
+            'duration': session['duration'],
+            'started_at': session['started_at'],
+            'samples': sampler.samples if sampler else 0,
+            'calls': session['calls'],
+            'skipped_calls': session['skipped_calls'],
+        }
+
+
+PROFILER = Profiler()
@@ -0,0 +1,189 @@
+# File: core/serialization.py
+# 持久化文件的序列化：安装了 orjson 或 msgspec 时使用它们，否则使用标准库 json
+# 统一写出紧凑格式，先写临时文件再替换，崩溃时不会留下写了一半的文件；
+# 音乐库和收藏夹缓存这类大文件还可以存为二进制快照，冷启动时加载更快
+import importlib.util
+import json
+import marshal
+import os
+import sys
+import threading
+from pathlib import Path
+
+from core.config import JSON_BACKEND, USE_BINARY_SNAPSHOTS
+
+HAS_ORJSON = importlib.util.find_spec('orjson') is not None
+HAS_MSGSPEC = importlib.util.find_spec('msgspec') is not None
+
+JSON_BACKENDS = ('orjson', 'msgspec', 'json')
+
+# 二进制快照的文件头：魔数 + 格式 + 写入时的 Python 版本（marshal 格式只保证同版本可读）
+SNAPSHOT_MAGIC = b'BMSNAP1'
+SNAPSHOT_SUFFIX = '.snapshot'
+
+
+class SerializationError(ValueError):
+    """文件内容无法解析"""
+
+
+class _JsonCodec:
+    def __init__(self, name, dumps, loads):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+
+def _create_codec(name):
+    # 各后端在第一次读写时才导入，不影响启动
+    if name == 'orjson':
+        import orjson
+        return _JsonCodec('orjson', orjson.dumps, orjson.loads)
+    if name == 'msgspec':
+        import msgspec
+        encoder = msgspec.json.Encoder()
+        return _JsonCodec('msgspec', encoder.encode, msgspec.json.decode)
+    if name == 'json':
+        return _JsonCodec(
+            'json',
+            lambda obj: json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8'),
+            json.loads
+        )
+    raise ValueError(f'未知的 JSON 后端: {name}')
+
+
+_codecs = {}
+
+
+def available_backends():
+    installed = {'orjson': HAS_ORJSON, 'msgspec': HAS_MSGSPEC, 'json': True}
+    return [name for name in JSON_BACKENDS if installed[name]]
+
+
+def get_codec(name=None):
+    """返回指定的 JSON 后端；未指定时使用配置的后端，默认选已安装的最快后端"""
+    name = name or JSON_BACKEND or available_backends()[0]
+    codec = _codecs.get(name)
+    if codec is None:
+        codec = _codecs[name] = _create_codec(name)
+    return codec
+
+
+def dumps(obj, backend=None):
+    """序列化为紧凑的 UTF-8 JSON 字节串"""
+    return get_codec(backend).dumps(obj)
+
+
+def loads(data, backend=None):
+    try:
+        return get_codec(backend).loads(data)
+    except Exception as e:
+        # 各后端的解析异常类型不同，统一转换
+        raise SerializationError(str(e)) from e
+
+
+def atomic_write(path, data):
+    """先写同目录下的临时文件再替换目标文件；临时文件名区分进程和线程，并发保存互不干扰"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def write_json(path, obj, backend=None):
+    atomic_write(path, dumps(obj, backend))
+
+
+def read_json(path, backend=None):
+    with open(path, 'rb') as f:
+        return loads(f.read(), backend)
+
+
+def _snapshot_header(fmt):
+    return SNAPSHOT_MAGIC + fmt + bytes(sys.version_info[:2])
+
+
+def encode_snapshot(obj):
+    """二进制快照：安装了 msgspec 时用 msgpack，否则用标准库 marshal"""
+    if HAS_MSGSPEC:
+        import msgspec
+        return _snapshot_header(b'P') + msgspec.msgpack.encode(obj)
+    return _snapshot_header(b'M') + marshal.dumps(obj)
+
+
+def decode_snapshot(data):
+    header_size = len(SNAPSHOT_MAGIC) + 3
+    if not data.startswith(SNAPSHOT_MAGIC) or len(data) < header_size:
+        raise SerializationError('不是有效的快照文件')
+    fmt = data[len(SNAPSHOT_MAGIC):len(SNAPSHOT_MAGIC) + 1]
+    body = memoryview(data)[header_size:]
+    if fmt == b'P':
+        if not HAS_MSGSPEC:
+            raise SerializationError('读取该快照需要 msgspec')
+        import msgspec
+        try:
+            return msgspec.msgpack.decode(body)
+        except msgspec.DecodeError as e:
+            raise SerializationError(str(e)) from e
+    if fmt == b'M':
+        if data[len(SNAPSHOT_MAGIC) + 1:header_size] != bytes(sys.version_info[:2]):
+            raise SerializationError('快照由其他版本的 Python 写入')
+        try:
+            return marshal.loads(body)
+        except (EOFError, ValueError, TypeError) as e:
+            raise SerializationError(str(e)) from e
+    raise SerializationError(f'未知的快照格式: {fmt!r}')
+
+
+def write_snapshot(path, obj):
+    atomic_write(path, encode_snapshot(obj))
+
+
+def read_snapshot(path):
+    with open(path, 'rb') as f:
+        return decode_snapshot(f.read())
+
+
+def snapshot_path(path):
+    path = Path(path)
+    return path.with_suffix(SNAPSHOT_SUFFIX)
+
+
+def save_document(path, obj, snapshot=None):
+    """保存较大的数据文件：总是写紧凑 JSON，开启快照时再写一份二进制快照（与 path 同名、后缀 .snapshot）
+
+    marshal 快照换了 Python 版本就无法读取，msgpack 快照卸载 msgspec 后也无法读取，
+    这时 load_document 退回读取 JSON，所以 JSON 必须和快照保持一致；先写 JSON，快照的修改时间不早于它。
+    """
+    if snapshot is None:
+        snapshot = USE_BINARY_SNAPSHOTS
+    write_json(path, obj)
+    if snapshot:
+        write_snapshot(snapshot_path(path), obj)
+
+
+def load_document(path, default=None):
+    """读取 save_document 保存的数据：JSON 和快照都存在时读较新的一个，快照无法读取时退回 JSON"""
+    path = Path(path)
+    candidates = []
+    for candidate, reader in ((snapshot_path(path), read_snapshot), (path, read_json)):
+        try:
+            candidates.append((candidate.stat().st_mtime, reader is read_snapshot, candidate, reader))
+        except OSError:
+            continue
+    candidates.sort(reverse=True)
+    if not candidates:
+        return default
+    error = None
+    for _, _, candidate, reader in candidates:
+        try:
+            return reader(candidate)
+        except (OSError, SerializationError) as e:
+            error = e
+            print(f"读取 {candidate} 失败: {e}")
+    raise error
@@ -1,6 +1,5 @@
 # File: core/wbi.py
 # wbi 签名
-import requests
 import time
 from functools import reduce
 from hashlib import md5
@@ -34,21 +33,22 @@ def encWbi(params: dict, img_key: str, sub_key: str):
     params['w_rid'] = wbi_sign
     return params
 
-def getWbiKeys() -> tuple[str, str]:
-    '获取最新的 img_key 和 sub_key'
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3',
-        'Referer': 'https://www.bilibili.com/'
-    }
-    resp = requests.get('https://api.bilibili.com/x/web-interface/nav', headers=headers)
-    resp.raise_for_status()
-    json_content = resp.json()
-    img_url: str = json_content['data']['wbi_img']['img_url']
-    sub_url: str = json_content['data']['wbi_img']['sub_url']
+def extractWbiKeys(nav_json: dict) -> tuple[str, str]:
+    '从 nav 接口的响应中提取 img_key 和 sub_key（未登录时响应中同样包含 wbi_img）'
+    img_url: str = nav_json['data']['wbi_img']['img_url']
+    sub_url: str = nav_json['data']['wbi_img']['sub_url']
     img_key = img_url.rsplit('/', 1)[1].split('.')[0]
     sub_key = sub_url.rsplit('/', 1)[1].split('.')[0]
     return img_key, sub_key
 
+def getWbiKeys() -> tuple[str, str]:
+    '获取最新的 img_key 和 sub_key（服务中应优先使用 AuthService.get_wbi_keys 的缓存结果）'
+    from core.config import API_BASE_URL
+    from core.http import get_transport
+    resp = get_transport().get(f'{API_BASE_URL}/x/web-interface/nav', timeout=10)
+    resp.raise_for_status()
+    return extractWbiKeys(resp.json())
+
 # Example usage:
 # img_key, sub_key = getWbiKeys()
 # signed_params = encWbi(
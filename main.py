@@ -1,30 +1,52 @@
 # File: main.py
+import time
+
+# 启动计时起点，用于记录冷启动到首帧可交互的耗时
+STARTUP_BEGIN = time.perf_counter()
+
 import webview
 import threading
 from app.api import Api
-from app.server import start_media_server
-from core.config import DOWNLOAD_DIR
+from core.config import DOWNLOAD_DIR, MEDIA_SERVER_PORT, ensure_data_dirs
+from core.log import log_event
 import os
 
+
+def log_startup(phase):
+    log_event('startup', phase=phase, elapsed_ms=round((time.perf_counter() - STARTUP_BEGIN) * 1000, 3))
+
+
+def run_media_server():
+    # Flask 在媒体服务器线程中才导入，不占用窗口显示前的时间
+    from app.server import start_media_server
+    start_media_server(DOWNLOAD_DIR, MEDIA_SERVER_PORT)
+
+
 def main():
+    log_startup('imports')
+    ensure_data_dirs()
     api = Api()
     html_path = os.path.abspath(os.path.join(os.path.dirname(__file__), 'frontend', 'dist', 'index.html'))
     window = webview.create_window('Bilibili', html_path, js_api=api, width=1200, height=800)
+    log_startup('window_created')
 
     def on_loaded():
         print("DOM is loaded, notifying frontend that pywebview is ready.")
         window.evaluate_js('window.onPywebviewReady()')
+        # 前端就绪后开始推送后台事件
+        api.attach_window(window)
+        log_startup('first_frame')
 
     window.events.loaded += on_loaded
     
     media_thread = threading.Thread(
-        target=start_media_server, 
-        args=(DOWNLOAD_DIR, 8765), 
+        target=run_media_server,
         daemon=True
     )
     media_thread.start()
     
     webview.start()
+    api._shutdown()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()